@@ -4,29 +4,58 @@
 # Lit listings.db, exporte les donnees en fichiers JS/JSON.
 # ⚠️  NE RÉGÉNÈRE PAS les fichiers HTML (conserve les modifications manuelles!)
 #
-# Usage : python dashboard_generator.py
+# Usage : python dashboard_generator.py [--db listings.db] [export|images|stats|analytics|serve|loadtest|verify|bench] [options]
+#         python dashboard_generator.py                 (= export, build complet)
+#         python dashboard_generator.py images --image-budget 300
+#         python dashboard_generator.py stats --json
+#         python dashboard_generator.py analytics --format parquet
+#         python dashboard_generator.py serve --port 8000
+#         python dashboard_generator.py verify --fixture fixture.db --threshold 0.25
+#         python dashboard_generator.py bench
+#         BUILD_PROFILES=profiles.json python dashboard_generator.py  (builds multi-profils)
+#         python dashboard_generator.py --db listings.db --db 'scrapers/*.db'  (plusieurs bases fusionnées)
 # Output :
 #   dashboards/data/listings.js           — donnees annonces (variable JS)
+#   dashboards/data/facets.js             — facettes + ordres de tri pré-calculés
 #   dashboards/data/stats.js              — statistiques (variable JS)
 #   dashboards/data/listings.json         — JSON pur (reutilisable)
 #   dashboards/data/history/YYYY-MM-DD.json — archive JSON du jour
+#   dashboards/data/stats-history.js      — série quotidienne des agrégats (listings.db)
+#   dashboards/data/quality.js            — compteurs qualité par site (GPS, image, ville, URL en double...)
+#   dashboards/data/trends.js             — tendances calculées depuis history/
+#   dashboards/data/heatmap/{z}/{x}_{y}.json — heatmap prix/m² (médiane, nb) par cellule
+#   dashboards/data/similar.json          — k annonces les plus similaires de chaque annonce
+#   dashboards/data/alert-matches.js      — correspondances des recherches sauvegardées (SAVED_SEARCHES_PATH)
+#   dashboards/data/build-manifest.json   — empreintes des fichiers de data/ (+ variantes .gz/.br)
 #   dashboards/manifest.json              — manifest PWA
+#   (sélection des sorties : DASHBOARD_EXPORTERS, ex. "+market-stats,-history")
+#   (JSON compact : DASHBOARD_JSON_COMPACT=1 ; orjson/ujson utilisés si installés)
+#   (un seul build à la fois : dashboards/.build.lock ; data/ assemblé en staging puis publié d'un bloc)
+#   (géocodage : gazetteer_lu.json / GAZETTEER_PATH, REFERENCE_POINTS="Gare:49.6,6.134;...")
 #
 # ✅ Les fichiers HTML (index.html, photos.html, etc.) sont gérés manuellement
 #    et NE sont PAS régénérés pour conserver les corrections du jour!
 #
-# Zero dependance externe (stdlib Python uniquement)
+# Dépendances : stdlib Python + module database du projet (build export) ; les
+# paquets suivants sont optionnels, chacun avec un repli stdlib sans lui :
+#   numpy         distances, cellules heatmap, annonces similaires → boucles Python
+#   orjson/ujson  sérialisation JSON plus rapide → module json (DASHBOARD_JSON_BACKEND pour forcer)
+#   pyarrow       analytics en parquet / arrow → csv
+#   brotli        variantes .br de data/ → .gz seulement
+#   Pillow        vignettes JPEG compressées → image téléchargée gardée telle quelle
+#   python-dotenv lecture de .env → variables d'environnement seulement
 # =============================================================================
 
 import sqlite3
 import json
 import os
 import re
-import shutil
-import hashlib
-import urllib.request
+import sys
+from contextlib import contextmanager
 from datetime import datetime
-from database import db
+
+# Pillow, urllib.request, database et dotenv sont importés à la demande : importer
+# ce module pour ses fonctions pures (tests, scripts) ne lit ni .env ni la base.
 
 # =============================================================================
 # VERSION DU DASHBOARD — incrémenter manuellement à chaque release notable
@@ -34,23 +63,64 @@ from database import db
 DASHBOARD_VERSION = "2.7"
 
 # Villes prioritaires — chargées depuis .env (fallback hardcodé)
-import dotenv as _dotenv_module
-_dotenv_module.load_dotenv()
-PRIORITY_CITIES = [c.strip() for c in os.getenv(
-    'PRIORITY_CITIES', 'Luxembourg,Belair,Gare,Merl,Bonnevoie,Bertrange,Mamer,Strassen'
-).split(',') if c.strip()]
+DEFAULT_PRIORITY_CITIES = 'Luxembourg,Belair,Gare,Merl,Bonnevoie,Bertrange,Mamer,Strassen'
 
 # Image compression settings
 IMAGE_MAX_WIDTH = 400  # Max width for thumbnails
 IMAGE_QUALITY = 75     # JPEG quality (1-100)
 IMAGES_DIR = 'dashboards/images'
 
-try:
-    from PIL import Image
-    PIL_AVAILABLE = True
-except ImportError:
-    PIL_AVAILABLE = False
-    print("⚠️  Pillow non disponible - images non compressées")
+_config_loaded = False
+_pil_checked = False
+_pil_image = None
+
+
+def load_config():
+    """Charger .env une seule fois (au premier accès à la configuration)"""
+    global _config_loaded
+    if _config_loaded:
+        return
+    _config_loaded = True
+    try:
+        import dotenv
+    except ImportError:
+        return
+    dotenv.load_dotenv()
+
+
+def config_value(name, default=None):
+    """Valeur de configuration (variable d'environnement ou .env)"""
+    load_config()
+    return os.getenv(name, default)
+
+
+def get_priority_cities():
+    """Villes prioritaires (PRIORITY_CITIES dans .env)"""
+    return [c.strip() for c in config_value('PRIORITY_CITIES', DEFAULT_PRIORITY_CITIES).split(',') if c.strip()]
+
+
+def get_pil_image():
+    """Module PIL.Image importé au premier usage, None si Pillow n'est pas installé"""
+    global _pil_checked, _pil_image
+    if not _pil_checked:
+        _pil_checked = True
+        try:
+            from PIL import Image
+            _pil_image = Image
+        except ImportError:
+            print("⚠️  Pillow non disponible - images non compressées")
+    return _pil_image
+
+
+def __getattr__(name):
+    # Anciens attributs de module, désormais résolus au premier accès
+    if name == 'PRIORITY_CITIES':
+        return get_priority_cities()
+    if name == 'PIL_AVAILABLE':
+        return get_pil_image() is not None
+    if name == 'Image':
+        return get_pil_image()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def normalize_city_name(city):
@@ -104,43 +174,585 @@ def normalize_city_name(city):
     return city
 
 
-def read_listings(db_path='listings.db'):
-    """Lire toutes les annonces depuis la base SQLite"""
-    conn = sqlite3.connect(db_path)
+# Réglages SQLite des connexions de lecture du générateur
+SQLITE_READ_PRAGMAS = (
+    ('query_only', 1),
+    ('mmap_size', 256 * 1024 * 1024),  # 256 Mo mappés en mémoire
+    ('cache_size', -64 * 1024),        # 64 Mo de cache de pages (valeur négative = Kio)
+    ('temp_store', 'MEMORY'),
+)
+SQLITE_FETCH_BATCH = 1000  # lignes par fetchmany()
+
+# Mode de journal : réglage du propriétaire de la base (côté scrapers), jamais modifié
+# ici. Activer WAL une fois côté scraper (PRAGMA journal_mode=WAL, persistant) permet
+# au générateur de lire un instantané figé sans bloquer les écritures ; à éviter si
+# la base est sur un partage réseau (WAL exige une mémoire partagée locale).
+
+
+def open_readonly_db(db_path='listings.db'):
+    """Ouvrir listings.db en lecture seule (URI mode=ro) avec les pragmas de lecture"""
+    from pathlib import Path
+    uri = Path(os.path.abspath(db_path)).as_uri() + '?mode=ro'
+    # isolation_level=None : les transactions sont pilotées explicitement (db_snapshot)
+    conn = sqlite3.connect(uri, uri=True, timeout=30, isolation_level=None)
     conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    for pragma, value in SQLITE_READ_PRAGMAS:
+        conn.execute(f'PRAGMA {pragma}={value}')
+    return conn
 
-    cursor.execute('''
-        SELECT listing_id, site, title, city, price, rooms, surface,
-               url, latitude, longitude, distance_km, created_at, image_url
+
+@contextmanager
+def db_snapshot(db_path='listings.db'):
+    """
+    Connexion de lecture partagée par toutes les étapes d'un build.
+
+    En mode WAL, une transaction de lecture est ouverte et figée dès l'entrée :
+    toutes les étapes voient le même instantané, même si un scraper écrit
+    entre-temps. Hors WAL, la transaction bloquerait les écritures : chaque
+    requête lit alors l'état courant.
+    """
+    conn = open_readonly_db(db_path)
+    in_snapshot = False
+    try:
+        if conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+            conn.execute('BEGIN')
+            # La première lecture fige l'instantané
+            conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            in_snapshot = True
+        yield conn
+    finally:
+        if in_snapshot:
+            conn.execute('COMMIT')
+        conn.close()
+
+
+# Colonnes lues dans listings.db (ordre du SELECT et de l'export)
+LISTING_COLUMNS = ('listing_id', 'site', 'title', 'city', 'price', 'rooms', 'surface',
+                   'url', 'latitude', 'longitude', 'distance_km', 'created_at', 'image_url')
+
+# Champs ajoutés par les étapes du build ; absents de l'export tant qu'ils ne sont pas renseignés
+LISTING_OPTIONAL_FIELDS = ('first_seen', 'days_on_market', 'price_drop_pct', 'geo_source', 'distances_km',
+                           'local_image')
+
+
+class Listing:
+    """
+    Annonce en mémoire, compacte (__slots__, site/ville internés).
+
+    Se manipule comme le dict d'origine (l['price'], l.get('city'), l['x'] = ...)
+    pour que toutes les étapes restent inchangées ; n'est converti en dict
+    (to_dict) qu'à la sérialisation. Les clés inconnues vont dans un dict annexe
+    créé à la demande.
+    """
+    __slots__ = LISTING_COLUMNS + ('price_m2',) + LISTING_OPTIONAL_FIELDS + ('src_id', 'src_rank', '_extra')
+
+    _FIELDS = LISTING_COLUMNS + ('price_m2',)
+    _SLOTS = frozenset(LISTING_COLUMNS + ('price_m2',) + LISTING_OPTIONAL_FIELDS)
+
+    def __init__(self, values=(), **fields):
+        for name, value in zip(LISTING_COLUMNS, values):
+            setattr(self, name, value)
+        for name in self._FIELDS:
+            if not hasattr(self, name):
+                setattr(self, name, None)
+        self.src_id = 0  # id SQLite dans la base source (non exporté)
+        self.src_rank = 0  # rang de la base source dans --db (non exporté)
+        self._extra = None
+        for name, value in fields.items():
+            self[name] = value
+
+    def __getitem__(self, key):
+        if key in self._SLOTS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self._SLOTS:
+            if key in ('site', 'city') and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = [name for name in self._FIELDS]
+        keys.extend(name for name in LISTING_OPTIONAL_FIELDS if hasattr(self, name))
+        if self._extra:
+            keys.extend(self._extra)
+        return keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        """Dict sérialisable (même clés et ordre que l'ancien dict de read_listings)"""
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (Listing, dict)):
+            return self.to_dict() == (other.to_dict() if isinstance(other, Listing) else other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Listing({self.to_dict()!r})"
+
+
+def listing_fields(listings, *names):
+    """
+    Lecteur des champs `names` d'une annonce, choisi une fois pour toute la liste.
+
+    Les boucles sur toutes les annonces l'utilisent à la place de l['x'] / l.get('x') :
+    pour des Listing, operator.attrgetter lit les slots en C sans passer par
+    __getitem__/get ; pour des dicts, dict.get (clé absente = None). Un seul nom :
+    la valeur, sinon un tuple.
+    """
+    import operator
+
+    first = next(iter(listings), None)
+    if isinstance(first, Listing) and all(name in Listing._FIELDS for name in names):
+        return operator.attrgetter(*names)
+    if len(names) == 1:
+        name = names[0]
+        return lambda l: l.get(name)
+    return lambda l: tuple(map(l.get, names))
+
+
+def iter_listings(conn, order_by='id DESC', city_cache=None):
+    """
+    Parcourir les annonces de la base par lots (objets Listing normalisés).
+
+    Args:
+        conn: Connexion de lecture (voir open_readonly_db / db_snapshot)
+        order_by: Clause ORDER BY (constante du module, jamais une entrée utilisateur)
+        city_cache: Cache {ville brute: ville normalisée} partagé entre plusieurs bases
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = None  # tuples : pas de dict intermédiaire
+    cursor.execute(f'''
+        SELECT {', '.join(LISTING_COLUMNS)}, id
         FROM listings
-        ORDER BY id DESC
+        ORDER BY {order_by}
     ''')
 
-    listings = []
-    for row in cursor.fetchall():
-        listing = dict(row)
+    # Normalisation calculée une fois par nom de ville distinct (résultat interné)
+    city_cache = {} if city_cache is None else city_cache
+    try:
+        while True:
+            rows = cursor.fetchmany(SQLITE_FETCH_BATCH)
+            if not rows:
+                break
+            for row in rows:
+                listing = Listing(row)
+                listing.src_id = row[-1]
+                if listing.site:
+                    listing.site = sys.intern(listing.site)
+
+                # Normaliser le nom de ville
+                city = listing.city
+                if city:
+                    normalized = city_cache.get(city)
+                    if normalized is None:
+                        normalized = city_cache[city] = sys.intern(normalize_city_name(city))
+                    listing.city = normalized
+
+                # Corriger les anciennes URLs athome imageGallery → CDN static.athome.eu
+                img = listing.image_url or ''
+                if img and 'athome.lu/imageGallery/' in img:
+                    m = re.search(r'/imageGallery/\w+(.+)', img)
+                    if m:
+                        listing.image_url = f"https://i1.static.athome.eu/images/annonces2/image_{m.group(1)}"
+
+                # Calculer prix/m²
+                if listing.price and listing.surface and listing.surface > 0:
+                    listing.price_m2 = round(listing.price / listing.surface, 1)
+                yield listing
+    finally:
+        cursor.close()
+
+
+def read_listings(db_path='listings.db', conn=None):
+    """
+    Lire toutes les annonces depuis la base SQLite (objets Listing).
 
-        # Normaliser le nom de ville
-        if listing.get('city'):
-            listing['city'] = normalize_city_name(listing['city'])
+    Args:
+        db_path: Chemin de listings.db (ignoré si conn est fourni)
+        conn: Connexion de lecture existante (voir db_snapshot)
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = open_readonly_db(db_path)
+    try:
+        return list(iter_listings(conn))
+    finally:
+        if own_conn:
+            conn.close()
+
+
+# Plusieurs bases (une par scraper/hôte) : --db répétable, motifs glob acceptés,
+# ou LISTINGS_DB_SOURCES="listings.db,scrapers/*.db". La première base est la base
+# principale (agrégats, cycle de vie). Fusion sur listing_id : la version au
+# created_at le plus récent gagne, à égalité celle de la base citée en premier.
+# Tri sur datetime(created_at) : même clé que la fusion (_created_at_key),
+# quel que soit le format de date écrit par chaque scraper
+MULTI_SOURCE_ORDER = 'datetime(created_at) DESC, created_at DESC, id DESC'
+
+
+def resolve_db_sources(sources=None):
+    """Liste ordonnée et dédoublonnée des bases à lire"""
+    import glob
+
+    if not sources:
+        sources = (config_value('LISTINGS_DB_SOURCES') or 'listings.db').split(',')
+    elif isinstance(sources, str):
+        sources = [sources]
+    paths, seen = [], set()
+    for pattern in sources:
+        pattern = pattern.strip()
+        if not pattern:
+            continue
+        if any(c in pattern for c in '*?['):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                print(f"⚠️  Aucune base ne correspond à {pattern}")
+        else:
+            matches = [pattern]
+        for path in matches:
+            key = os.path.realpath(path)
+            if key not in seen:
+                seen.add(key)
+                paths.append(path)
+    return paths
 
-        # Corriger les anciennes URLs athome imageGallery → CDN static.athome.eu
-        img = listing.get('image_url') or ''
-        if img and 'athome.lu/imageGallery/' in img:
-            m = re.search(r'/imageGallery/\w+(.+)', img)
-            if m:
-                listing['image_url'] = f"https://i1.static.athome.eu/images/annonces2/image_{m.group(1)}"
 
-        # Calculer prix/m²
-        if listing['price'] and listing['surface'] and listing['surface'] > 0:
-            listing['price_m2'] = round(listing['price'] / listing['surface'], 1)
-        else:
-            listing['price_m2'] = None
-        listings.append(listing)
+def _read_source(db_path, order_by, city_cache):
+    import time
+    start = time.perf_counter()
+    with db_snapshot(db_path) as conn:
+        # Position du journal lue avant les annonces : tout changement jusqu'à
+        # cette position est visible dans la lecture
+        change_seq = read_change_seq(conn)
+        listings = list(iter_listings(conn, order_by, city_cache))
+    return listings, time.perf_counter() - start, change_seq
 
-    conn.close()
-    return listings
+
+# Lots d'avance lus par base pendant la fusion (mémoire bornée par base)
+MULTI_SOURCE_PREFETCH_BATCHES = 4
+
+
+def _created_at_key(value):
+    """
+    created_at comparable entre bases, comme datetime(created_at) de SQLite.
+
+    '2024-05-01T10:00:00', '2024-05-01 10:00:00.123', '2024-05-01T10:00:00Z'
+    donnent tous '2024-05-01 10:00:00' (décalage horaire ramené en UTC) ;
+    date absente ou illisible : '' (en fin de fusion, comme NULL dans le tri SQL).
+    """
+    if not value:
+        return ''
+    try:
+        dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return ''
+    if dt.tzinfo is not None:
+        from datetime import timezone
+        dt = dt.astimezone(timezone.utc)
+    return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _stream_source(db_path, order_by, city_cache, stats, stop):
+    """
+    Annonces d'une base lues dans un thread (instantané propre) et transmises
+    par lots via une file bornée : la fusion consomme au fil de la lecture.
+    """
+    import queue
+    import threading
+    import time
+
+    batches = queue.Queue(maxsize=MULTI_SOURCE_PREFETCH_BATCHES)
+
+    def put(item):
+        # Abandon si le consommateur a fermé le flux
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        start = time.perf_counter()
+        try:
+            with db_snapshot(db_path) as conn:
+                stats['change_seq'] = read_change_seq(conn)
+                batch = []
+                for listing in iter_listings(conn, order_by, city_cache):
+                    batch.append(listing)
+                    if len(batch) >= SQLITE_FETCH_BATCH:
+                        stats['rows'] += len(batch)
+                        if not put(batch):
+                            return
+                        batch = []
+                stats['rows'] += len(batch)
+                if batch and not put(batch):
+                    return
+        except Exception as exc:
+            put(exc)
+        finally:
+            stats['seconds'] = time.perf_counter() - start
+            put(None)
+
+    threading.Thread(target=produce, name=f'read-{db_path}', daemon=True).start()
+    while True:
+        item = batches.get()
+        if item is None:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield from item
+
+
+def iter_listings_multi(db_paths, report=None):
+    """
+    Annonces de plusieurs bases lues en parallèle (un thread et un instantané
+    par base), fusionnées en flux par created_at décroissant.
+
+    Chaque base est parcourue par iter_listings (ORDER BY created_at DESC) et
+    fusionnée au fil de la lecture : seuls quelques lots par base sont en
+    mémoire. La clé de fusion est created_at au format unifié (_created_at_key).
+
+    Args:
+        report: liste complétée, base par base, de
+                {'source', 'rows', 'kept', 'seconds', 'change_seq'} (remplie en fin de flux)
+    """
+    import heapq
+    import threading
+
+    city_cache = {}  # normalisation des villes commune à toutes les bases
+    stop = threading.Event()
+    stats = [{'rows': 0, 'seconds': 0.0, 'change_seq': None} for _ in db_paths]
+    # Clé (created_at, -rang de la base) : décroissante = plus récent, puis première base citée
+    def keyed(rank, path):
+        for listing in _stream_source(path, MULTI_SOURCE_ORDER, city_cache, stats[rank], stop):
+            listing.src_rank = rank
+            yield _created_at_key(listing.created_at), -rank, listing
+
+    streams = [keyed(n, path) for n, path in enumerate(db_paths)]
+    kept = [0] * len(db_paths)
+    seen = set()
+    try:
+        for _, neg_rank, listing in heapq.merge(*streams, key=lambda item: item[:2], reverse=True):
+            if listing.listing_id in seen:
+                continue
+            seen.add(listing.listing_id)
+            kept[-neg_rank] += 1
+            yield listing
+    finally:
+        stop.set()
+
+    if report is not None:
+        for path, source, count in zip(db_paths, stats, kept):
+            report.append({'source': path, 'rows': source['rows'], 'kept': count,
+                           'seconds': source['seconds'], 'change_seq': source['change_seq']})
+
+
+def read_listings_multi(db_paths):
+    """
+    Lire une ou plusieurs bases.
+
+    Une seule base : lecture inchangée (instantané, ORDER BY id DESC).
+
+    Returns:
+        tuple: (annonces, rapport par base)
+    """
+    if len(db_paths) == 1:
+        listings, seconds, change_seq = _read_source(db_paths[0], 'id DESC', None)
+        return listings, [{'source': db_paths[0], 'rows': len(listings), 'kept': len(listings),
+                           'seconds': seconds, 'change_seq': change_seq}]
+    report = []
+    listings = list(iter_listings_multi(db_paths, report))
+    return listings, report
+
+
+# =============================================================================
+# GÉOCODAGE : coordonnées manquantes et distances aux points de référence
+# =============================================================================
+# Gazetteer hors ligne (communes/quartiers → lat, lon), surchargeable par GAZETTEER_PATH
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gazetteer_lu.json')
+# distance_km des scrapers : mesurée depuis Luxembourg-Gare
+DEFAULT_REFERENCE_POINTS = 'Gare:49.6000,6.1340'
+EARTH_RADIUS_KM = 6371.0
+
+_gazetteer = None
+
+
+def load_gazetteer(path=None):
+    """Gazetteer {ville normalisée: (lat, lon)}, lu une seule fois par processus"""
+    global _gazetteer
+    if path is None and _gazetteer is not None:
+        return _gazetteer
+    path = path or config_value('GAZETTEER_PATH', GAZETTEER_PATH)
+    places = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            raw = json.load(f).get('places', {})
+        for name, coords in raw.items():
+            places[geo_key(name)] = (float(coords[0]), float(coords[1]))
+    except (OSError, ValueError, TypeError, IndexError) as e:
+        print(f"⚠️  Gazetteer illisible ({path}): {e}")
+    _gazetteer = places
+    return places
+
+
+def geo_key(city):
+    """Clé de recherche : nom normalisé, entités HTML et espaces parasites retirés"""
+    import html
+    if not city:
+        return None
+    return normalize_city_name(html.unescape(city).strip()) or None
+
+
+def parse_reference_points(value=None):
+    """
+    Points de référence pour les distances.
+
+    Format REFERENCE_POINTS : "Nom:lat,lon;Nom2:lat,lon" (défaut : la Gare,
+    origine de distance_km chez les scrapers).
+    """
+    if value is None:
+        value = config_value('REFERENCE_POINTS') or DEFAULT_REFERENCE_POINTS
+    points = []
+    for chunk in value.split(';'):
+        if not chunk.strip():
+            continue
+        try:
+            name, coords = chunk.split(':', 1)
+            lat, lon = (float(v) for v in coords.split(','))
+        except ValueError:
+            print(f"⚠️  Point de référence ignoré : {chunk.strip()!r}")
+            continue
+        points.append((name.strip(), lat, lon))
+    return points
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distance orthodromique en km"""
+    import math
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def distance_matrix_km(coords, points):
+    """
+    Distances (km) de chaque coordonnée à chaque point de référence.
+
+    Vectorisé avec numpy s'il est installé, boucle math sinon ; renvoie une
+    liste de lignes [d_point1, d_point2, ...] dans l'ordre de coords.
+    """
+    if not coords or not points:
+        return [[] for _ in coords]
+    try:
+        import numpy as np
+    except ImportError:
+        return [[haversine_km(lat, lon, plat, plon) for _, plat, plon in points]
+                for lat, lon in coords]
+
+    c = np.radians(np.asarray(coords, dtype=float))
+    p = np.radians(np.asarray([(plat, plon) for _, plat, plon in points], dtype=float))
+    lat1, lon1 = c[:, 0:1], c[:, 1:2]
+    lat2, lon2 = p[:, 0], p[:, 1]
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return (2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))).tolist()
+
+
+def enrich_geo(listings, gazetteer=None, points=None):
+    """
+    Compléter les coordonnées manquantes et les distances.
+
+    - lat/lon absents : gazetteer de la ville, sinon centre (médiane) des
+      annonces de la même ville qui ont des coordonnées ; geo_source l'indique
+    - distance_km : calculée si absente ou si les coordonnées viennent d'être
+      déduites ; recalculée partout si REFERENCE_POINTS est configuré
+    - distances_km : {nom: km} par point quand plusieurs points sont configurés
+
+    Résolution mise en cache par ville (une recherche par ville distincte).
+
+    Returns:
+        dict de compteurs (gazetteer, centroid, unresolved, distances)
+    """
+    gazetteer = load_gazetteer() if gazetteer is None else gazetteer
+    explicit_points = points is not None or bool(config_value('REFERENCE_POINTS'))
+    points = parse_reference_points() if points is None else points
+    counts = {'gazetteer': 0, 'centroid': 0, 'unresolved': 0, 'distances': 0}
+
+    # Centres par ville, appris des annonces géolocalisées du run
+    seen = {}
+    for l in listings:
+        if l.latitude and l.longitude:
+            key = geo_key(l.city)
+            if key:
+                seen.setdefault(key, []).append((l.latitude, l.longitude))
+    import statistics
+    centroids = {key: (round(statistics.median(c[0] for c in pts), 5),
+                       round(statistics.median(c[1] for c in pts), 5))
+                 for key, pts in seen.items()}
+
+    city_cache = {}
+    todo = []  # (listing, coordonnées déduites ?)
+    for l in listings:
+        located = bool(l.latitude and l.longitude)
+        if not located:
+            resolved = city_cache.get(l.city)
+            if resolved is None and l.city not in city_cache:
+                key = geo_key(l.city)
+                if key in gazetteer:
+                    resolved = (gazetteer[key], 'gazetteer')
+                elif key in centroids:
+                    resolved = (centroids[key], 'city-centroid')
+                city_cache[l.city] = resolved
+            if resolved is None:
+                counts['unresolved'] += 1
+                continue
+            (l.latitude, l.longitude), l.geo_source = resolved
+            counts['gazetteer' if resolved[1] == 'gazetteer' else 'centroid'] += 1
+        if not points:
+            continue
+        if explicit_points or len(points) > 1 or not located or l.distance_km is None:
+            todo.append((l, located))
+
+    rows = distance_matrix_km([(l.latitude, l.longitude) for l, _ in todo], points)
+    for (l, located), dists in zip(todo, rows):
+        if explicit_points or not located or l.distance_km is None:
+            l.distance_km = round(dists[0], 1)
+            counts['distances'] += 1
+        if len(points) > 1:
+            l.distances_km = {name: round(d, 1) for (name, _, _), d in zip(points, dists)}
+    return counts
 
 
 def calc_stats(listings):
@@ -152,24 +764,36 @@ def calc_stats(listings):
             'by_city': [], 'by_price_range': {}
         }
 
-    prices = [l['price'] for l in listings if l['price'] and l['price'] > 0]
-    surfaces = [l['surface'] for l in listings if l['surface'] and l['surface'] > 0]
+    prices = []
+    surfaces = []
     sites = {}
     cities = {}
+    normalized = {}  # normalize_city_name une fois par nom distinct
 
-    for l in listings:
-        site = l['site'] or 'Inconnu'
+    for price, surface, site, city in map(listing_fields(listings, 'price', 'surface', 'site', 'city'), listings):
+        if price and price > 0:
+            prices.append(price)
+        if surface and surface > 0:
+            surfaces.append(surface)
+
+        site = site or 'Inconnu'
         sites[site] = sites.get(site, 0) + 1
 
         # Normaliser le nom de ville (double sécurité si déjà fait dans read_listings)
-        city = normalize_city_name(l['city']) if l.get('city') else 'N/A'
+        if city:
+            key = city
+            city = normalized.get(key)
+            if city is None:
+                city = normalized[key] = normalize_city_name(key)
+        else:
+            city = 'N/A'
 
         if city != 'N/A':
             if city not in cities:
                 cities[city] = {'count': 0, 'prices': []}
             cities[city]['count'] += 1
-            if l['price'] and l['price'] > 0:
-                cities[city]['prices'].append(l['price'])
+            if price and price > 0:
+                cities[city]['prices'].append(price)
 
     by_city = []
     for city, data in sorted(cities.items(), key=lambda x: x[1]['count'], reverse=True):
@@ -200,6 +824,793 @@ def calc_stats(listings):
     }
 
 
+# Tranches de prix (mêmes bornes que calc_stats)
+PRICE_BUCKETS = [(1500, '< 1500'), (2000, '1500 - 2000'), (2500, '2000 - 2500'), (None, '> 2500')]
+
+
+def price_bucket(price):
+    """Tranche de prix d'une annonce (None si prix absent)"""
+    if not price or price <= 0:
+        return None
+    for upper, label in PRICE_BUCKETS:
+        if upper is None or price < upper:
+            return label
+
+
+# =============================================================================
+# AGRÉGATS MATÉRIALISÉS — tables de synthèse maintenues dans listings.db
+# =============================================================================
+# listing_aggregates         : compteurs/sommes par dimension (all, site, city, price_range)
+# listing_aggregates_members : annonces déjà comptées (permet de retrancher les supprimées)
+# listing_aggregates_daily   : série quotidienne des indicateurs globaux
+#
+# listing_aggregates_sources : position du journal des changements déjà appliquée, par base
+#
+# A chaque build, seules les annonces nouvelles, supprimées ou modifiées depuis le
+# build précédent mettent à jour les tables : calc_stats_from_aggregates() lit
+# ensuite les compteurs au lieu de reparcourir toutes les annonces. Les annonces
+# touchées sont lues dans listing_changes (journal alimenté par des triggers sur
+# listings) : sans journal, ou si la liste des bases change, diff complet.
+
+AGGREGATES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS listing_aggregates (
+        dimension     TEXT NOT NULL,
+        key           TEXT NOT NULL,
+        count         INTEGER NOT NULL DEFAULT 0,
+        price_sum     INTEGER NOT NULL DEFAULT 0,
+        price_count   INTEGER NOT NULL DEFAULT 0,
+        surface_sum   REAL NOT NULL DEFAULT 0,
+        surface_count INTEGER NOT NULL DEFAULT 0,
+        max_read_order TEXT NOT NULL DEFAULT '',
+        PRIMARY KEY (dimension, key)
+    );
+    CREATE TABLE IF NOT EXISTS listing_aggregates_members (
+        listing_id TEXT PRIMARY KEY,
+        read_order TEXT NOT NULL DEFAULT '',
+        site       TEXT,
+        city       TEXT,
+        price      INTEGER,
+        surface    REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_agg_members_price ON listing_aggregates_members(price);
+    CREATE INDEX IF NOT EXISTS idx_agg_members_site ON listing_aggregates_members(site, read_order);
+    CREATE INDEX IF NOT EXISTS idx_agg_members_city ON listing_aggregates_members(city, read_order);
+    CREATE TABLE IF NOT EXISTS listing_aggregates_daily (
+        date          TEXT PRIMARY KEY,
+        total         INTEGER NOT NULL,
+        avg_price     INTEGER NOT NULL,
+        min_price     INTEGER NOT NULL,
+        max_price     INTEGER NOT NULL,
+        avg_surface   INTEGER NOT NULL,
+        cities        INTEGER NOT NULL,
+        new_count     INTEGER NOT NULL DEFAULT 0,
+        removed_count INTEGER NOT NULL DEFAULT 0,
+        sites         TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS listing_aggregates_sources (
+        source     TEXT PRIMARY KEY,
+        change_seq INTEGER NOT NULL
+    );
+'''
+
+# Journal des changements de listings, installé dans chaque base source. Seules les
+# colonnes lues par les agrégats (et l'ordre de lecture) déclenchent une entrée ;
+# INSERT OR REPLACE passe par le trigger d'insertion.
+CHANGE_LOG_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS listing_changes (
+        seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+        listing_id TEXT
+    );
+    CREATE TRIGGER IF NOT EXISTS listing_changes_insert AFTER INSERT ON listings BEGIN
+        INSERT INTO listing_changes (listing_id) VALUES (NEW.listing_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS listing_changes_update
+    AFTER UPDATE OF id, listing_id, site, city, price, surface, created_at ON listings BEGIN
+        INSERT INTO listing_changes (listing_id) VALUES (OLD.listing_id);
+        INSERT INTO listing_changes (listing_id) SELECT NEW.listing_id WHERE NEW.listing_id IS NOT OLD.listing_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS listing_changes_delete AFTER DELETE ON listings BEGIN
+        INSERT INTO listing_changes (listing_id) VALUES (OLD.listing_id);
+    END;
+'''
+
+
+def ensure_change_log(db_path='listings.db'):
+    """Installer le journal des changements (table + triggers) ; False si la base n'est pas modifiable"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        conn.executescript(CHANGE_LOG_SCHEMA)
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+def read_change_seq(conn):
+    """Dernière position du journal des changements (None si la base n'en a pas)"""
+    # Compteur AUTOINCREMENT : conservé quand le journal est purgé
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'listing_changes'").fetchone()
+    if row is None:
+        return None
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'listing_changes'").fetchone()
+    return row[0] if row else 0
+
+
+def _change_marks(report):
+    """{base: position du journal} d'une lecture (None si une base n'a pas de journal)"""
+    if not report or any(entry.get('change_seq') is None for entry in report):
+        return None
+    return {os.path.realpath(entry['source']): entry['change_seq'] for entry in report}
+
+
+def _changed_listing_ids(conn, marks, applied):
+    """listing_id journalisés entre la position appliquée et celle de la lecture, toutes bases"""
+    changed = set()
+    primary = os.path.realpath(conn.execute('PRAGMA database_list').fetchone()[2])
+    for source, seq in marks.items():
+        if seq <= applied[source]:
+            continue
+        source_conn = conn if source == primary else open_readonly_db(source)
+        try:
+            changed.update(row[0] for row in source_conn.execute(
+                'SELECT DISTINCT listing_id FROM listing_changes WHERE seq > ? AND seq <= ?',
+                (applied[source], seq)))
+        finally:
+            if source_conn is not conn:
+                source_conn.close()
+    return changed
+
+
+def _aggregate_members(conn, listing_ids):
+    """Lignes de listing_aggregates_members des annonces données"""
+    listing_ids = list(listing_ids)
+    rows = {}
+    for i in range(0, len(listing_ids), 500):
+        batch = listing_ids[i:i + 500]
+        for row in conn.execute(f'''
+            SELECT listing_id, read_order, site, city, price, surface FROM listing_aggregates_members
+            WHERE listing_id IN ({','.join('?' * len(batch))})
+        ''', batch):
+            rows[row[0]] = row
+    return rows
+
+
+@contextmanager
+def generator_transaction(db_path='listings.db', conn=None):
+    """
+    Transaction d'écriture sur les tables du générateur (agrégats, cycle de vie, qualité).
+
+    Sans conn : connexion propre, BEGIN IMMEDIATE (diff lu et appliqué dans une seule
+    transaction : deux runs ne peuvent pas appliquer le même delta), COMMIT en sortie.
+    Avec conn (transaction du build) : les écritures la rejoignent ; l'appelant ne
+    valide qu'une fois l'export publié, un échec ne laisse pas les tables en avance.
+    """
+    if conn is not None:
+        yield conn
+        return
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        _migrate_aggregates(conn)
+        conn.executescript(AGGREGATES_SCHEMA + LIFECYCLE_SCHEMA + QUALITY_SCHEMA)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+
+def _aggregate_read_order(listing, multi_source):
+    """
+    Position de lecture d'une annonce, comparable en texte (décroissante = lue en premier).
+
+    Une base : id DESC. Plusieurs bases : ordre de iter_listings_multi, soit
+    created_at normalisé, rang de la base (première citée d'abord), puis l'ordre
+    SQL de la base (created_at brut, id). Ne dépend que de l'annonce : les égalités
+    de by_city/sites restent celles de calc_stats sans réécrire les autres annonces.
+    """
+    if isinstance(listing, Listing):
+        src_id, rank = listing.src_id, listing.src_rank
+    else:
+        src_id, rank = listing.get('src_id', 0), listing.get('src_rank', 0)
+    if not multi_source:
+        return f'{src_id or 0:012d}'
+    created_at = str(listing.get('created_at') or '')[:40]
+    # Champs à largeur fixe ; l'espace de bourrage trie avant tout caractère imprimable
+    return (f'{_created_at_key(listing.get("created_at")):19}|{9999 - rank:04d}|'
+            f'{created_at:40}|{src_id or 0:012d}')
+
+
+def _migrate_aggregates(conn):
+    """Tables d'agrégats de l'ancien format (ordre par id entier) : supprimées puis recalculées"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(listing_aggregates_members)')}
+    if 'src_id' in columns:
+        conn.executescript('''
+            DROP TABLE IF EXISTS listing_aggregates;
+            DROP TABLE IF EXISTS listing_aggregates_members;
+            DROP TABLE IF EXISTS listing_aggregates_sources;
+        ''')
+
+
+def _aggregate_keys(member):
+    """Clés (dimension, key) alimentées par une annonce (même logique que calc_stats)"""
+    _, _, site, city, price, _ = member
+    keys = [('all', '*'), ('site', site)]
+    if city != 'N/A':
+        keys.append(('city', city))
+    if price and price > 0:
+        keys.append(('price_range', price_bucket(price)))
+    return keys
+
+
+def _apply_aggregate_delta(conn, member, sign):
+    """Ajouter (sign=1) ou retrancher (sign=-1) une annonce des compteurs"""
+    _, read_order, _, _, price, surface = member
+    has_price = 1 if price and price > 0 else 0
+    has_surface = 1 if surface and surface > 0 else 0
+    for dimension, key in _aggregate_keys(member):
+        conn.execute('''
+            INSERT INTO listing_aggregates (dimension, key) VALUES (?, ?)
+            ON CONFLICT(dimension, key) DO NOTHING
+        ''', (dimension, key))
+        conn.execute('''
+            UPDATE listing_aggregates
+            SET count = count + ?,
+                price_sum = price_sum + ?, price_count = price_count + ?,
+                surface_sum = surface_sum + ?, surface_count = surface_count + ?,
+                max_read_order = CASE WHEN ? > 0 AND ? > max_read_order THEN ? ELSE max_read_order END
+            WHERE dimension = ? AND key = ?
+        ''', (sign, sign * has_price * (price or 0), sign * has_price,
+              sign * has_surface * (surface or 0), sign * has_surface,
+              sign, read_order, read_order, dimension, key))
+
+
+def _refresh_aggregate_max(conn, dimension, key):
+    """Recalculer max_read_order d'une clé après suppression (index members(site|city, read_order))"""
+    if dimension == 'site':
+        row = conn.execute('SELECT MAX(read_order) FROM listing_aggregates_members WHERE site = ?',
+                           (key,)).fetchone()
+    elif dimension == 'city':
+        row = conn.execute('SELECT MAX(read_order) FROM listing_aggregates_members WHERE city = ?',
+                           (key,)).fetchone()
+    else:
+        return
+    conn.execute('UPDATE listing_aggregates SET max_read_order = ? WHERE dimension = ? AND key = ?',
+                 (row[0] or '', dimension, key))
+
+
+def update_aggregates(listings, db_path='listings.db', report=None, conn=None):
+    """
+    Mettre à jour les tables d'agrégats à partir des changements depuis le dernier build.
+
+    Avec le rapport de lecture (read_listings_multi), seules les annonces inscrites
+    au journal listing_changes depuis le build précédent sont comparées ; sinon
+    diff complet par listing_id. Seules les annonces nouvelles, supprimées ou
+    modifiées (site, ville, prix, surface) touchent la base.
+
+    Args:
+        conn: Transaction du build (generator_transaction) ; par défaut, transaction propre
+
+    Returns:
+        tuple: (nouvelles, supprimées) — les modifications comptent dans les deux
+    """
+    own_transaction = conn is None
+    marks = _change_marks(report)
+    with generator_transaction(db_path, conn) as conn:
+        applied = dict(conn.execute('SELECT source, change_seq FROM listing_aggregates_sources'))
+        # Journal incomplet, bases ajoutées/retirées ou journal revenu en arrière
+        # (base restaurée) : diff complet
+        if marks and applied.keys() == marks.keys() and all(marks[k] >= applied[k] for k in marks):
+            changed = _changed_listing_ids(conn, marks, applied)
+            candidates = [l for l in listings if l['listing_id'] in changed] if changed else []
+            stored = _aggregate_members(conn, changed)
+        else:
+            candidates = listings
+            stored = {
+                row[0]: row for row in conn.execute(
+                    'SELECT listing_id, read_order, site, city, price, surface FROM listing_aggregates_members')
+            }
+        multi_source = report is not None and len(report) > 1
+        current = {}
+        for l in candidates:
+            city = normalize_city_name(l['city']) if l.get('city') else 'N/A'
+            current[l['listing_id']] = (_aggregate_read_order(l, multi_source), l['site'] or 'Inconnu',
+                                        city, l['price'], l['surface'])
+
+        removed = [lid for lid, row in stored.items()
+                   if lid not in current or row[1:] != current[lid]]
+        added = [lid for lid, values in current.items()
+                 if lid not in stored or stored[lid][1:] != values]
+
+        _store_change_marks(conn, marks)
+        if removed or added:
+            _apply_aggregate_changes(conn, stored, current, removed, added)
+    # Transaction du build : journaux secondaires purgés par l'appelant après COMMIT
+    if own_transaction:
+        _prune_change_logs(db_path, marks)
+    return len(added), len(removed)
+
+
+def _apply_aggregate_changes(conn, stored, current, removed, added):
+    """Appliquer le diff aux compteurs et à la série quotidienne (transaction de l'appelant)"""
+    touched = set()
+    for lid in removed:
+        member = stored[lid]
+        _apply_aggregate_delta(conn, member, -1)
+        touched.update(_aggregate_keys(member))
+        conn.execute('DELETE FROM listing_aggregates_members WHERE listing_id = ?', (lid,))
+    for lid in added:
+        member = (lid,) + current[lid]
+        conn.execute('INSERT INTO listing_aggregates_members VALUES (?, ?, ?, ?, ?, ?)', member)
+        _apply_aggregate_delta(conn, member, 1)
+    for dimension, key in touched:
+        _refresh_aggregate_max(conn, dimension, key)
+    conn.execute('DELETE FROM listing_aggregates WHERE count <= 0')
+
+    # Série quotidienne : une ligne par jour, écrasée par le dernier build du jour
+    stats = _stats_from_aggregate_tables(conn)
+    today = datetime.now().strftime('%Y-%m-%d')
+    new_count = len(set(added) - set(stored))
+    removed_count = len(set(removed) - set(current))
+    conn.execute('''
+        INSERT INTO listing_aggregates_daily
+            (date, total, avg_price, min_price, max_price, avg_surface, cities,
+             new_count, removed_count, sites)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(date) DO UPDATE SET
+            total = excluded.total, avg_price = excluded.avg_price,
+            min_price = excluded.min_price, max_price = excluded.max_price,
+            avg_surface = excluded.avg_surface, cities = excluded.cities,
+            new_count = new_count + excluded.new_count,
+            removed_count = removed_count + excluded.removed_count,
+            sites = excluded.sites
+    ''', (today, stats['total'], stats['avg_price'], stats['min_price'], stats['max_price'],
+          stats['avg_surface'], stats['cities'], new_count, removed_count,
+          json.dumps(stats['sites'], ensure_ascii=False)))
+
+
+def _prune_change_logs(db_path, marks):
+    """Purger le journal des bases secondaires jusqu'à la position appliquée (best effort)"""
+    primary = os.path.realpath(db_path)
+    for source, seq in (marks or {}).items():
+        if source == primary:
+            continue
+        conn = sqlite3.connect(source, timeout=30)
+        try:
+            with conn:
+                conn.execute('DELETE FROM listing_changes WHERE seq <= ?', (seq,))
+        except sqlite3.OperationalError:
+            pass  # base en lecture seule : le journal sera relu à partir de la position stockée
+        finally:
+            conn.close()
+
+
+def _store_change_marks(conn, marks):
+    """Positions du journal appliquées ; journal de la base principale purgé jusque-là"""
+    conn.execute('DELETE FROM listing_aggregates_sources')
+    if not marks:
+        return
+    conn.executemany('INSERT INTO listing_aggregates_sources VALUES (?, ?)', marks.items())
+    primary = os.path.realpath(conn.execute('PRAGMA database_list').fetchone()[2])
+    if primary in marks:
+        conn.execute('DELETE FROM listing_changes WHERE seq <= ?', (marks[primary],))
+
+
+def _stats_from_aggregate_tables(conn):
+    """Construire le dict de calc_stats depuis les tables d'agrégats"""
+    rows = conn.execute('''
+        SELECT dimension, key, count, price_sum, price_count, surface_sum, surface_count, max_read_order
+        FROM listing_aggregates
+        WHERE count > 0
+        ORDER BY max_read_order DESC
+    ''').fetchall()
+    if not rows:
+        return calc_stats([])
+
+    total = price_sum = price_count = surface_sum = surface_count = 0
+    sites = {}
+    by_city = []
+    ranges = {label: 0 for _, label in PRICE_BUCKETS}
+    for dimension, key, count, p_sum, p_count, s_sum, s_count, _ in rows:
+        if dimension == 'all':
+            total, price_sum, price_count, surface_sum, surface_count = count, p_sum, p_count, s_sum, s_count
+        elif dimension == 'site':
+            sites[key] = count
+        elif dimension == 'city':
+            by_city.append({'city': key, 'count': count,
+                            'avg_price': int(p_sum / p_count) if p_count else 0})
+        elif dimension == 'price_range':
+            ranges[key] = count
+
+    # Tri stable : à nombre égal, ordre de première apparition (ordre de lecture) comme calc_stats
+    by_city.sort(key=lambda c: c['count'], reverse=True)
+    min_price, max_price = conn.execute(
+        'SELECT MIN(price), MAX(price) FROM listing_aggregates_members WHERE price > 0').fetchone()
+
+    return {
+        'total': total,
+        'avg_price': int(price_sum / price_count) if price_count else 0,
+        'min_price': min_price or 0,
+        'max_price': max_price or 0,
+        'avg_surface': int(surface_sum / surface_count) if surface_count else 0,
+        'cities': len(by_city),
+        'sites': sites,
+        'by_city': by_city,
+        'by_price_range': ranges
+    }
+
+
+def calc_stats_from_aggregates(db_path='listings.db', conn=None):
+    """Statistiques globales lues depuis listing_aggregates (même format que calc_stats)"""
+    if conn is not None:
+        return _stats_from_aggregate_tables(conn)
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        _migrate_aggregates(conn)
+        conn.executescript(AGGREGATES_SCHEMA)
+        return _stats_from_aggregate_tables(conn)
+    finally:
+        conn.close()
+
+
+def read_daily_aggregates(db_path='listings.db', conn=None):
+    """Série quotidienne des indicateurs globaux (listing_aggregates_daily), ordre chronologique"""
+    own_conn = conn is None
+    if own_conn:
+        conn = open_readonly_db(db_path)
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'listing_aggregates_daily'"
+        ).fetchone()
+        if not exists:
+            return []
+        series = []
+        for row in conn.execute('''
+            SELECT date, total, avg_price, min_price, max_price, avg_surface, cities,
+                   new_count, removed_count, sites
+            FROM listing_aggregates_daily ORDER BY date
+        '''):
+            day = dict(zip(('date', 'total', 'avg_price', 'min_price', 'max_price', 'avg_surface',
+                            'cities', 'new_count', 'removed_count'), row[:9]))
+            day['sites'] = json.loads(row[9])
+            series.append(day)
+        return series
+    finally:
+        if own_conn:
+            conn.close()
+
+
+# =============================================================================
+# CYCLE DE VIE DES ANNONCES — première/dernière vue, retrait, historique des prix
+# =============================================================================
+# listing_lifecycle     : une ligne par listing_id (first_seen, last_seen, removed_at, prix)
+# listing_price_changes : journal des changements de prix
+#
+# Le diff entre le build courant et l'état stocké se fait par dict/ensemble sur
+# listing_id : coût linéaire, seules les lignes changées sont écrites.
+
+LIFECYCLE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS listing_lifecycle (
+        listing_id  TEXT PRIMARY KEY,
+        first_seen  TEXT NOT NULL,
+        last_seen   TEXT NOT NULL,
+        removed_at  TEXT,
+        first_price INTEGER,
+        last_price  INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS idx_lifecycle_removed ON listing_lifecycle(removed_at);
+    CREATE TABLE IF NOT EXISTS listing_price_changes (
+        listing_id TEXT NOT NULL,
+        changed_at TEXT NOT NULL,
+        old_price  INTEGER,
+        new_price  INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS idx_price_changes_listing ON listing_price_changes(listing_id, changed_at);
+'''
+
+
+def update_lifecycle(listings, db_path='listings.db', now=None, conn=None):
+    """
+    Mettre à jour le cycle de vie des annonces et annoter les listings.
+
+    Ajoute à chaque annonce : first_seen, days_on_market, price_drop_pct
+    (baisse en % depuis le premier prix vu, None si pas de baisse).
+
+    Args:
+        conn: Transaction du build (generator_transaction) ; par défaut, transaction propre
+
+    Returns:
+        dict: compteurs {'new', 'removed', 'reappeared', 'price_changes'}
+    """
+    now = now or datetime.now()
+    now_str = now.strftime('%Y-%m-%d %H:%M:%S')
+    with generator_transaction(db_path, conn) as conn:
+        stored = {
+            row[0]: row for row in conn.execute(
+                'SELECT listing_id, first_seen, removed_at, first_price, last_price FROM listing_lifecycle')
+        }
+
+        new_rows, reappeared, price_changes = [], [], []
+        current_ids = set()
+        for l in listings:
+            lid = l['listing_id']
+            current_ids.add(lid)
+            price = l.get('price')
+            row = stored.get(lid)
+            if row is None:
+                # created_at = première insertion par le scraper, plus fiable que "maintenant"
+                first_seen = str(l['created_at'])[:19] if l.get('created_at') else now_str
+                new_rows.append((lid, first_seen, now_str, price, price))
+                stored[lid] = (lid, first_seen, None, price, price)
+                continue
+            if row[2] is not None:
+                reappeared.append(lid)
+            if price != row[4]:
+                price_changes.append((lid, now_str, row[4], price))
+
+        removed = [lid for lid, row in stored.items() if row[2] is None and lid not in current_ids]
+
+        conn.executemany('''
+            INSERT INTO listing_lifecycle (listing_id, first_seen, last_seen, first_price, last_price)
+            VALUES (?, ?, ?, ?, ?)
+        ''', new_rows)
+        conn.executemany('UPDATE listing_lifecycle SET removed_at = NULL WHERE listing_id = ?',
+                         [(lid,) for lid in reappeared])
+        conn.executemany('INSERT INTO listing_price_changes VALUES (?, ?, ?, ?)', price_changes)
+        conn.executemany('UPDATE listing_lifecycle SET last_price = ? WHERE listing_id = ?',
+                         [(new, lid) for lid, _, _, new in price_changes])
+        conn.executemany('UPDATE listing_lifecycle SET removed_at = ? WHERE listing_id = ?',
+                         [(now_str, lid) for lid in removed])
+        conn.execute('UPDATE listing_lifecycle SET last_seen = ? WHERE removed_at IS NULL', (now_str,))
+
+    for l in listings:
+        _, first_seen, _, first_price, _ = stored[l['listing_id']]
+        l['first_seen'] = first_seen
+        try:
+            l['days_on_market'] = max((now - datetime.strptime(first_seen[:10], '%Y-%m-%d')).days, 0)
+        except ValueError:
+            l['days_on_market'] = None
+        price = l.get('price')
+        if first_price and price and 0 < price < first_price:
+            l['price_drop_pct'] = round((first_price - price) / first_price * 100, 1)
+        else:
+            l['price_drop_pct'] = None
+
+    return {
+        'new': len(new_rows),
+        'removed': len(removed),
+        'reappeared': len(reappeared),
+        'price_changes': len(price_changes),
+    }
+
+
+# =============================================================================
+# QUALITÉ DES DONNÉES — compteurs de complétude/validité par site, incrémentaux
+# =============================================================================
+# listing_quality_members : drapeaux (bitmask QUALITY_CHECKS) et URL de chaque annonce comptée
+# listing_quality         : compteurs par (site, contrôle) ; 'total' = annonces du site
+# listing_quality_daily   : série quotidienne des compteurs (un scraper cassé se voit le jour même)
+#
+# Comme listing_aggregates : seules les annonces nouvelles, supprimées ou modifiées
+# depuis le build précédent ajustent les compteurs. Les URL en double dépendent de
+# plusieurs annonces : seules les URL touchées par le diff sont recomptées.
+
+QUALITY_CHECKS = ('missing_gps', 'missing_image', 'invalid_city',
+                  'missing_surface', 'missing_rooms', 'missing_price')
+QUALITY_DUPLICATE_URL = 'duplicate_url'
+
+QUALITY_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS listing_quality_members (
+        listing_id TEXT PRIMARY KEY,
+        site       TEXT NOT NULL,
+        url        TEXT,
+        flags      INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_quality_members_url ON listing_quality_members(url);
+    CREATE TABLE IF NOT EXISTS listing_quality (
+        site       TEXT NOT NULL,
+        check_name TEXT NOT NULL,
+        count      INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (site, check_name)
+    );
+    CREATE TABLE IF NOT EXISTS listing_quality_daily (
+        date  TEXT PRIMARY KEY,
+        total INTEGER NOT NULL,
+        sites TEXT NOT NULL
+    );
+'''
+
+
+def _city_is_valid(city):
+    """Ville exploitable : présente, avec des lettres, sans reste de HTML/URL/icône"""
+    if not city or city == 'N/A':
+        return False
+    if not any(c.isalpha() for c in city):
+        return False
+    lowered = city.lower()
+    return not any(marker in lowered for marker in ('&', '<', '.svg', 'http', '/'))
+
+
+def _image_is_valid(image_url):
+    """Même règle que hasValidPhoto() de data-quality.html"""
+    if not image_url:
+        return False
+    if image_url.startswith('images/'):
+        return True
+    if 'imageGallery' in image_url:
+        return False
+    return image_url.startswith('http')
+
+
+# Champs lus par les contrôles (ordre des arguments de _quality_flags)
+QUALITY_FIELDS = ('latitude', 'longitude', 'image_url', 'city', 'surface', 'rooms', 'price')
+
+
+def _quality_flags(latitude, longitude, image_url, city, surface, rooms, price):
+    failed = (
+        not (latitude and longitude),
+        not _image_is_valid(image_url),
+        not _city_is_valid(city),
+        not (surface and surface > 0),
+        not (rooms and rooms > 0),
+        not (price and price > 0),
+    )
+    return sum(1 << i for i, bad in enumerate(failed) if bad)
+
+
+def quality_flags(listing):
+    """Bitmask des contrôles en échec pour une annonce (bit i = QUALITY_CHECKS[i])"""
+    return _quality_flags(*map(listing.get, QUALITY_FIELDS))
+
+
+def _quality_delta(deltas, site, flags, sign):
+    """Ajouter (sign=1) ou retrancher (sign=-1) une annonce des compteurs d'un site"""
+    counters = deltas.setdefault(site, {})
+    counters['total'] = counters.get('total', 0) + sign
+    for i, check in enumerate(QUALITY_CHECKS):
+        if flags >> i & 1:
+            counters[check] = counters.get(check, 0) + sign
+
+
+def _duplicate_url_counts(conn, urls):
+    """Annonces par site dont l'URL (parmi `urls`) est partagée par plusieurs annonces"""
+    counts = {}
+    urls = list(urls)
+    for i in range(0, len(urls), 500):
+        batch = urls[i:i + 500]
+        placeholders = ','.join('?' * len(batch))
+        for site, n in conn.execute(f'''
+            SELECT site, COUNT(*) FROM listing_quality_members
+            WHERE url IN (SELECT url FROM listing_quality_members
+                          WHERE url IN ({placeholders}) GROUP BY url HAVING COUNT(*) > 1)
+            GROUP BY site
+        ''', batch):
+            counts[site] = counts.get(site, 0) + n
+    return counts
+
+
+def update_quality(listings, db_path='listings.db', conn=None):
+    """
+    Mettre à jour les compteurs de qualité à partir des changements depuis le dernier build.
+
+    Args:
+        conn: Transaction du build (generator_transaction) ; par défaut, transaction propre
+
+    Returns:
+        tuple: (nouvelles, supprimées) — les modifications comptent dans les deux
+    """
+    with generator_transaction(db_path, conn) as conn:
+        stored = {
+            row[0]: row[1:] for row in conn.execute(
+                'SELECT listing_id, site, url, flags FROM listing_quality_members')
+        }
+        current = {}
+        fields = listing_fields(listings, 'listing_id', 'site', 'url', *QUALITY_FIELDS)
+        for listing_id, site, url, *checked in map(fields, listings):
+            current[listing_id] = (site or 'Inconnu', url or None, _quality_flags(*checked))
+
+        removed = [lid for lid, row in stored.items() if current.get(lid) != row]
+        added = [lid for lid, values in current.items() if stored.get(lid) != values]
+
+        if removed or added:
+            deltas = {}
+            touched_urls = {stored[lid][1] for lid in removed} | {current[lid][1] for lid in added}
+            touched_urls.discard(None)
+
+            # URL en double : retirer la contribution des URL touchées, appliquer, recompter
+            for site, n in _duplicate_url_counts(conn, touched_urls).items():
+                deltas.setdefault(site, {})[QUALITY_DUPLICATE_URL] = -n
+            for lid in removed:
+                site, _, flags = stored[lid]
+                _quality_delta(deltas, site, flags, -1)
+            conn.executemany('DELETE FROM listing_quality_members WHERE listing_id = ?',
+                             [(lid,) for lid in removed])
+            conn.executemany('INSERT INTO listing_quality_members VALUES (?, ?, ?, ?)',
+                             [(lid,) + current[lid] for lid in added])
+            for lid in added:
+                site, _, flags = current[lid]
+                _quality_delta(deltas, site, flags, 1)
+            for site, n in _duplicate_url_counts(conn, touched_urls).items():
+                counters = deltas.setdefault(site, {})
+                counters[QUALITY_DUPLICATE_URL] = counters.get(QUALITY_DUPLICATE_URL, 0) + n
+
+            conn.executemany('''
+                INSERT INTO listing_quality (site, check_name, count) VALUES (?, ?, ?)
+                ON CONFLICT(site, check_name) DO UPDATE SET count = count + excluded.count
+            ''', [(site, check, n) for site, counters in deltas.items()
+                  for check, n in counters.items() if n])
+            conn.execute('DELETE FROM listing_quality WHERE count <= 0')
+
+        # Série quotidienne : une ligne par jour, écrasée par le dernier build du jour
+        sites = _quality_from_tables(conn)
+        today = datetime.now().strftime('%Y-%m-%d')
+        conn.execute('''
+            INSERT INTO listing_quality_daily (date, total, sites) VALUES (?, ?, ?)
+            ON CONFLICT(date) DO UPDATE SET total = excluded.total, sites = excluded.sites
+        ''', (today, sum(c['total'] for c in sites.values()), json.dumps(sites, ensure_ascii=False)))
+
+    return len(added), len(removed)
+
+
+def _quality_from_tables(conn):
+    """Compteurs {site: {'total', contrôle: nb}} depuis listing_quality (sites triés par nom)"""
+    sites = {}
+    for site, check, count in conn.execute(
+            'SELECT site, check_name, count FROM listing_quality WHERE count > 0 ORDER BY site'):
+        counters = sites.setdefault(site, dict.fromkeys(('total',) + QUALITY_CHECKS + (QUALITY_DUPLICATE_URL,), 0))
+        counters[check] = count
+    return sites
+
+
+def calc_quality(listings):
+    """Mêmes compteurs que listing_quality, recalculés depuis zéro (contrôle / sans base)"""
+    deltas = {}
+    urls = {}
+    fields = listing_fields(listings, 'site', 'url', *QUALITY_FIELDS)
+    for site, url, *checked in map(fields, listings):
+        site = site or 'Inconnu'
+        _quality_delta(deltas, site, _quality_flags(*checked), 1)
+        if url:
+            urls.setdefault(url, []).append(site)
+    for sites in urls.values():
+        if len(sites) > 1:
+            for site in sites:
+                counters = deltas[site]
+                counters[QUALITY_DUPLICATE_URL] = counters.get(QUALITY_DUPLICATE_URL, 0) + 1
+    empty = ('total',) + QUALITY_CHECKS + (QUALITY_DUPLICATE_URL,)
+    return {site: {key: deltas[site].get(key, 0) for key in empty} for site in sorted(deltas)}
+
+
+def read_quality(db_path='listings.db', conn=None):
+    """Compteurs courants et série quotidienne (listing_quality*), pour data/quality.js"""
+    own_conn = conn is None
+    if own_conn:
+        conn = open_readonly_db(db_path)
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'listing_quality_daily'"
+        ).fetchone()
+        if not exists:
+            return {'checks': list(QUALITY_CHECKS) + [QUALITY_DUPLICATE_URL], 'sites': {}, 'daily': []}
+        daily = [
+            {'date': date, 'total': total, 'sites': json.loads(sites)}
+            for date, total, sites in conn.execute(
+                'SELECT date, total, sites FROM listing_quality_daily ORDER BY date')
+        ]
+        return {
+            'checks': list(QUALITY_CHECKS) + [QUALITY_DUPLICATE_URL],
+            'sites': _quality_from_tables(conn),
+            'daily': daily,
+        }
+    finally:
+        if own_conn:
+            conn.close()
+
+
 def calculate_time_ago(date_str):
     """Calculer le temps écoulé depuis une date"""
     if not date_str:
@@ -262,9 +1673,133 @@ def calculate_market_stats_detailed(listings, stats=None):
     return stats
 
 
-def download_and_compress_image(image_url, listing_id, images_dir=IMAGES_DIR):
-    """
-    Télécharger une image, la compresser et la sauvegarder localement.
+def image_filename(listing_id):
+    """Nom du fichier image local d'une annonce"""
+    safe_id = listing_id.replace('/', '_').replace('\\', '_')
+    return f"{safe_id}.jpg"
+
+
+IMAGE_DOWNLOAD_CHUNK = 64 * 1024  # lecture de la réponse HTTP par blocs
+
+
+def compress_image(src_path, dest_path):
+    """
+    Vignette JPEG de src_path dans dest_path (Pillow requis).
+
+    - JPEG déjà assez petit, sans EXIF : copié tel quel (pas de ré-encodage)
+    - JPEG plus grand : draft() décode directement à 1/2, 1/4 ou 1/8 dans le
+      domaine DCT, puis thumbnail(reducing_gap) finit la réduction
+    - EXIF (GPS, appareil...) non recopié ; l'orientation est appliquée avant
+
+    Returns:
+        bool: True si dest_path a été écrit
+    """
+    Image = get_pil_image()
+    if Image is None:
+        return False
+    from PIL import ImageOps
+
+    with Image.open(src_path) as img:
+        if img.format == 'JPEG' and img.width <= IMAGE_MAX_WIDTH and img.mode in ('RGB', 'L') \
+                and 'exif' not in img.info:
+            img.close()
+            os.replace(src_path, dest_path)
+            return True
+
+        # Orientation EXIF appliquée avant thumbnail() : la largeur cible est celle de
+        # l'image affichée (orientations 5-8 = largeur et hauteur stockées inversées)
+        orientation = img.getexif().get(0x0112, 1)
+        swapped = orientation in (5, 6, 7, 8)
+        width, height = (img.height, img.width) if swapped else img.size
+        if width > IMAGE_MAX_WIDTH:
+            target = (IMAGE_MAX_WIDTH, max(1, round(height * IMAGE_MAX_WIDTH / width)))
+            img.draft('RGB', target[::-1] if swapped else target)
+        if orientation != 1:
+            img = ImageOps.exif_transpose(img)
+        if width > IMAGE_MAX_WIDTH:
+            img.thumbnail(target, Image.LANCZOS, reducing_gap=3.0)
+
+        # Convertir en RGB si nécessaire (pour JPEG)
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        tmp_path = f"{dest_path}.{os.getpid()}.tmp"
+        try:
+            img.save(tmp_path, 'JPEG', quality=IMAGE_QUALITY, optimize=True)
+            os.replace(tmp_path, dest_path)
+        except BaseException:
+            # Pas de .tmp orphelin dans images/ si l'encodage ou le renommage échoue
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    return True
+
+
+def benchmark_images(n=20, width=2400, height=1600):
+    """
+    Temps CPU par image : ancien chemin (décodage complet + resize LANCZOS)
+    contre compress_image (draft + thumbnail), sur des JPEG synthétiques.
+
+    Returns:
+        tuple: (ms/image ancien chemin, ms/image compress_image) ou None sans Pillow
+    """
+    import shutil
+    import tempfile
+    import time
+
+    Image = get_pil_image()
+    if Image is None:
+        print("  Pillow absent : benchmark images ignoré")
+        return None
+
+    tmp_dir = tempfile.mkdtemp(prefix='bench-images-')
+    try:
+        # Photo synthétique : dégradés + bruit (compression réaliste), avec EXIF
+        base = Image.merge('RGB', (Image.linear_gradient('L').resize((width, height)),
+                                   Image.effect_noise((width, height), 40),
+                                   Image.radial_gradient('L').resize((width, height))))
+        exif = Image.Exif()
+        exif[0x010F] = 'Bench'  # Make
+        sources = []
+        for i in range(n):
+            path = os.path.join(tmp_dir, f'src_{i}.jpg')
+            base.save(path, 'JPEG', quality=90, exif=exif)
+            sources.append(path)
+
+        def legacy(src, dest):
+            img = Image.open(src)
+            if img.mode in ('RGBA', 'P', 'LA'):
+                img = img.convert('RGB')
+            if img.width > IMAGE_MAX_WIDTH:
+                img = img.resize((IMAGE_MAX_WIDTH, int(img.height * IMAGE_MAX_WIDTH / img.width)), Image.LANCZOS)
+            img.save(dest, 'JPEG', quality=IMAGE_QUALITY, optimize=True)
+
+        def fast(src, dest):
+            # compress_image consomme sa source (copie sans ré-encodage) : travailler sur une copie
+            work = f'{src}.work'
+            shutil.copyfile(src, work)
+            compress_image(work, dest)
+
+        results = []
+        print(f"Benchmark images : {n} JPEG {width}x{height} → {IMAGE_MAX_WIDTH}px")
+        for label, func in (('ancien', legacy), ('draft', fast)):
+            start = time.process_time()
+            for i, src in enumerate(sources):
+                func(src, os.path.join(tmp_dir, f'{label}_{i}.jpg'))
+            per_image = (time.process_time() - start) * 1000 / n
+            size = os.path.getsize(os.path.join(tmp_dir, f'{label}_0.jpg'))
+            results.append(per_image)
+            print(f"  {label:<7} {per_image:8.1f} ms CPU/image  ({size / 1024:.1f} Ko)")
+        return tuple(results)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def download_and_compress_image(image_url, listing_id, images_dir=IMAGES_DIR):
+    """
+    Télécharger une image, la compresser et la sauvegarder localement.
 
     Args:
         image_url: URL de l'image source
@@ -285,8 +1820,7 @@ def download_and_compress_image(image_url, listing_id, images_dir=IMAGES_DIR):
     os.makedirs(images_dir, exist_ok=True)
 
     # Nom du fichier basé sur listing_id
-    safe_id = listing_id.replace('/', '_').replace('\\', '_')
-    local_filename = f"{safe_id}.jpg"
+    local_filename = image_filename(listing_id)
     local_path = os.path.join(images_dir, local_filename)
     relative_path = f"images/{local_filename}"
 
@@ -294,6 +1828,9 @@ def download_and_compress_image(image_url, listing_id, images_dir=IMAGES_DIR):
     if os.path.exists(local_path):
         return relative_path
 
+    import urllib.request
+
+    part_path = _image_state_path(images_dir, f"{local_filename}.{os.getpid()}.part")
     try:
         # Télécharger l'image avec headers pour éviter blocage
         headers = {
@@ -302,125 +1839,344 @@ def download_and_compress_image(image_url, listing_id, images_dir=IMAGES_DIR):
         }
         req = urllib.request.Request(image_url, headers=headers)
 
-        with urllib.request.urlopen(req, timeout=10) as response:
-            image_data = response.read()
-
-        if not image_data or len(image_data) < 1000:  # Image trop petite = probablement erreur
+        # Réponse écrite par blocs dans images/.state/ (jamais entière en mémoire)
+        size = 0
+        with urllib.request.urlopen(req, timeout=10) as response, open(part_path, 'wb') as f:
+            while True:
+                chunk = response.read(IMAGE_DOWNLOAD_CHUNK)
+                if not chunk:
+                    break
+                f.write(chunk)
+                size += len(chunk)
+
+        if size < 1000:  # Image trop petite = probablement erreur
             return None
 
-        # Compresser avec Pillow si disponible
-        if PIL_AVAILABLE:
-            from io import BytesIO
-            img = Image.open(BytesIO(image_data))
-
-            # Convertir en RGB si nécessaire (pour JPEG)
-            if img.mode in ('RGBA', 'P', 'LA'):
-                img = img.convert('RGB')
-
-            # Redimensionner si trop large
-            if img.width > IMAGE_MAX_WIDTH:
-                ratio = IMAGE_MAX_WIDTH / img.width
-                new_height = int(img.height * ratio)
-                img = img.resize((IMAGE_MAX_WIDTH, new_height), Image.LANCZOS)
-
-            # Sauvegarder compressé
-            img.save(local_path, 'JPEG', quality=IMAGE_QUALITY, optimize=True)
-        else:
-            # Sans Pillow, sauvegarder tel quel
-            with open(local_path, 'wb') as f:
-                f.write(image_data)
+        # Compresser avec Pillow si disponible, sinon sauvegarder tel quel
+        if not compress_image(part_path, local_path):
+            os.replace(part_path, local_path)
 
         return relative_path
 
     except Exception as e:
         # Silencieux - beaucoup d'images seront bloquées par hotlink protection
         return None
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
 
+# Fichiers d'état de l'étape images, dans un sous-dossier : les écrire ne modifie
+# pas le mtime du dossier images/ (utilisé pour détecter les ajouts/suppressions)
+IMAGE_STATE_DIR = '.state'
+IMAGE_INDEX_FILE = 'index.json'
+IMAGE_GC_GRACE_SECONDS = 3 * 24 * 3600   # une image non référencée est gardée 3 jours
+IMAGE_GC_BATCH = 500                     # suppressions par lot (index sauvegardé entre les lots)
+IMAGE_GC_MAX_UNREFERENCED_RATIO = 0.5    # au-delà, lecture de la base suspecte : pas de sweep
 
-def cleanup_old_images(current_listing_ids, images_dir=IMAGES_DIR):
+
+def _write_json_atomic(path, data):
+    """Écrire un JSON via fichier temporaire + os.replace (jamais de fichier tronqué)"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def _image_state_path(images_dir, filename):
+    """Chemin d'un fichier d'état de l'étape images (crée images/.state/)"""
+    state_dir = os.path.join(images_dir, IMAGE_STATE_DIR)
+    os.makedirs(state_dir, exist_ok=True)
+    return os.path.join(state_dir, filename)
+
+
+def load_image_index(images_dir=IMAGES_DIR):
     """
-    Supprimer les images des annonces qui n'existent plus.
+    Index du stock d'images : {nom: {size, mtime, ids, unreferenced_since}}.
+
+    Le dossier n'est re-parcouru (os.scandir) que si son mtime a changé depuis la
+    dernière mise à jour de l'index, c.-à-d. si des fichiers ont été ajoutés ou retirés.
+    """
+    path = _image_state_path(images_dir, IMAGE_INDEX_FILE)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {'dir_mtime': None, 'files': {}}
+
+    dir_mtime = os.stat(images_dir).st_mtime_ns
+    if index.get('dir_mtime') == dir_mtime:
+        return index
+
+    files = index['files']
+    seen = set()
+    with os.scandir(images_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.jpg') or not entry.is_file():
+                continue
+            seen.add(entry.name)
+            st = entry.stat()
+            known = files.get(entry.name)
+            if not known or known['size'] != st.st_size or known['mtime'] != int(st.st_mtime):
+                files[entry.name] = {
+                    'size': st.st_size,
+                    'mtime': int(st.st_mtime),
+                    'ids': [entry.name[:-len('.jpg')]],
+                    'unreferenced_since': known.get('unreferenced_since') if known else None,
+                }
+    for name in list(files):
+        if name not in seen:
+            del files[name]
+    index['dir_mtime'] = dir_mtime
+    return index
+
+
+def cleanup_old_images(current_listing_ids, images_dir=IMAGES_DIR, grace_seconds=IMAGE_GC_GRACE_SECONDS,
+                       dry_run=False):
+    """
+    Supprimer les images des annonces qui n'existent plus (mark-and-sweep).
+
+    Mark : chaque image de l'index est marquée référencée ou non par les annonces
+    actuelles ; une image non référencée note depuis quand. Sweep : seules les images
+    non référencées depuis plus de grace_seconds sont supprimées, par lots.
+    Garde-fous : aucun sweep si la liste d'annonces est vide ou si une part anormale
+    du stock devient non référencée d'un coup (lecture de base transitoire).
 
     Args:
         current_listing_ids: Set des IDs d'annonces actuelles
         images_dir: Dossier des images
+        grace_seconds: Délai avant suppression d'une image non référencée
+        dry_run: Afficher le rapport sans rien supprimer
 
     Returns:
-        int: Nombre d'images supprimées
+        int: Nombre d'images supprimées (ou à supprimer en dry_run)
     """
+    import time
+
     if not os.path.exists(images_dir):
         return 0
+    if not current_listing_ids:
+        print("   ⚠️  Nettoyage images ignoré : aucune annonce courante")
+        return 0
 
-    deleted_count = 0
-
-    for filename in os.listdir(images_dir):
-        if not filename.endswith('.jpg'):
-            continue
+    index = load_image_index(images_dir)
+    files = index['files']
+    referenced = {image_filename(lid) for lid in current_listing_ids}
+    now = int(time.time())
+
+    # Mark
+    newly_unreferenced = 0
+    for name, info in files.items():
+        if name in referenced:
+            info['unreferenced_since'] = None
+        elif info['unreferenced_since'] is None:
+            info['unreferenced_since'] = now
+            newly_unreferenced += 1
+
+    index_path = _image_state_path(images_dir, IMAGE_INDEX_FILE)
+    if files and newly_unreferenced > IMAGE_GC_MAX_UNREFERENCED_RATIO * len(files):
+        print(f"   ⚠️  {newly_unreferenced}/{len(files)} images deviennent orphelines d'un coup : "
+              f"sweep annulé par sécurité")
+        for info in files.values():
+            if info['unreferenced_since'] == now:
+                info['unreferenced_since'] = None
+        _write_json_atomic(index_path, index)
+        return 0
 
-        # Extraire l'ID de l'annonce du nom de fichier
-        listing_id = filename.replace('.jpg', '')
+    # Sweep
+    expired = sorted(name for name, info in files.items()
+                     if info['unreferenced_since'] is not None
+                     and now - info['unreferenced_since'] >= grace_seconds)
+    if dry_run:
+        freed = sum(files[name]['size'] for name in expired)
+        waiting = sum(1 for info in files.values() if info['unreferenced_since'] is not None) - len(expired)
+        print(f"   🔎 Dry-run : {len(expired)} images à supprimer ({freed // 1024} Ko), "
+              f"{waiting} en période de grâce")
+        for name in expired[:20]:
+            print(f"      - {name}")
+        _write_json_atomic(index_path, index)
+        return len(expired)
 
-        # Si l'annonce n'existe plus, supprimer l'image
-        if listing_id not in current_listing_ids:
+    deleted_count = 0
+    for start in range(0, len(expired), IMAGE_GC_BATCH):
+        for name in expired[start:start + IMAGE_GC_BATCH]:
             try:
-                os.remove(os.path.join(images_dir, filename))
+                os.remove(os.path.join(images_dir, name))
                 deleted_count += 1
-            except Exception:
+            except FileNotFoundError:
                 pass
+            except OSError:
+                continue
+            del files[name]
+        _write_json_atomic(index_path, index)
 
+    index['dir_mtime'] = os.stat(images_dir).st_mtime_ns
+    _write_json_atomic(index_path, index)
     return deleted_count
 
 
-def process_images_for_listings(listings, images_dir=IMAGES_DIR):
+IMAGE_CHECKPOINT_FILE = 'checkpoint.json'
+IMAGE_PROGRESS_FILE = 'progress.log'   # journal en ajout des IDs faits / en échec
+
+
+def _load_image_checkpoint(images_dir):
+    """Checkpoint de l'étape images ({} si absent ou illisible)"""
+    try:
+        with open(_image_state_path(images_dir, IMAGE_CHECKPOINT_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_image_checkpoint(images_dir, checkpoint):
+    """Écrire le checkpoint de façon atomique (un kill ne laisse jamais un fichier tronqué)"""
+    _write_json_atomic(_image_state_path(images_dir, IMAGE_CHECKPOINT_FILE), checkpoint)
+
+
+def _load_image_progress(images_dir):
+    """IDs faits / en échec du journal de progression (ensembles vides si absent)"""
+    done, failed = set(), set()
+    try:
+        with open(_image_state_path(images_dir, IMAGE_PROGRESS_FILE), 'r', encoding='utf-8') as f:
+            for line in f:
+                status, _, listing_id = line.rstrip('\n').partition('\t')
+                if not listing_id:
+                    continue  # ligne tronquée par un kill
+                (done if status == 'done' else failed).add(listing_id)
+    except OSError:
+        pass
+    return done, failed
+
+
+def _open_image_progress(images_dir, done=(), failed=()):
+    """
+    Réécrire le journal avec les entrées reprises puis l'ouvrir en ajout.
+
+    Une ligne par annonce traitée ("done\t<id>" / "failed\t<id>") : coût d'écriture
+    linéaire, quel que soit le nombre de checkpoints.
+    """
+    path = _image_state_path(images_dir, IMAGE_PROGRESS_FILE)
+    write_text_file(path, ''.join(f'done\t{i}\n' for i in done) + ''.join(f'failed\t{i}\n' for i in failed))
+    return open(path, 'a', encoding='utf-8', buffering=1)
+
+
+def image_priority_order(listings, priority_cities=None):
+    """Annonces triées pour le téléchargement : villes prioritaires d'abord, puis les plus récentes"""
+    priority = set(priority_cities or ())
+    ordered = sorted(listings, key=lambda l: str(l.get('created_at') or ''), reverse=True)
+    ordered.sort(key=lambda l: l.get('city') not in priority)  # tri stable
+    return ordered
+
+
+def process_images_for_listings(listings, images_dir=IMAGES_DIR, budget_seconds=None, priority_cities=None):
     """
     Télécharger et compresser les images pour toutes les annonces.
     Met à jour les listings avec le chemin local.
 
+    L'étape est reprenable : un checkpoint (images/.state/checkpoint.json) garde la
+    position dans l'ordre de traitement et un journal en ajout (progress.log) les IDs
+    faits / en échec. Si le run précédent a été interrompu, ses IDs faits sont sautés
+    et ses échecs ne sont pas retentés. Au-delà de budget_seconds, plus aucun
+    téléchargement n'est lancé : les annonces restantes gardent leur URL distante
+    (les images déjà présentes sur disque restent utilisées).
+
     Args:
         listings: Liste des annonces
         images_dir: Dossier de destination
+        budget_seconds: Budget en secondes pour les téléchargements (None = illimité)
+        priority_cities: Villes traitées en premier (défaut: get_priority_cities())
 
     Returns:
         tuple: (nombre téléchargées, nombre échecs)
     """
+    import time
+
     downloaded = 0
     failed = 0
+    skipped = 0
 
     print(f"\n📸 Traitement des images ({len(listings)} annonces)...")
+    os.makedirs(images_dir, exist_ok=True)
 
-    # Créer le set des IDs actuels pour le nettoyage
-    current_ids = {l['listing_id'] for l in listings}
-
-    # Nettoyer les anciennes images
-    deleted = cleanup_old_images(current_ids, images_dir)
-    if deleted > 0:
-        print(f"   🗑️  {deleted} anciennes images supprimées")
-
-    # Télécharger les nouvelles images
-    for i, listing in enumerate(listings):
-        if not listing.get('image_url'):
-            continue
-
-        local_path = download_and_compress_image(
-            listing['image_url'],
-            listing['listing_id'],
-            images_dir
-        )
+    previous = _load_image_checkpoint(images_dir)
+    resumed = bool(previous) and not previous.get('completed')
+    # Run interrompu : ses IDs faits sont sautés, ses échecs ne sont pas retentés
+    # et restent dans le journal du run courant (cumulés d'une reprise à l'autre)
+    known_done, known_failures = _load_image_progress(images_dir) if resumed else (set(), set())
+    if resumed:
+        print(f"   ↩️  Reprise du run interrompu ({len(known_done)} faites, "
+              f"{len(known_failures)} en échec, position {previous.get('position', 0)}/{previous.get('total', '?')})")
+
+    ordered = image_priority_order(
+        [l for l in listings if l.get('image_url')],
+        get_priority_cities() if priority_cities is None else priority_cities
+    )
+    checkpoint = {
+        'started_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'completed': False,
+        'total': len(ordered),
+        'position': 0,
+    }
+    _save_image_checkpoint(images_dir, checkpoint)
+    ordered_ids = {l['listing_id'] for l in ordered}
+    progress = _open_image_progress(images_dir, known_done & ordered_ids, known_failures & ordered_ids)
 
-        if local_path:
-            listing['local_image'] = local_path
-            listing['image_url'] = local_path  # chemin relatif pour le dashboard HTML
-            downloaded += 1
-        else:
-            failed += 1
+    deadline = time.monotonic() + budget_seconds if budget_seconds else None
+    out_of_budget = False
 
-        # Afficher progression tous les 20
-        if (i + 1) % 20 == 0:
-            print(f"   ... {i + 1}/{len(listings)} traitées")
+    try:
+        for i, listing in enumerate(ordered):
+            listing_id = listing['listing_id']
+            local_file = os.path.join(images_dir, image_filename(listing_id))
+
+            if not out_of_budget and deadline and time.monotonic() > deadline:
+                out_of_budget = True
+                print(f"   ⏱️  Budget de {budget_seconds}s atteint : images restantes laissées en URL distante")
+
+            if out_of_budget or listing_id in known_failures:
+                # Plus de téléchargement : seulement les images déjà présentes
+                local_path = f"images/{image_filename(listing_id)}" if os.path.exists(local_file) else None
+                if not local_path:
+                    skipped += 1
+            else:
+                # Image déjà sur disque (dont celles du run interrompu) : pas de
+                # re-téléchargement, download_and_compress_image court-circuite
+                local_path = download_and_compress_image(listing['image_url'], listing_id, images_dir)
+                if listing_id not in known_done or not local_path:
+                    progress.write(f"{'done' if local_path else 'failed'}\t{listing_id}\n")
+                if not local_path:
+                    failed += 1
+
+            if local_path:
+                listing['local_image'] = local_path
+                listing['image_url'] = local_path  # chemin relatif pour le dashboard HTML
+                downloaded += 1
+
+            # Afficher progression + checkpoint tous les 20
+            if (i + 1) % 20 == 0:
+                print(f"   ... {i + 1}/{len(ordered)} traitées")
+                checkpoint['position'] = i + 1
+                _save_image_checkpoint(images_dir, checkpoint)
+    finally:
+        progress.close()
+
+    checkpoint['position'] = len(ordered)
+    checkpoint['completed'] = True
+    _save_image_checkpoint(images_dir, checkpoint)
+
+    # Nettoyer les anciennes images seulement après un passage complet
+    if listings and not out_of_budget:
+        current_ids = {l['listing_id'] for l in listings}
+        dry_run = config_value('IMAGE_GC_DRY_RUN') == '1'
+        deleted = cleanup_old_images(current_ids, images_dir, dry_run=dry_run)
+        if deleted > 0 and not dry_run:
+            print(f"   🗑️  {deleted} anciennes images supprimées")
 
     print(f"   ✅ {downloaded} images téléchargées/compressées")
     if failed > 0:
         print(f"   ⚠️  {failed} images non accessibles (hotlink protection)")
+    if skipped > 0:
+        print(f"   ⏭️  {skipped} images non traitées (budget/échecs précédents), URL distante conservée")
 
     return downloaded, failed
 
@@ -429,7 +2185,9 @@ def calc_anomalies(listings, stats):
     """Calculer les anomalies dans les annonces"""
     anomalies = []
     avg_price = stats['avg_price']
-    prices = [l['price'] for l in listings if l['price'] and l['price'] > 0]
+    fields = listing_fields(listings, 'price', 'price_m2', 'surface', 'city')
+    values = list(map(fields, listings))
+    prices = [price for price, _, _, _ in values if price and price > 0]
 
     if not prices:
         return anomalies
@@ -441,34 +2199,34 @@ def calc_anomalies(listings, stats):
     else:
         std_dev = 0
 
-    for l in listings:
+    for l, (price, price_m2, surface, city) in zip(listings, values):
         reasons = []
 
         # Prix anormalement bas (< 50% du prix moyen)
-        if l['price'] and l['price'] > 0 and avg_price > 0:
-            if l['price'] < avg_price * 0.5:
-                reasons.append(f"Prix bas: {l['price']}€ (moy: {avg_price}€)")
+        if price and price > 0 and avg_price > 0:
+            if price < avg_price * 0.5:
+                reasons.append(f"Prix bas: {price}€ (moy: {avg_price}€)")
 
         # Prix anormalement haut (> 200% du prix moyen)
-        if l['price'] and l['price'] > avg_price * 2:
-            reasons.append(f"Prix élevé: {l['price']}€ (moy: {avg_price}€)")
+        if price and price > avg_price * 2:
+            reasons.append(f"Prix élevé: {price}€ (moy: {avg_price}€)")
 
         # Prix/m² anormal
-        if l.get('price_m2'):
-            if l['price_m2'] > 50:  # > 50€/m² est suspect pour une location
-                reasons.append(f"Prix/m² élevé: {l['price_m2']}€/m²")
-            elif l['price_m2'] < 5:  # < 5€/m² est très bas
-                reasons.append(f"Prix/m² très bas: {l['price_m2']}€/m²")
+        if price_m2:
+            if price_m2 > 50:  # > 50€/m² est suspect pour une location
+                reasons.append(f"Prix/m² élevé: {price_m2}€/m²")
+            elif price_m2 < 5:  # < 5€/m² est très bas
+                reasons.append(f"Prix/m² très bas: {price_m2}€/m²")
 
         # Surface suspecte
-        if l.get('surface'):
-            if l['surface'] > 300:
-                reasons.append(f"Surface très grande: {l['surface']}m²")
-            elif l['surface'] < 15:
-                reasons.append(f"Surface très petite: {l['surface']}m²")
+        if surface:
+            if surface > 300:
+                reasons.append(f"Surface très grande: {surface}m²")
+            elif surface < 15:
+                reasons.append(f"Surface très petite: {surface}m²")
 
         # Données manquantes importantes
-        if not l.get('city') or l['city'] == 'N/A':
+        if not city or city == 'N/A':
             reasons.append("Ville manquante")
 
         if reasons:
@@ -486,77 +2244,1510 @@ def calc_anomalies(listings, stats):
     return anomalies
 
 
-def export_data(listings, stats, data_dir):
-    """Exporter les donnees en fichiers JS + JSON + archive quotidienne"""
-    os.makedirs(data_dir, exist_ok=True)
-    os.makedirs(os.path.join(data_dir, 'history'), exist_ok=True)
-    now_str = datetime.now().strftime("%d/%m/%Y %H:%M")
-    today = datetime.now().strftime('%Y-%m-%d')
 
-    # listings.js
-    listings_json = json.dumps(listings, ensure_ascii=False, indent=2, default=str)
-    with open(os.path.join(data_dir, 'listings.js'), 'w', encoding='utf-8') as f:
-        f.write(f'// Genere le {now_str}\n')
-        f.write(f'// {len(listings)} annonces depuis listings.db\n')
-        f.write(f'const LISTINGS = {listings_json};\n')
+# Colonnes pour lesquelles un ordre de tri est pré-calculé
+FACET_SORT_KEYS = ('price', 'price_m2', 'surface', 'created_at')
 
-    # stats.js
-    colors = ['#FF6384', '#36A2EB', '#FFCE56', '#4BC0C0', '#9966FF', '#FF9F40', '#2ECC71', '#E74C3C', '#3498DB']
-    site_colors = {}
-    for i, site in enumerate(stats['sites'].keys()):
-        site_colors[site] = colors[i % len(colors)]
+# Clé de tri par colonne quand la valeur brute ne se compare pas telle quelle
+# (created_at : formats mélangés selon les sources ; illisible = valeur nulle)
+FACET_SORT_NORMALIZERS = {'created_at': lambda value: _created_at_key(value) or None}
 
-    stats_json = json.dumps(stats, ensure_ascii=False, indent=2)
-    colors_json = json.dumps(site_colors, ensure_ascii=False, indent=2)
-    with open(os.path.join(data_dir, 'stats.js'), 'w', encoding='utf-8') as f:
-        f.write(f'// Genere le {now_str}\n')
-        f.write(f'const STATS = {stats_json};\n')
-        f.write(f'const SITE_COLORS = {colors_json};\n')
-
-    # listings.json (reutilisable)
-    with open(os.path.join(data_dir, 'listings.json'), 'w', encoding='utf-8') as f:
-        json.dump(listings, f, ensure_ascii=False, indent=2, default=str)
-
-    # Archive JSON du jour (historique)
-    history_path = os.path.join(data_dir, 'history', f'{today}.json')
-    with open(history_path, 'w', encoding='utf-8') as f:
-        json.dump({
-            'date': today,
-            'generated_at': now_str,
-            'stats': stats,
-            'listings': listings
-        }, f, ensure_ascii=False, indent=2, default=str)
-
-    # anomalies.js - Détection automatique d'anomalies
-    anomalies = calc_anomalies(listings, stats)
-    anomalies_json = json.dumps(anomalies, ensure_ascii=False, indent=2, default=str)
-    with open(os.path.join(data_dir, 'anomalies.js'), 'w', encoding='utf-8') as f:
-        f.write(f'// Genere le {now_str}\n')
-        f.write(f'// {len(anomalies)} anomalies detectees\n')
-        f.write(f'const ANOMALIES = {anomalies_json};\n')
 
-    # new-listings.json - Nouvelles annonces récentes (derniers 7 jours)
-    from datetime import timedelta
-    cutoff_date = datetime.now() - timedelta(days=7)
-    new_listings = [
-        l for l in listings
-        if l.get('created_at') and datetime.strptime(l['created_at'][:10], '%Y-%m-%d') >= cutoff_date
-    ]
+def _facet_rooms(value):
+    """Clé de facette des pièces : 2, 2.0 et '2' donnent '2' (None si illisible)"""
+    try:
+        rooms = float(value)
+    except (TypeError, ValueError):
+        return None
+    return str(int(rooms)) if rooms.is_integer() else str(rooms)
+
+
+def build_facets(listings):
+    """
+    Pré-calculer les facettes et les ordres de tri pour les filtres côté client.
+
+    Les index renvoyés sont les positions dans LISTINGS (même ordre que listings.js) :
+    le client intersecte les listes d'index des filtres actifs puis parcourt une
+    permutation pré-triée pour paginer, sans re-trier le tableau complet.
+
+    Returns:
+        dict: {'facets': {champ: {valeur: [index, ...]}},
+               'counts': {champ: {valeur: nombre}},
+               'order': {colonne: [index, ...]}}  (tri croissant, valeurs nulles en fin)
+    """
+    facets = {'site': {}, 'city': {}, 'rooms': {}, 'price_bucket': {}}
+
+    # Une seule passe pour toutes les facettes
+    for i, l in enumerate(listings):
+        values = {
+            'site': l.get('site') or 'Inconnu',
+            'city': l.get('city') or 'N/A',
+            'rooms': _facet_rooms(l.get('rooms')),
+            'price_bucket': price_bucket(l.get('price')),
+        }
+        for field, value in values.items():
+            if value is None:
+                continue
+            facets[field].setdefault(str(value), []).append(i)
+
+    counts = {
+        field: {value: len(ids) for value, ids in values.items()}
+        for field, values in facets.items()
+    }
+
+    order = {}
+    for col in FACET_SORT_KEYS:
+        normalize = FACET_SORT_NORMALIZERS.get(col)
+        keys = [l.get(col) for l in listings]
+        if normalize:
+            keys = [normalize(k) if k is not None else None for k in keys]
+        present = [i for i, k in enumerate(keys) if k is not None]
+        missing = [i for i, k in enumerate(keys) if k is None]
+        present.sort(key=keys.__getitem__)
+        order[col] = present + missing
+
+    return {'facets': facets, 'counts': counts, 'order': order}
+
+
+# =============================================================================
+# TENDANCES — agrégats quotidiens calculés depuis data/history/
+# =============================================================================
+# Chaque archive YYYY-MM-DD.json est lue une seule fois : ses agrégats sont mis en
+# cache dans history/.trends-cache.json (avec taille + mtime du fichier). Les builds
+# suivants ne relisent que les jours nouveaux ou réécrits (et le jour suivant,
+# dont les compteurs nouvelles/retirées en dépendent).
+
+TRENDS_CACHE_FILE = '.trends-cache.json'
+TRENDS_CACHE_VERSION = 1
+
+# Tranches de durée de mise en ligne (jours) : (borne haute incluse, libellé)
+DAYS_ON_MARKET_BUCKETS = [(7, '0-7'), (14, '8-14'), (30, '15-30'), (60, '31-60'), (None, '> 60')]
+
+
+def _median(values):
+    """Médiane arrondie (None si liste vide)"""
+    if not values:
+        return None
+    import statistics
+    return round(statistics.median(values), 1)
+
+
+def days_on_market_bucket(days):
+    """Tranche de durée de mise en ligne"""
+    for upper, label in DAYS_ON_MARKET_BUCKETS:
+        if upper is None or days <= upper:
+            return label
+
+
+def _day_aggregates(day, listings):
+    """Agrégats d'une archive quotidienne"""
+    day_date = datetime.strptime(day, '%Y-%m-%d')
+    prices = []
+    prices_m2 = []
+    by_site = {}
+    city_m2 = {}
+    dom = {label: 0 for _, label in DAYS_ON_MARKET_BUCKETS}
+    dom_values = []
+
+    for l in listings:
+        site = l.get('site') or 'Inconnu'
+        by_site[site] = by_site.get(site, 0) + 1
+        if l.get('price') and l['price'] > 0:
+            prices.append(l['price'])
+        if l.get('price_m2'):
+            prices_m2.append(l['price_m2'])
+            city = l.get('city')
+            if city and city != 'N/A':
+                city_m2.setdefault(city, []).append(l['price_m2'])
+        created = l.get('created_at')
+        if created:
+            try:
+                days = (day_date - datetime.strptime(str(created)[:10], '%Y-%m-%d')).days
+            except ValueError:
+                continue
+            days = max(days, 0)
+            dom[days_on_market_bucket(days)] += 1
+            dom_values.append(days)
+
+    return {
+        'total': len(listings),
+        'median_price': _median(prices),
+        'median_price_m2': _median(prices_m2),
+        'median_days_on_market': _median(dom_values),
+        'by_site': by_site,
+        'city_price_m2': {city: _median(values) for city, values in city_m2.items()},
+        'days_on_market': dom,
+    }
+
+
+def _load_history_day(path):
+    """Annonces d'une archive quotidienne ([] si fichier illisible)"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('listings', [])
+    except (OSError, ValueError):
+        return []
+
+
+def build_trends(history_dir):
+    """
+    Calculer les séries de tendances depuis les archives quotidiennes.
+
+    Returns:
+        dict: séries par colonnes (une valeur par date de 'dates')
+    """
+    cache_path = os.path.join(history_dir, TRENDS_CACHE_FILE)
+    cache = {}
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if cache.get('version') != TRENDS_CACHE_VERSION:
+        cache = {'version': TRENDS_CACHE_VERSION, 'days': {}}
+    cached_days = cache['days']
+
+    files = {}
+    if os.path.isdir(history_dir):
+        for entry in os.scandir(history_dir):
+            if re.fullmatch(r'\d{4}-\d{2}-\d{2}\.json', entry.name):
+                st = entry.stat()
+                files[entry.name[:10]] = (entry.path, st.st_size, int(st.st_mtime))
+    dates = sorted(files)
+
+    # Jours à (re)calculer : nouveaux ou modifiés, plus le jour suivant chacun d'eux
+    dirty = set()
+    for i, day in enumerate(dates):
+        entry = cached_days.get(day)
+        if not entry or (entry['size'], entry['mtime']) != files[day][1:]:
+            dirty.add(day)
+            if i + 1 < len(dates):
+                dirty.add(dates[i + 1])
+
+    prev_ids = None
+    for i, day in enumerate(dates):
+        if day not in dirty:
+            prev_ids = None
+            continue
+        listings = _load_history_day(files[day][0])
+        ids = {l.get('listing_id') for l in listings}
+        if i > 0 and prev_ids is None:
+            prev_ids = {l.get('listing_id') for l in _load_history_day(files[dates[i - 1]][0])}
+        entry = _day_aggregates(day, listings)
+        entry['new'] = len(ids - prev_ids) if i > 0 else None
+        entry['removed'] = len(prev_ids - ids) if i > 0 else None
+        entry['size'], entry['mtime'] = files[day][1:]
+        cached_days[day] = entry
+        prev_ids = ids
+
+    # Oublier les jours dont l'archive a disparu
+    for day in list(cached_days):
+        if day not in files:
+            del cached_days[day]
+
+    if dirty:
+        write_text_file(cache_path, json.dumps(cache, ensure_ascii=False, separators=(',', ':')))
+
+    days = [cached_days[d] for d in dates]
+    sites = sorted({s for d in days for s in d['by_site']})
+    cities = sorted({c for d in days for c in d['city_price_m2']})
+    return {
+        'dates': dates,
+        'total': [d['total'] for d in days],
+        'new': [d['new'] for d in days],
+        'removed': [d['removed'] for d in days],
+        'median_price': [d['median_price'] for d in days],
+        'median_price_m2': [d['median_price_m2'] for d in days],
+        'median_days_on_market': [d['median_days_on_market'] for d in days],
+        'by_site': {s: [d['by_site'].get(s, 0) for d in days] for s in sites},
+        'city_price_m2': {c: [d['city_price_m2'].get(c) for d in days] for c in cities},
+        'days_on_market': {label: [d['days_on_market'][label] for d in days]
+                           for _, label in DAYS_ON_MARKET_BUCKETS},
+        'processed_days': len(dirty),
+    }
+
+
+# =============================================================================
+# HEATMAP — prix/m² par cellule de grille, tuiles z/x/y pré-calculées
+# =============================================================================
+# Découpage "slippy map" (celui de Leaflet/OSM) : à chaque zoom, une tuile z/x/y
+# est divisée en 2^HEATMAP_CELL_BITS × 2^HEATMAP_CELL_BITS cellules, chacune avec
+# la médiane du prix/m² et le nombre d'annonces. Sortie :
+#   data/heatmap/{z}/{x}_{y}.json  — cellules de la tuile
+#   data/heatmap/index.json        — tuiles existantes (+ signature de leur contenu)
+# Une tuile n'est recalculée et réécrite que si l'ensemble de ses annonces
+# (id, position, prix/m²) a changé depuis le build précédent.
+HEATMAP_DIR = 'heatmap'
+HEATMAP_INDEX_FILE = 'index.json'
+HEATMAP_ZOOMS = (10, 12, 14)
+HEATMAP_CELL_BITS = 3  # 8×8 cellules par tuile
+HEATMAP_MAX_LAT = 85.05112878  # limite de la projection Web Mercator
+
+
+def heatmap_cells(coords, level):
+    """
+    Indices de cellule (x, y) au niveau `level` (= zoom + HEATMAP_CELL_BITS).
+
+    Vectorisé avec numpy s'il est installé, boucle math sinon.
+    """
+    n = 1 << level
+    if not coords:
+        return []
+    try:
+        import numpy as np
+    except ImportError:
+        import math
+        cells = []
+        for lat, lon in coords:
+            lat = math.radians(max(-HEATMAP_MAX_LAT, min(HEATMAP_MAX_LAT, lat)))
+            x = int((lon + 180.0) / 360.0 * n)
+            y = int((1.0 - math.asinh(math.tan(lat)) / math.pi) / 2.0 * n)
+            cells.append((min(max(x, 0), n - 1), min(max(y, 0), n - 1)))
+        return cells
+
+    c = np.asarray(coords, dtype=float)
+    lat = np.radians(np.clip(c[:, 0], -HEATMAP_MAX_LAT, HEATMAP_MAX_LAT))
+    x = np.floor((c[:, 1] + 180.0) / 360.0 * n)
+    y = np.floor((1.0 - np.arcsinh(np.tan(lat)) / np.pi) / 2.0 * n)
+    x = np.clip(x, 0, n - 1).astype(np.int64)
+    y = np.clip(y, 0, n - 1).astype(np.int64)
+    return list(zip(x.tolist(), y.tolist()))
+
+
+def heatmap_cell_center(cx, cy, level):
+    """Centre (lat, lon) d'une cellule"""
+    import math
+    n = 1 << level
+    lon = (cx + 0.5) / n * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (cy + 0.5) / n))))
+    return round(lat, 5), round(lon, 5)
+
+
+def _heatmap_signature(members):
+    import hashlib
+    digest = hashlib.sha1()
+    for member in sorted(members):
+        digest.update(repr(member).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def build_heatmap(listings, heatmap_dir, zooms=HEATMAP_ZOOMS):
+    """
+    Construire les tuiles heatmap prix/m² dans heatmap_dir.
+
+    Returns:
+        dict: {'tiles': nb de tuiles, 'written': [fichiers réécrits], 'removed': nb supprimées}
+    """
+    points = [(l['listing_id'], l['latitude'], l['longitude'], l['price_m2']) for l in listings
+              if l.get('latitude') and l.get('longitude') and l.get('price_m2')]
+    coords = [(p[1], p[2]) for p in points]
+
+    index_path = os.path.join(heatmap_dir, HEATMAP_INDEX_FILE)
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous.get('cell_bits') != HEATMAP_CELL_BITS:
+            previous = {}
+    except (OSError, ValueError):
+        previous = {}
+    previous_tiles = previous.get('tiles', {})
+
+    # (z, x, y) → {(cx, cy): [points]}
+    tiles = {}
+    for z in zooms:
+        level = z + HEATMAP_CELL_BITS
+        for (cx, cy), point in zip(heatmap_cells(coords, level), points):
+            key = (z, cx >> HEATMAP_CELL_BITS, cy >> HEATMAP_CELL_BITS)
+            tiles.setdefault(key, {}).setdefault((cx, cy), []).append(point)
+
+    index_tiles = {}
+    written = []
+    for (z, x, y), cells in sorted(tiles.items()):
+        tile_id = f'{z}/{x}_{y}'
+        members = [p for cell in cells.values() for p in cell]
+        signature = _heatmap_signature(members)
+        path = os.path.join(heatmap_dir, str(z), f'{x}_{y}.json')
+        prev = previous_tiles.get(tile_id)
+        if prev and prev.get('sig') == signature and os.path.exists(path):
+            index_tiles[tile_id] = prev
+            continue
+
+        level = z + HEATMAP_CELL_BITS
+        mask = (1 << HEATMAP_CELL_BITS) - 1
+        rows = []
+        for (cx, cy), cell in sorted(cells.items()):
+            lat, lon = heatmap_cell_center(cx, cy, level)
+            rows.append([cx & mask, cy & mask, lat, lon, _median([p[3] for p in cell]), len(cell)])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_text_file(path, json_dumps({'z': z, 'x': x, 'y': y, 'cells': rows}, pretty=False))
+        written.append(path)
+        index_tiles[tile_id] = {'sig': signature, 'count': len(members),
+                                'median': _median([p[3] for p in members])}
+
+    # Tuiles qui ne contiennent plus aucune annonce
+    removed = 0
+    for tile_id in previous_tiles:
+        if tile_id not in index_tiles:
+            z, xy = tile_id.split('/')
+            try:
+                os.remove(os.path.join(heatmap_dir, z, f'{xy}.json'))
+                removed += 1
+            except FileNotFoundError:
+                pass
+
+    os.makedirs(heatmap_dir, exist_ok=True)
+    write_text_file(index_path, json_dumps({
+        'zooms': list(zooms),
+        'cell_bits': HEATMAP_CELL_BITS,
+        'cell_columns': ['dx', 'dy', 'lat', 'lon', 'median_price_m2', 'count'],
+        'tiles': index_tiles,
+    }, pretty=False))
+    return {'tiles': len(index_tiles), 'written': written, 'removed': removed}
+
+
+# =============================================================================
+# ALERTES — recherches sauvegardées évaluées au build
+# =============================================================================
+# Fichier saved_searches.json (chemin : SAVED_SEARCHES_PATH) : liste JSON de
+#   {"id": "loyer-centre", "name": "...", "city": "Belair" | ["Belair", "Merl"],
+#    "site": ..., "price_max": 1800, "surface_min": 60, "rooms_min": 2, ...}
+# Bornes disponibles : price/surface/rooms _min/_max ; comme dans alerts.html,
+# "price" seul vaut price_max, "surface" et "rooms" seuls valent _min, et une
+# annonce sans valeur (0/None) ne fait pas échouer le critère.
+#
+# Toutes les recherches sont compilées en un index : ensembles de recherches
+# représentés en masques de bits (int), tables de hachage ville/site, bornes
+# triées avec masques cumulés (bisect). Évaluer une annonce coûte quelques
+# bisect et AND, quel que soit le nombre de recherches.
+#
+# Seules les annonces nouvelles depuis le build précédent sont évaluées ; une
+# recherche ajoutée ou modifiée est évaluée sur toutes les annonces. L'état
+# (annonces vues, correspondances) est gardé dans data/.alert-state.json.
+SAVED_SEARCHES_FILE = 'saved_searches.json'
+ALERT_STATE_FILE = '.alert-state.json'
+ALERT_RANGE_FIELDS = ('price', 'surface', 'rooms')
+# Critère sans suffixe : sens de la borne (identique au formulaire de alerts.html)
+ALERT_SHORTHAND_BOUNDS = {'price': 'max', 'surface': 'min', 'rooms': 'min'}
+
+
+def _as_list(value):
+    if value in (None, '', []):
+        return None
+    return [value] if isinstance(value, str) else list(value)
+
+
+def load_saved_searches(path=None):
+    """Recherches sauvegardées normalisées ([] si le fichier n'existe pas)"""
+    import hashlib
+
+    path = path or config_value('SAVED_SEARCHES_PATH', SAVED_SEARCHES_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        raw = json.load(f)
+    if isinstance(raw, dict):
+        raw = raw.get('searches', [])
+
+    searches = []
+    for i, entry in enumerate(raw):
+        cities = _as_list(entry.get('city') or entry.get('cities'))
+        sites = _as_list(entry.get('site') or entry.get('sites'))
+        search = {
+            'id': str(entry.get('id') or entry.get('name') or i),
+            'name': entry.get('name') or str(entry.get('id') or i),
+            'cities': sorted({normalize_city_name(c) for c in cities}) if cities else None,
+            'sites': sorted(set(sites)) if sites else None,
+        }
+        for field in ALERT_RANGE_FIELDS:
+            bounds = {'min': entry.get(f'{field}_min'), 'max': entry.get(f'{field}_max')}
+            if entry.get(field):
+                bounds[ALERT_SHORTHAND_BOUNDS[field]] = entry[field]
+            search[field] = (bounds['min'] or None, bounds['max'] or None)
+        # Signature des critères : une recherche modifiée est réévaluée entièrement
+        search['signature'] = hashlib.sha1(json.dumps(
+            [search[k] for k in ('cities', 'sites') + ALERT_RANGE_FIELDS]).encode('utf-8')).hexdigest()[:16]
+        searches.append(search)
+    return searches
+
+
+def _range_masks(bounds):
+    """
+    Index d'une borne : valeurs triées + masques cumulés.
+
+    bounds : [(valeur, bit)] ; masks[k] = recherches des k plus petites valeurs,
+    donc masks[bisect_right(values, v)] = recherches dont la valeur est <= v.
+    """
+    bounds = sorted(bounds)
+    values = [b[0] for b in bounds]
+    masks = [0]
+    for _, bit in bounds:
+        masks.append(masks[-1] | bit)
+    return values, masks
+
+
+def compile_search_index(searches):
+    """Index de toutes les recherches (masques de bits par critère)"""
+    all_mask = (1 << len(searches)) - 1
+    index = {'searches': searches, 'all': all_mask,
+             'city': {}, 'city_any': 0, 'site': {}, 'site_any': 0, 'ranges': {}}
+    for dim, key in (('city', 'cities'), ('site', 'sites')):
+        for i, search in enumerate(searches):
+            if search[key] is None:
+                index[f'{dim}_any'] |= 1 << i
+            else:
+                for value in search[key]:
+                    index[dim][value] = index[dim].get(value, 0) | 1 << i
+
+    for field in ALERT_RANGE_FIELDS:
+        lows, highs = [], []
+        no_low = no_high = 0
+        for i, search in enumerate(searches):
+            lo, hi = search[field]
+            if lo is None:
+                no_low |= 1 << i
+            else:
+                lows.append((lo, 1 << i))
+            if hi is None:
+                no_high |= 1 << i
+            else:
+                # Bornes hautes triées par valeur décroissante (négation)
+                highs.append((-hi, 1 << i))
+        index['ranges'][field] = (no_low, _range_masks(lows), no_high, _range_masks(highs))
+    return index
+
+
+def match_searches(index, listing):
+    """Masque des recherches auxquelles l'annonce correspond"""
+    from bisect import bisect_right
+
+    mask = (index['city_any'] | index['city'].get(listing.get('city'), 0)) \
+        & (index['site_any'] | index['site'].get(listing.get('site'), 0))
+    for field, (no_low, (lows, low_masks), no_high, (highs, high_masks)) in index['ranges'].items():
+        if not mask:
+            break
+        value = listing.get(field)
+        if not value:
+            continue
+        # lo <= value : les bornes basses triées jusqu'à value ; hi >= value : -hi <= -value
+        mask &= no_low | low_masks[bisect_right(lows, value)]
+        mask &= no_high | high_masks[bisect_right(highs, -value)]
+    return mask
+
+
+def _mask_bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def _alert_listing_signature(listing):
+    """Empreinte des champs lus par match_searches : une annonce modifiée est réévaluée"""
+    import hashlib
+    raw = '|'.join(str(listing.get(field)) for field in ('city', 'site') + ALERT_RANGE_FIELDS)
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def evaluate_saved_searches(listings, searches, state_path):
+    """
+    Correspondances de chaque recherche, évaluées incrémentalement.
+
+    Les recherches inchangées ne réévaluent que les annonces nouvelles ou dont un
+    champ filtrable (ville, site, prix, surface, chambres) a changé depuis le run
+    précédent ; « new » liste les annonces qui entrent dans la recherche.
+
+    Returns:
+        dict: {'searches': [{id, name, count, matches, new}], 'evaluated': nb d'annonces évaluées}
+    """
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    # Ancien état (liste 'seen' sans empreintes) : annonces connues mais à réévaluer
+    known = state.get('listings') or dict.fromkeys(state.get('seen', ()), None)
+    previous = state.get('searches', {})
+
+    signatures = {l['listing_id']: _alert_listing_signature(l) for l in listings}
+    changed_listings = [l for l in listings if known.get(l['listing_id'], '') != signatures[l['listing_id']]]
+    changed_ids = {l['listing_id'] for l in changed_listings}
+
+    # Recherches inchangées : correspondances conservées (sans les annonces retirées
+    # ni les annonces modifiées, réévaluées ci-dessous)
+    matches = {}
+    previous_matches = {}
+    stale = []
+    for search in searches:
+        prev = previous.get(search['id'])
+        if prev and prev.get('signature') == search['signature']:
+            previous_matches[search['id']] = set(prev.get('matches', ()))
+            matches[search['id']] = {i for i in previous_matches[search['id']]
+                                     if i in signatures and i not in changed_ids}
+        else:
+            matches[search['id']] = set()
+            stale.append(search)
+
+    # Un seul index par passe : recherches inchangées × annonces nouvelles/modifiées,
+    # recherches nouvelles/modifiées × toutes les annonces
+    fresh = [search for search in searches if search not in stale]
+    new_matches = {search['id']: set() for search in searches}
+    evaluated = 0
+    for subset, candidates in ((fresh, changed_listings), (stale, listings)):
+        if not subset or not candidates:
+            continue
+        index = compile_search_index(subset)
+        for listing in candidates:
+            listing_id = listing['listing_id']
+            for bit in _mask_bits(match_searches(index, listing)):
+                search_id = subset[bit]['id']
+                matches[search_id].add(listing_id)
+                # Recherche inchangée : entrée dans la recherche ; sinon : annonce inconnue
+                before = previous_matches.get(search_id, known)
+                if listing_id not in before:
+                    new_matches[search_id].add(listing_id)
+        evaluated += len(candidates)
+
+    order = {l['listing_id']: n for n, l in enumerate(listings)}
+    results = []
+    for search in searches:
+        ids = sorted(matches[search['id']], key=order.__getitem__)
+        results.append({
+            'id': search['id'],
+            'name': search['name'],
+            'count': len(ids),
+            'matches': ids,
+            'new': [i for i in ids if i in new_matches[search['id']]],
+        })
+
+    _write_json_atomic(state_path, {
+        'listings': signatures,
+        'searches': {s['id']: {'signature': s['signature'], 'matches': r['matches']}
+                     for s, r in zip(searches, results)},
+    })
+    return {'searches': results, 'evaluated': evaluated}
+
+
+# =============================================================================
+# ANNONCES SIMILAIRES — k plus proches voisins pré-calculés
+# =============================================================================
+# Distance² entre deux annonces : écarts normalisés (z-score pondéré) de prix,
+# surface, chambres et prix/m², distance géographique (SIMILAR_DISTANCE_KM ≈ un
+# écart-type) et pénalité si la ville diffère. Valeur manquante = moyenne.
+# Sortie : data/similar.json {"k": 5, "similar": {listing_id: [ids voisins]}}.
+#
+# Recherche par blocs de requêtes avec numpy : mémoire en O(bloc × n), jamais O(n²).
+# Sans numpy : parcours trié sur un axe avec élagage et tas de taille k, nettement
+# plus lent — l'exporteur n'est alors actif que sur demande (DASHBOARD_EXPORTERS=+similar).
+#
+# Incrémental (état dans data/.similar-state.json) : tant que la normalisation
+# est conservée, seules les annonces nouvelles/modifiées, et celles dont un
+# voisin a changé ou disparu, sont recalculées ; les autres comparent seulement
+# leurs k voisins aux annonces modifiées. Résultat identique à un calcul complet.
+SIMILAR_K = 5
+SIMILAR_FEATURE_WEIGHTS = (('price', 1.0), ('surface', 1.0), ('rooms', 0.5), ('price_m2', 0.5))
+SIMILAR_DISTANCE_KM = 5.0
+SIMILAR_CITY_PENALTY = 0.5
+SIMILAR_REFIT_RATIO = 0.25       # au-delà de 25 % d'annonces changées : normalisation recalculée
+SIMILAR_BLOCK_CELLS = 4_000_000  # taille max d'un bloc numpy (requêtes × annonces)
+SIMILAR_PRESELECT_MARGIN = 1e-6  # marge d'erreur d'arrondi de la présélection matricielle
+SIMILAR_STATE_FILE = '.similar-state.json'
+SIMILAR_STATE_VERSION = 1
+
+
+def _similar_raw(listing):
+    """Valeurs brutes utilisées (empreinte : une annonce modifiée est recalculée)"""
+    return [listing.get(name) for name, _ in SIMILAR_FEATURE_WEIGHTS] + \
+        [listing.get('latitude'), listing.get('longitude'), listing.get('city')]
+
+
+def fit_similar_params(listings):
+    """Moyennes/écarts-types des caractéristiques (normalisation figée entre builds)"""
+    import statistics
+    params = {'version': SIMILAR_STATE_VERSION}
+    for name, _ in SIMILAR_FEATURE_WEIGHTS + (('latitude', 0), ('longitude', 0)):
+        values = [float(l.get(name)) for l in listings if l.get(name)]
+        mean = statistics.fmean(values) if values else 0.0
+        std = statistics.pstdev(values, mean) if len(values) > 1 else 0.0
+        params[name] = [mean, std or 1.0]
+    return params
+
+
+def similar_vectors(listings, params):
+    """Vecteurs normalisés + code de ville de chaque annonce"""
+    import math
+    lat0 = params['latitude'][0]
+    km_lat = 110.57 / SIMILAR_DISTANCE_KM
+    km_lon = 111.32 * math.cos(math.radians(lat0)) / SIMILAR_DISTANCE_KM
+    vectors, cities = [], []
+    city_codes = {}
+    for l in listings:
+        vector = []
+        for name, weight in SIMILAR_FEATURE_WEIGHTS:
+            value = l.get(name)
+            mean, std = params[name]
+            vector.append((float(value) - mean) / std * weight if value else 0.0)
+        lat, lon = l.get('latitude'), l.get('longitude')
+        if lat and lon:
+            vector.append((lat - lat0) * km_lat)
+            vector.append((lon - params['longitude'][0]) * km_lon)
+        else:
+            vector.extend((0.0, 0.0))
+        vectors.append(vector)
+        cities.append(city_codes.setdefault(l.get('city'), len(city_codes)))
+    return vectors, cities
+
+
+def _knn_search_python(queries, vectors, cities, k, candidates):
+    """
+    Repli pure Python de knn_search : candidats triés sur l'axe le plus dispersé,
+    parcourus depuis la position de la requête vers l'extérieur, tas borné à k.
+
+    Un candidat est écarté dès que sa somme partielle dépasse le k-ième meilleur ;
+    le parcours s'arrête quand l'écart sur l'axe seul le dépasse. Les sommes étant
+    faites dans le même ordre, le résultat est identique à un parcours complet.
+    """
+    import bisect
+    import heapq
+
+    dims = len(vectors[candidates[0]])
+
+    def spread(f):
+        values = [vectors[j][f] for j in candidates]
+        return max(values) - min(values)
+
+    axis = max(range(dims), key=spread)
+    order = sorted(candidates, key=lambda j: vectors[j][axis])
+    keys = [vectors[j][axis] for j in order]
+    cand = [(vectors[j], cities[j], j) for j in order]
+    n = len(cand)
+    inf = float('inf')
+
+    results = []
+    for i in queries:
+        q, city = vectors[i], cities[i]
+        qa = q[axis]
+        heap = []  # (-distance², -indice) : heap[0] = pire voisin retenu
+        worst = inf
+        hi = bisect.bisect_left(keys, qa)
+        lo = hi - 1
+        while lo >= 0 or hi < n:
+            if hi < n and (lo < 0 or keys[hi] - qa <= qa - keys[lo]):
+                idx = hi
+                hi += 1
+            else:
+                idx = lo
+                lo -= 1
+            gap = keys[idx] - qa
+            if gap * gap > worst:
+                break  # l'autre côté est au moins aussi loin sur l'axe
+            v, c, j = cand[idx]
+            if j == i:
+                continue
+            d = 0.0
+            for a, b in zip(q, v):
+                d += (a - b) * (a - b)
+                if d > worst:
+                    break
+            else:
+                if c != city:
+                    d += SIMILAR_CITY_PENALTY
+                if len(heap) < k:
+                    heapq.heappush(heap, (-d, -j))
+                    if len(heap) == k:
+                        worst = -heap[0][0]
+                elif (d, j) < (worst, -heap[0][1]):
+                    heapq.heapreplace(heap, (-d, -j))
+                    worst = -heap[0][0]
+        results.append(sorted((-nd, -nj) for nd, nj in heap))
+    return results
+
+
+def knn_search(queries, vectors, cities, k, candidates=None):
+    """
+    k plus proches voisins de chaque requête parmi `vectors`.
+
+    Args:
+        queries: indices (dans vectors) des annonces dont on cherche les voisins
+        candidates: indices parmi lesquels chercher (défaut : toutes les annonces)
+
+    Returns:
+        list: pour chaque requête, [(distance², indice)] trié (égalités : indice croissant)
+    """
+    candidates = list(range(len(vectors))) if candidates is None else list(candidates)
+    if not queries or not candidates:
+        return [[] for _ in queries]
+    try:
+        import numpy as np
+    except ImportError:
+        return _knn_search_python(queries, vectors, cities, k, candidates)
+
+    # Présélection par produit matriciel (|q|² + |x|² - 2 q·x), puis distance exacte
+    # des seuls candidats retenus : même résultat, au bit près, que la boucle pure Python
+    X = np.asarray([vectors[j] for j in candidates], dtype=float)
+    X_city = np.asarray([cities[j] for j in candidates])
+    X_index = np.asarray(candidates)
+    X_norm = (X * X).sum(axis=1)
+    column = {j: c for c, j in enumerate(candidates)}
+    # k + marge candidats par ligne ; la ligne entière n'est relue que si la marge
+    # ne suffit pas à couvrir les égalités d'arrondi
+    kk = min(k + 8, len(candidates))
+    block = max(1, SIMILAR_BLOCK_CELLS // len(candidates))
+    results = []
+    for start in range(0, len(queries), block):
+        rows = queries[start:start + block]
+        Q = np.asarray([vectors[i] for i in rows], dtype=float)
+        Q_city = np.asarray([cities[i] for i in rows])
+        D = Q @ X.T  # opérations en place : un seul tableau bloc × n alloué
+        D *= -2.0
+        D += (Q * Q).sum(axis=1)[:, None]
+        D += X_norm[None, :]
+        D += SIMILAR_CITY_PENALTY * (Q_city[:, None] != X_city[None, :])
+        for r, i in enumerate(rows):
+            if i in column:
+                D[r, column[i]] = np.inf
+        nearest = np.argpartition(D, kk - 1, axis=1)[:, :kk]
+        for r in range(len(rows)):
+            cols = nearest[r]
+            approx = D[r, cols]
+            order = np.argsort(approx, kind='stable')
+            cols, approx = cols[order], approx[order]
+            if len(cols) > k and approx[-1] <= approx[k - 1] + SIMILAR_PRESELECT_MARGIN:
+                cols = np.nonzero(D[r] <= approx[k - 1] + SIMILAR_PRESELECT_MARGIN)[0]
+            else:
+                cols = cols[approx <= approx[min(k, len(cols)) - 1] + SIMILAR_PRESELECT_MARGIN]
+            cols = cols[np.isfinite(D[r, cols])]
+            diff = X[cols] - Q[r]
+            exact = np.zeros(len(cols))
+            for f in range(diff.shape[1]):  # même ordre de sommation que la boucle pure Python
+                exact += diff[:, f] * diff[:, f]
+            exact += SIMILAR_CITY_PENALTY * (X_city[cols] != Q_city[r])
+            results.append(sorted(zip(exact.tolist(), X_index[cols].tolist()))[:k])
+    return results
+
+
+def build_similar(listings, state_path, k=SIMILAR_K):
+    """
+    Voisins de chaque annonce, recalculés incrémentalement.
+
+    Returns:
+        dict: {'similar': {id: [ids]}, 'recomputed': nb d'annonces recalculées, 'refit': bool}
+    """
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('params', {}).get('version') != SIMILAR_STATE_VERSION or state.get('k') != k:
+            state = {}
+    except (OSError, ValueError):
+        state = {}
+
+    ids = [l['listing_id'] for l in listings]
+    position = {listing_id: n for n, listing_id in enumerate(ids)}
+    raw = {l['listing_id']: json.dumps(_similar_raw(l)) for l in listings}
+    old_raw = state.get('raw', {})
+    changed = {i for i in ids if old_raw.get(i) != raw[i]}
+    gone = set(old_raw) - set(position)
+
+    params = state.get('params')
+    refit = params is None or len(changed) + len(gone) > SIMILAR_REFIT_RATIO * max(1, len(ids))
+    if refit:
+        params = fit_similar_params(listings)
+    vectors, cities = similar_vectors(listings, params)
+
+    old_knn = state.get('knn', {}) if not refit else {}
+    touched = changed | gone
+    full = [n for n, i in enumerate(ids)
+            if refit or i in changed or i not in old_knn or any(j in touched for j, _ in old_knn[i])]
+    full_set = set(full)
+    knn = {}
+    for n, neighbours in zip(full, knn_search(full, vectors, cities, k)):
+        knn[ids[n]] = [(ids[j], d) for d, j in neighbours]
+
+    # Annonces inchangées : leurs k voisins contre les seules annonces modifiées
+    rest = [n for n in range(len(ids)) if n not in full_set]
+    changed_idx = sorted(position[i] for i in changed)
+    for n, extra in zip(rest, knn_search(rest, vectors, cities, k, changed_idx)):
+        merged = [(d, position[j]) for j, d in old_knn[ids[n]]] + extra
+        knn[ids[n]] = [(ids[j], d) for d, j in sorted(merged)[:k]]
+
+    write_text_file(state_path, json_dumps({'k': k, 'params': params, 'raw': raw,
+                                            'knn': {i: [[j, d] for j, d in knn[i]] for i in ids}}, pretty=False))
+    return {'similar': {i: [j for j, _ in knn[i]] for i in ids}, 'recomputed': len(full), 'refit': refit}
+
+
+# =============================================================================
+# ENCODAGE JSON — orjson / ujson si installés, sinon json (stdlib)
+# =============================================================================
+# Sortie sémantiquement identique quel que soit le backend : UTF-8 non échappé
+# (ensure_ascii=False), objets non sérialisables (datetime, ...) convertis par str().
+# msgspec n'est pas utilisé : il encode datetime nativement en ISO 8601 ("T") sans
+# possibilité de passer par str(), ce qui changerait les valeurs exportées.
+#
+# DASHBOARD_JSON_COMPACT=1 : JSON compact (production) ; sinon indenté (debug, défaut)
+# DASHBOARD_JSON_BACKEND=json|orjson|ujson : forcer un backend
+
+JSON_BACKENDS = ('orjson', 'ujson', 'json')
+_json_backend = None
+
+
+def _json_default(obj):
+    """Conversion des objets non sérialisables : Listing → dict, le reste comme default=str"""
+    if isinstance(obj, Listing):
+        return obj.to_dict()
+    return str(obj)
+
+
+def json_backend():
+    """Nom du backend JSON utilisé (résolu au premier appel)"""
+    global _json_backend
+    if _json_backend is None:
+        forced = config_value('DASHBOARD_JSON_BACKEND')
+        for name in ([forced] if forced else JSON_BACKENDS):
+            if name == 'json':
+                _json_backend = 'json'
+                break
+            try:
+                __import__(name)
+                _json_backend = name
+                break
+            except ImportError:
+                continue
+        else:
+            _json_backend = 'json'
+    return _json_backend
+
+
+def json_compact_default():
+    """Mode compact par défaut (DASHBOARD_JSON_COMPACT=1)"""
+    return config_value('DASHBOARD_JSON_COMPACT') == '1'
+
+
+def json_dumps(obj, pretty=None, backend=None):
+    """
+    Sérialiser en JSON (str) avec le backend le plus rapide disponible.
+
+    Args:
+        obj: Objet à sérialiser
+        pretty: True = indenté (2 espaces), False = compact, None = réglage DASHBOARD_JSON_COMPACT
+        backend: Forcer un backend ('json', 'orjson', 'ujson')
+    """
+    if pretty is None:
+        pretty = not json_compact_default()
+    backend = backend or json_backend()
+
+    if backend == 'orjson':
+        import orjson
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_json_default, option=option).decode('utf-8')
+
+    if backend == 'ujson':
+        import ujson
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False,
+                           indent=2 if pretty else 0, default=_json_default)
+
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2, default=_json_default)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+
+def _bench_listings(n):
+    """Annonces synthétiques pour les benchmarks (même forme que read_listings)"""
+    import random
+    rng = random.Random(42)
+    sites = ['Athome.lu', 'Immotop.lu', 'Luxhome.lu', 'Nextimmo.lu', 'Wortimmo.lu']
+    cities = ['Belair', 'Merl', 'Gare', 'Bonnevoie', 'Strassen', 'Esch-Sur-Alzette', 'Différdange']
+    listings = []
+    for i in range(n):
+        price = rng.randrange(1200, 4500, 25)
+        surface = rng.randrange(25, 180)
+        listings.append({
+            'listing_id': f'bench_{i}', 'site': rng.choice(sites),
+            'title': f'Appartement {rng.randint(1, 4)} chambres — résidence {i}',
+            'city': rng.choice(cities), 'price': price, 'rooms': rng.randint(0, 5), 'surface': surface,
+            'url': f'https://www.example.lu/location/appartement/id-{i}.html',
+            'latitude': round(49.5 + rng.random() * 0.3, 7), 'longitude': round(5.9 + rng.random() * 0.4, 7),
+            'distance_km': round(rng.random() * 30, 1), 'created_at': f'2026-03-{rng.randint(1, 28):02d} 12:00:00',
+            'image_url': f'images/bench_{i}.jpg', 'price_m2': round(price / surface, 1),
+        })
+    return listings
+
+
+def benchmark_listing_memory(n=100000):
+    """
+    Mémoire de n annonces : dicts (ancien format) vs objets Listing.
+
+    Returns:
+        tuple: (octets avec dicts, octets avec Listing)
+    """
+    import tracemalloc
+
+    source = _bench_listings(n)
+    # Chaînes recréées comme à la lecture SQLite (pas de partage entre lignes)
+    rows = [tuple(''.join(v) if isinstance(v, str) else v for v in
+                  (l[c] for c in LISTING_COLUMNS)) for l in source]
+    del source
+
+    results = []
+    for label, build in (('dict', lambda r: dict(zip(LISTING_COLUMNS, r))), ('Listing', Listing)):
+        tracemalloc.start()
+        items = []
+        for row in rows:
+            item = build(row)
+            item['site'] = sys.intern(item['site'])
+            item['city'] = sys.intern(item['city'])
+            item['price_m2'] = round(item['price'] / item['surface'], 1)
+            items.append(item)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del items
+        results.append(peak)
+        print(f"  {label:<8} pic {peak / 1e6:7.1f} Mo ({n} annonces)")
+    return tuple(results)
+
+
+def benchmark_json(n=100000, repeat=3):
+    """
+    Comparer les backends JSON disponibles sur n annonces synthétiques.
+
+    Returns:
+        list: [(backend, mode, meilleur temps en s, taille en octets), ...]
+    """
+    import time
+
+    listings = _bench_listings(n)
+    backends = ['json']
+    for name in JSON_BACKENDS:
+        if name != 'json':
+            try:
+                __import__(name)
+                backends.append(name)
+            except ImportError:
+                pass
+
+    reference = json.loads(json_dumps(listings, pretty=False, backend='json'))
+    results = []
+    print(f"Benchmark JSON : {n} annonces, meilleur de {repeat}")
+    for backend in backends:
+        for pretty in (True, False):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                out = json_dumps(listings, pretty=pretty, backend=backend)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            if json.loads(out) != reference:
+                raise AssertionError(f"Sortie {backend} différente de la référence stdlib")
+            mode = 'pretty' if pretty else 'compact'
+            results.append((backend, mode, best, len(out.encode('utf-8'))))
+            print(f"  {backend:<7} {mode:<8} {best * 1000:8.1f} ms  {len(out.encode('utf-8')) / 1e6:6.1f} Mo")
+    return results
+
+
+# =============================================================================
+# EXPORTEURS — une classe par fichier de sortie, exécutés par un ordonnanceur
+# =============================================================================
+# Chaque exporteur déclare :
+#   name    : identifiant (config DASHBOARD_EXPORTERS)
+#   inputs  : clés du contexte utilisées (listings, stats, anomalies, ...)
+#   after   : exporteurs à terminer avant lui (ex: trends lit l'archive du jour)
+#   kind    : 'io' (pool de threads) ou 'cpu' (pool de processus sur gros volumes,
+#             si plusieurs cœurs)
+#   stateful: lit/écrit un état incrémental dans data/ (.similar-state.json, index de
+#             la heatmap) : toujours exécuté dans le processus principal (threads)
+#   default : actif sans configuration
+# Les exporteurs sans dépendance entre eux tournent en parallèle.
+#
+# DASHBOARD_EXPORTERS (.env) : "+market-stats,-history" active/désactive par rapport
+# aux défauts ; une liste sans +/- remplace entièrement la sélection.
+
+EXPORTERS = {}
+
+# Taille à partir de laquelle les exporteurs 'cpu' passent dans un pool de processus
+# (en dessous, copier les annonces vers un processus coûte plus que la sérialisation)
+EXPORT_PROCESS_POOL_MIN_LISTINGS = 20000
+
+SITE_COLOR_PALETTE = ['#FF6384', '#36A2EB', '#FFCE56', '#4BC0C0', '#9966FF', '#FF9F40', '#2ECC71', '#E74C3C', '#3498DB']
+
+
+def register_exporter(cls):
+    """Décorateur : enregistrer une classe d'exporteur dans EXPORTERS"""
+    EXPORTERS[cls.name] = cls()
+    return cls
+
+
+class Exporter:
+    """Base des exporteurs de données"""
+    name = None
+    inputs = ('listings',)
+    after = ()
+    kind = 'io'
+    stateful = False
+    default = True
+
+    def write(self, ctx, data_dir):
+        """Écrire la sortie ; retourne la liste des fichiers écrits"""
+        raise NotImplementedError
+
+
+def write_text_file(path, content):
+    """Écrire un fichier texte UTF-8 (fichier temporaire + os.replace : jamais lu à moitié écrit)"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _js_const(header_lines, const_name, value_json):
+    """Contenu d'un fichier data/*.js : commentaires d'en-tête + const NOM = valeur;"""
+    head = ''.join(f'// {line}\n' for line in header_lines)
+    return f'{head}const {const_name} = {value_json};\n'
+
+
+def calculate_site_colors(stats):
+    """Couleur de chaque site (ordre de stats['sites'])"""
+    return {site: SITE_COLOR_PALETTE[i % len(SITE_COLOR_PALETTE)] for i, site in enumerate(stats['sites'])}
+
+
+def calculate_new_listings(listings, days=7):
+    """Annonces créées dans les `days` derniers jours"""
+    from datetime import timedelta
+    cutoff_date = datetime.now() - timedelta(days=days)
+    return [
+        l for l in listings
+        if l.get('created_at') and datetime.strptime(l['created_at'][:10], '%Y-%m-%d') >= cutoff_date
+    ]
+
+
+def calculate_market_stats_by_city(listings):
+    """Stats marché par ville (count, moyenne, médiane, min, max, prix/m² moyen)"""
+    cities = {}
+    for l in listings:
+        city = l.get('city')
+        if not city or city == 'N/A':
+            continue
+        data = cities.setdefault(city, {'prices': [], 'prices_m2': []})
+        if l.get('price') and l['price'] > 0:
+            data['prices'].append(l['price'])
+        if l.get('price_m2'):
+            data['prices_m2'].append(l['price_m2'])
+
+    market = {}
+    for city, data in cities.items():
+        prices = sorted(data['prices'])
+        if not prices:
+            continue
+        market[city] = {
+            'count': len(prices),
+            'avg_price': int(sum(prices) / len(prices)),
+            'median_price': prices[len(prices) // 2],
+            'min_price': prices[0],
+            'max_price': prices[-1],
+            'avg_price_m2': int(sum(data['prices_m2']) / len(data['prices_m2'])) if data['prices_m2'] else None,
+        }
+    return market
+
+
+# Entrées dérivées : calculées une seule fois, seulement si un exporteur actif les demande
+EXPORT_DERIVED_INPUTS = {
+    'site_colors': lambda ctx: calculate_site_colors(ctx['stats']),
+    'anomalies': lambda ctx: calc_anomalies(ctx['listings'], ctx['stats']),
+    'new_listings': lambda ctx: calculate_new_listings(ctx['listings']),
+}
+
+
+@register_exporter
+class ListingsJsExporter(Exporter):
+    name = 'listings'
+    kind = 'cpu'
+
+    def write(self, ctx, data_dir):
+        listings = ctx['listings']
+        listings_json = json_dumps(listings)
+        path = os.path.join(data_dir, 'listings.js')
+        write_text_file(path, _js_const(
+            [f"Genere le {ctx['now_str']}", f'{len(listings)} annonces depuis listings.db'],
+            'LISTINGS', listings_json))
+        return [path]
+
+
+@register_exporter
+class FacetsExporter(Exporter):
+    name = 'facets'
+    kind = 'cpu'
+
+    def write(self, ctx, data_dir):
+        # Facettes + ordres de tri pré-calculés (JSON compact, index dans LISTINGS)
+        facets_json = json_dumps(build_facets(ctx['listings']), pretty=False)
+        path = os.path.join(data_dir, 'facets.js')
+        write_text_file(path, _js_const([f"Genere le {ctx['now_str']}"], 'FACETS', facets_json))
+        return [path]
+
+
+@register_exporter
+class StatsExporter(Exporter):
+    name = 'stats'
+    inputs = ('stats', 'site_colors')
+
+    def write(self, ctx, data_dir):
+        stats_json = json_dumps(ctx['stats'])
+        colors_json = json_dumps(ctx['site_colors'])
+        path = os.path.join(data_dir, 'stats.js')
+        write_text_file(path, _js_const([f"Genere le {ctx['now_str']}"], 'STATS', stats_json)
+                        + f'const SITE_COLORS = {colors_json};\n')
+        return [path]
+
+
+@register_exporter
+class ListingsJsonExporter(Exporter):
+    name = 'listings-json'
+    kind = 'cpu'
+
+    def write(self, ctx, data_dir):
+        # listings.json (reutilisable)
+        path = os.path.join(data_dir, 'listings.json')
+        write_text_file(path, json_dumps(ctx['listings']))
+        return [path]
+
+
+@register_exporter
+class HistoryExporter(Exporter):
+    name = 'history'
+    inputs = ('listings', 'stats')
+    kind = 'cpu'
+
+    def write(self, ctx, data_dir):
+        # Archive JSON du jour (historique)
+        os.makedirs(os.path.join(data_dir, 'history'), exist_ok=True)
+        path = os.path.join(data_dir, 'history', f"{ctx['today']}.json")
+        write_text_file(path, json_dumps({
+            'date': ctx['today'],
+            'generated_at': ctx['now_str'],
+            'stats': ctx['stats'],
+            'listings': ctx['listings']
+        }))
+        return [path]
+
+
+@register_exporter
+class AnomaliesExporter(Exporter):
+    name = 'anomalies'
+    inputs = ('anomalies',)
+
+    def write(self, ctx, data_dir):
+        # anomalies.js - Détection automatique d'anomalies
+        anomalies = ctx['anomalies']
+        anomalies_json = json_dumps(anomalies)
+        path = os.path.join(data_dir, 'anomalies.js')
+        write_text_file(path, _js_const(
+            [f"Genere le {ctx['now_str']}", f'{len(anomalies)} anomalies detectees'],
+            'ANOMALIES', anomalies_json))
+        return [path]
+
+
+@register_exporter
+class NewListingsExporter(Exporter):
+    name = 'new-listings'
+    inputs = ('stats', 'anomalies', 'new_listings')
+
+    def write(self, ctx, data_dir):
+        # new-listings.json - Nouvelles annonces récentes (derniers 7 jours)
+        stats = ctx['stats']
+        new_listings = ctx['new_listings']
+        new_ids = {l['listing_id'] for l in new_listings}
+        new_listings_data = {
+            'generated_at': ctx['now_str'],
+            'total': len(new_listings),
+            'anomalies_count': len([a for a in ctx['anomalies'] if a['listing_id'] in new_ids]),
+            'good_deals_count': len([l for l in new_listings if l.get('price', 0) > 0 and l.get('price', 0) < stats.get('avg_price', 0) * 0.7]),
+            'high_price_count': len([l for l in new_listings if l.get('price', 0) > stats.get('avg_price', 0) * 1.5]),
+            'market_stats': {},
+            'listings': new_listings
+        }
+        path = os.path.join(data_dir, 'new-listings.json')
+        write_text_file(path, json_dumps(new_listings_data))
+        return [path]
+
+
+@register_exporter
+class StatsHistoryExporter(Exporter):
+    name = 'stats-history'
+    inputs = ('stats_history',)
+
+    def write(self, ctx, data_dir):
+        # Série quotidienne des agrégats (listing_aggregates_daily)
+        series = ctx['stats_history']
+        series_json = json_dumps(series)
+        path = os.path.join(data_dir, 'stats-history.js')
+        write_text_file(path, _js_const(
+            [f"Genere le {ctx['now_str']}", f'{len(series)} jours depuis listing_aggregates_daily'],
+            'STATS_HISTORY', series_json))
+        return [path]
+
+
+@register_exporter
+class QualityExporter(Exporter):
+    name = 'quality'
+    inputs = ('quality',)
+
+    def write(self, ctx, data_dir):
+        # Compteurs de qualité par site + série quotidienne (listing_quality*)
+        quality = ctx['quality']
+        path = os.path.join(data_dir, 'quality.js')
+        write_text_file(path, _js_const(
+            [f"Genere le {ctx['now_str']}",
+             f"{len(quality['sites'])} sites, {len(quality['daily'])} jours depuis listing_quality_daily"],
+            'QUALITY', json_dumps(quality)))
+        return [path]
+
+
+@register_exporter
+class TrendsExporter(Exporter):
+    name = 'trends'
+    inputs = ()
+    after = ('history',)
+
+    def write(self, ctx, data_dir):
+        # Séries compactes, calcul incrémental depuis history/ (archive du jour incluse)
+        trends = build_trends(os.path.join(data_dir, 'history'))
+        processed = trends.pop('processed_days')
+        trends_json = json_dumps(trends, pretty=False)
+        path = os.path.join(data_dir, 'trends.js')
+        write_text_file(path, _js_const(
+            [f"Genere le {ctx['now_str']}", f"{len(trends['dates'])} jours d'historique ({processed} recalculés)"],
+            'TRENDS', trends_json))
+        return [path]
+
+
+@register_exporter
+class HeatmapExporter(Exporter):
+    name = 'heatmap'
+    kind = 'cpu'
+    stateful = True
+
+    def write(self, ctx, data_dir):
+        # Seules les tuiles dont les annonces ont changé sont réécrites
+        result = build_heatmap(ctx['listings'], os.path.join(data_dir, HEATMAP_DIR))
+        return result['written'] + [os.path.join(data_dir, HEATMAP_DIR, HEATMAP_INDEX_FILE)]
+
+
+def heatmap_zoom_summary(data_dir, paths):
+    """Résumé des fichiers écrits par HeatmapExporter : tuiles réécrites par zoom"""
+    counts = {z: 0 for z in HEATMAP_ZOOMS}
+    prefix = os.path.join(data_dir, HEATMAP_DIR) + os.sep
+    for path in paths:
+        zoom, sep, _ = path[len(prefix):].partition(os.sep)
+        if path.startswith(prefix) and sep and zoom.isdigit():
+            counts[int(zoom)] = counts.get(int(zoom), 0) + 1
+    per_zoom = ', '.join(f"z{z}: {n}" for z, n in sorted(counts.items()))
+    return f"tuiles réécrites {per_zoom} + {HEATMAP_INDEX_FILE}"
+
+
+@register_exporter
+class AlertMatchesExporter(Exporter):
+    name = 'alert-matches'
+
+    def write(self, ctx, data_dir):
+        # Rien à écrire sans fichier de recherches sauvegardées
+        searches = load_saved_searches()
+        if not searches:
+            return []
+        result = evaluate_saved_searches(ctx['listings'], searches, os.path.join(data_dir, ALERT_STATE_FILE))
+        alerts_json = json_dumps(result['searches'])
+        path = os.path.join(data_dir, 'alert-matches.js')
+        write_text_file(path, _js_const(
+            [f"Genere le {ctx['now_str']}",
+             f"{len(searches)} recherches, {result['evaluated']} annonces évaluées"],
+            'ALERT_MATCHES', alerts_json))
+        return [path]
+
+
+@register_exporter
+class SimilarExporter(Exporter):
+    name = 'similar'
+    kind = 'cpu'
+    stateful = True
+
+    @property
+    def default(self):
+        # Actif par défaut seulement avec numpy (sinon "+similar" dans DASHBOARD_EXPORTERS)
+        import importlib.util
+        return importlib.util.find_spec('numpy') is not None
+
+    def write(self, ctx, data_dir):
+        # Seules les annonces modifiées (et leurs voisinages) sont recalculées
+        result = build_similar(ctx['listings'], os.path.join(data_dir, SIMILAR_STATE_FILE))
+        path = os.path.join(data_dir, 'similar.json')
+        write_text_file(path, json_dumps({'k': SIMILAR_K, 'similar': result['similar']}, pretty=False))
+        return [path]
+
+
+@register_exporter
+class MarketStatsExporter(Exporter):
+    name = 'market-stats'
+    default = False
+
+    def write(self, ctx, data_dir):
+        market_json = json_dumps(calculate_market_stats_by_city(ctx['listings']))
+        path = os.path.join(data_dir, 'market-stats.js')
+        write_text_file(path, _js_const(
+            [f"Genere le {ctx['now_str']}", 'Statistiques detaillees par ville (median, avg, price_m2, etc.)'],
+            'MARKET_STATS', market_json))
+        return [path]
+
+
+@register_exporter
+class Dashboard2SyncExporter(Exporter):
+    name = 'dashboard2'
+    inputs = ()
+    after = ('listings', 'stats', 'listings-json', 'anomalies', 'market-stats', 'new-listings')
+    default = False
+
+    def write(self, ctx, data_dir):
+        sync_data_to_dashboard2(data_dir)
+        return []
+
+
+def selected_exporters(config=None):
+    """
+    Noms des exporteurs actifs selon la config (DASHBOARD_EXPORTERS par défaut).
+
+    "+nom" active, "-nom" désactive par rapport aux défauts ; une liste de noms
+    sans préfixe remplace la sélection.
+    """
+    if config is None:
+        config = config_value('DASHBOARD_EXPORTERS', '')
+    entries = [e.strip() for e in config.split(',') if e.strip()]
+    for entry in entries:
+        if entry.lstrip('+-') not in EXPORTERS:
+            raise ValueError(f"Exporteur inconnu: {entry} (disponibles: {', '.join(EXPORTERS)})")
+
+    if entries and all(not e.startswith(('+', '-')) for e in entries):
+        return [name for name in EXPORTERS if name in entries]
+
+    selected = {name for name, exporter in EXPORTERS.items() if exporter.default}
+    for entry in entries:
+        if entry.startswith('+'):
+            selected.add(entry[1:])
+        elif entry.startswith('-'):
+            selected.discard(entry[1:])
+    return [name for name in EXPORTERS if name in selected]
+
+
+# Contexte partagé avec les processus du pool d'exporteurs (envoyé une fois par processus)
+_EXPORT_CTX = None
+
+
+def _init_export_worker(ctx):
+    global _EXPORT_CTX
+    _EXPORT_CTX = ctx
+
+
+def _exporter_ctx(name, ctx):
+    """Sous-contexte d'un exporteur : ses entrées + horodatage du build"""
+    sub_ctx = {k: ctx[k] for k in EXPORTERS[name].inputs}
+    sub_ctx.update(now_str=ctx['now_str'], today=ctx['today'])
+    return sub_ctx
+
+
+def _run_exporter(name, ctx, data_dir):
+    """Exécuter un exporteur"""
+    return EXPORTERS[name].write(ctx, data_dir)
+
+
+def _run_shared_exporter(name, data_dir):
+    """Point d'entrée du pool de processus : contexte reçu par _init_export_worker"""
+    return EXPORTERS[name].write(_exporter_ctx(name, _EXPORT_CTX), data_dir)
+
+
+def run_exporters(ctx, data_dir, names=None, max_workers=None, use_processes=None):
+    """
+    Exécuter les exporteurs sélectionnés, en parallèle par vagues de dépendances.
+
+    Les exporteurs dont une entrée manque dans le contexte (ex: quality pour un
+    profil, sans base) sont ignorés. use_processes=False force les threads (appel
+    depuis un processus d'un pool : pas de pool de processus imbriqué) ; None = auto.
+
+    Returns:
+        dict: {nom de l'exporteur: [fichiers écrits]}
+    """
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+    names = selected_exporters() if names is None else names
+    ctx = dict(ctx)
+    available = set(ctx) | set(EXPORT_DERIVED_INPUTS)
+    names = [n for n in names if set(EXPORTERS[n].inputs) <= available]
 
-    new_listings_data = {
-        'generated_at': now_str,
-        'total': len(new_listings),
-        'anomalies_count': len([a for a in anomalies if a['listing_id'] in [l['listing_id'] for l in new_listings]]),
-        'good_deals_count': len([l for l in new_listings if l.get('price', 0) > 0 and l.get('price', 0) < stats.get('avg_price', 0) * 0.7]),
-        'high_price_count': len([l for l in new_listings if l.get('price', 0) > stats.get('avg_price', 0) * 1.5]),
-        'market_stats': {},
-        'listings': new_listings
+    # Entrées dérivées demandées, calculées une fois
+    needed = {i for n in names for i in EXPORTERS[n].inputs}
+    for key, compute in EXPORT_DERIVED_INPUTS.items():
+        if key in needed and key not in ctx:
+            ctx[key] = compute(ctx)
+
+    os.makedirs(data_dir, exist_ok=True)
+    # Processus seulement s'il y a plusieurs cœurs, du volume et un exporteur 'cpu' sans état :
+    # le contexte (annonces comprises) est envoyé une fois par processus, pas par exporteur
+    process_names = [n for n in names if EXPORTERS[n].kind == 'cpu' and not EXPORTERS[n].stateful]
+    use_processes = (use_processes is not False and (os.cpu_count() or 1) > 1 and len(process_names) > 0
+                     and len(ctx.get('listings') or ()) >= EXPORT_PROCESS_POOL_MIN_LISTINGS)
+    results = {}
+    remaining = list(names)
+    with ThreadPoolExecutor(max_workers=max_workers) as threads:
+        processes = None
+        if use_processes:
+            shared = {k: ctx[k] for k in {i for n in process_names for i in EXPORTERS[n].inputs}
+                      | {'now_str', 'today'}}
+            processes = ProcessPoolExecutor(max_workers=min(max_workers or os.cpu_count(), len(process_names)),
+                                            initializer=_init_export_worker, initargs=(shared,))
+        try:
+            while remaining:
+                wave = [n for n in remaining
+                        if all(dep in results or dep not in remaining for dep in EXPORTERS[n].after)]
+                if not wave:
+                    raise ValueError(f"Dépendances circulaires entre exporteurs: {remaining}")
+                futures = {}
+                for n in wave:
+                    if processes and n in process_names:
+                        futures[n] = processes.submit(_run_shared_exporter, n, data_dir)
+                    else:
+                        futures[n] = threads.submit(_run_exporter, n, _exporter_ctx(n, ctx), data_dir)
+                for n, future in futures.items():
+                    results[n] = future.result()
+                remaining = [n for n in remaining if n not in results]
+        finally:
+            if processes:
+                processes.shutdown()
+
+    return results
+
+
+def build_export_context(listings, stats, db_path=None, conn=None):
+    """
+    Contexte partagé par les exporteurs.
+
+    Les tables du générateur (série quotidienne, qualité) sont lues ici, une fois :
+    par la transaction du build (conn) si elle est fournie, les exporteurs voient
+    alors les tables telles qu'elles seront validées.
+    """
+    now = datetime.now()
+    ctx = {
+        'listings': listings,
+        'stats': stats,
+        'now_str': now.strftime("%d/%m/%Y %H:%M"),
+        'today': now.strftime('%Y-%m-%d'),
+        'site_colors': calculate_site_colors(stats),
     }
+    if db_path or conn is not None:
+        ctx['stats_history'] = read_daily_aggregates(db_path, conn)
+        ctx['quality'] = read_quality(db_path, conn)
+    return ctx
 
-    with open(os.path.join(data_dir, 'new-listings.json'), 'w', encoding='utf-8') as f:
-        json.dump(new_listings_data, f, ensure_ascii=False, indent=2, default=str)
 
-    return site_colors
+def export_data(listings, stats, data_dir, db_path=None, exporters=None, use_processes=None):
+    """Exporter les donnees en fichiers JS + JSON + archive quotidienne (exporteurs actifs)"""
+    ctx = build_export_context(listings, stats, db_path)
+    run_exporters(ctx, data_dir, exporters, use_processes=use_processes)
+    return ctx['site_colors']
 
 
 def generate_manifest(dashboards_dir):
@@ -577,8 +3768,7 @@ def generate_manifest(dashboards_dir):
             }
         ]
     }
-    with open(os.path.join(dashboards_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
-        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    write_text_file(os.path.join(dashboards_dir, 'manifest.json'), json.dumps(manifest, ensure_ascii=False, indent=2))
 
 
 def generate_html(stats, site_colors):
@@ -1038,6 +4228,8 @@ renderPriceView();
 
 def sync_data_to_dashboard2(data_dir):
     """Sync data files to Dashboard2 (Vue app)"""
+    import shutil
+
     dashboard2_data = 'dashboards2/public/data'
 
     try:
@@ -1067,10 +4259,10 @@ def sync_data_to_dashboard2(data_dir):
         print(f"⚠️  Dashboard2 sync skipped: {e}")
 
 
-def generate_version_js(data_dir, total_listings):
+def generate_version_js(data_dir, total_listings, priority_cities=None):
     """Générer data/version.js avec version, date de build et token de cache busting"""
     now = datetime.now()
-    build_token = now.strftime("%Y%m%d-%H%M")
+    build_token = now.strftime("%Y%m%d-%H%M%S")  # à la seconde : deux builds rapprochés restent distincts
     built_at = now.strftime("%d/%m/%Y %H:%M")
 
     version_info = {
@@ -1080,12 +4272,12 @@ def generate_version_js(data_dir, total_listings):
         "total_listings": total_listings
     }
     version_json = json.dumps(version_info, ensure_ascii=False, indent=2)
-    priority_json = json.dumps(PRIORITY_CITIES, ensure_ascii=False)
+    priority_json = json.dumps(priority_cities or get_priority_cities(), ensure_ascii=False)
 
-    with open(os.path.join(data_dir, 'version.js'), 'w', encoding='utf-8') as f:
-        f.write(f'// Genere le {built_at}\n')
-        f.write(f'const VERSION_INFO = {version_json};\n')
-        f.write(f'const PRIORITY_CITIES = {priority_json};\n')
+    write_text_file(os.path.join(data_dir, 'version.js'),
+                    f'// Genere le {built_at}\n'
+                    f'const VERSION_INFO = {version_json};\n'
+                    f'const PRIORITY_CITIES = {priority_json};\n')
 
     return build_token
 
@@ -1112,53 +4304,1306 @@ def update_sw_cache_version(dashboards_dir, build_token):
         new_content
     )
 
-    with open(sw_path, 'w', encoding='utf-8') as f:
-        f.write(new_content)
+    write_text_file(sw_path, new_content)
 
 
-def main():
-    """Point d'entree principal"""
+# =============================================================================
+# PUBLICATION — verrou de build, staging, bascule atomique du dossier data/
+# =============================================================================
+BUILD_LOCK_FILE = '.build.lock'
+
+
+def _try_lock_fd(fd):
+    """Verrou exclusif non bloquant sur un descripteur (flock ; msvcrt sous Windows)"""
+    try:
+        import fcntl
+    except ImportError:
+        import msvcrt
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (BlockingIOError, PermissionError):
+        return False
+    return True
+
+
+@contextmanager
+def build_lock(dashboards_dir):
+    """
+    Verrou exclusif d'un build (verrou système sur <dashboards>/.build.lock).
+
+    Produit True si le verrou est pris, False si un autre run le détient
+    (l'appelant saute alors son travail au lieu de s'empiler). Le fichier est
+    permanent et le verrou est libéré par le système à la mort du processus :
+    pas de verrou périmé à détecter ni de reprise concurrente possible.
+    """
+    import socket
+
+    os.makedirs(dashboards_dir, exist_ok=True)
+    lock_path = os.path.join(dashboards_dir, BUILD_LOCK_FILE)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        acquired = _try_lock_fd(fd)
+        if acquired:
+            # Détenteur courant, pour le message des runs refusés
+            info = {'pid': os.getpid(), 'host': socket.gethostname(),
+                    'started_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+            os.ftruncate(fd, 0)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, json.dumps(info).encode('utf-8'))
+        else:
+            try:
+                with open(lock_path, 'r', encoding='utf-8') as f:
+                    holder = f.read().strip() or 'détenteur inconnu'
+            except OSError:
+                holder = 'détenteur inconnu'
+            print(f"⏭️  Build déjà en cours ({holder}) : run ignoré")
+        yield acquired
+    finally:
+        # Fermer le descripteur libère le verrou (flock comme msvcrt)
+        os.close(fd)
+
+
+def _link_or_copy(src, dst):
+    """Lien dur (instantané, sans copie) ; copie si le système de fichiers le refuse"""
+    import shutil
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
+def _build_dirs(data_dir):
+    """Dossiers de build/anciennes versions laissés à côté de data_dir"""
+    parent = os.path.dirname(os.path.abspath(data_dir))
+    prefix = os.path.basename(os.path.normpath(data_dir))
+    if not os.path.isdir(parent):
+        return []
+    return [entry.path for entry in os.scandir(parent)
+            if entry.name.startswith((f'{prefix}.build-', f'{prefix}.old-')) and not entry.is_symlink()]
+
+
+def prepare_staging_dir(data_dir):
+    """
+    Créer le dossier de staging d'un build à côté de data_dir.
+
+    Le contenu publié y est reproduit par liens durs : history/, caches de
+    tendances et autres états incrémentaux sont repris sans copie. Les
+    écritures passent par write_text_file (fichier temporaire + os.replace),
+    donc jamais dans un inode partagé avec la version publiée.
+    """
+    import shutil
+    import time
+
+    live = os.path.realpath(data_dir) if os.path.exists(data_dir) else None
+    # Restes d'un run interrompu (le verrou garantit qu'aucun build n'est en cours)
+    for path in _build_dirs(data_dir):
+        if live is None or os.path.realpath(path) != live:
+            shutil.rmtree(path, ignore_errors=True)
+
+    token = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    staging = f"{os.path.normpath(data_dir)}.build-{token}"
+    if live and os.path.isdir(live):
+        shutil.copytree(live, staging, symlinks=True, copy_function=_link_or_copy)
+    else:
+        os.makedirs(staging)
+    return staging
+
+
+_RENAME_EXCHANGE = 2  # linux/fs.h
+
+
+def _rename_exchange(path_a, path_b):
+    """
+    Échanger atomiquement deux chemins (renameat2 RENAME_EXCHANGE, Linux ≥ 3.15).
+
+    Returns:
+        bool: False si l'appel n'est pas disponible (autre OS, libc ou système de fichiers)
+    """
+    if not sys.platform.startswith('linux'):
+        return False
+    import ctypes
+    import ctypes.util
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        renameat2 = libc.renameat2
+    except (OSError, AttributeError):
+        return False
+    renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    at_fdcwd = -100
+    if renameat2(at_fdcwd, os.fsencode(path_a), at_fdcwd, os.fsencode(path_b), _RENAME_EXCHANGE) == 0:
+        return True
+    errno = ctypes.get_errno()
+    if errno in (22, 38, 95):  # EINVAL, ENOSYS, EOPNOTSUPP : échange non supporté ici
+        return False
+    raise OSError(errno, os.strerror(errno), path_a, None, path_b)
+
+
+def publish_staging_dir(staging, data_dir):
+    """
+    Publier le staging à la place de data_dir, sans instant où data/ manque.
+
+    - data_dir est un lien symbolique (ou DASHBOARD_PUBLISH_SYMLINK=1) : le lien
+      est remplacé par os.replace ; l'ancienne version est supprimée
+    - sinon (dossier réel, suivi par git) : échange atomique des deux dossiers par
+      renameat2(RENAME_EXCHANGE)
+    - repli hors Linux : deux rename, avec une fenêtre de quelques µs sans data/
+    """
+    import shutil
+
+    data_dir = os.path.normpath(data_dir)
+    old = staging.replace('.build-', '.old-', 1)
+    if os.path.islink(data_dir) or config_value('DASHBOARD_PUBLISH_SYMLINK') == '1':
+        previous = os.path.realpath(data_dir) if os.path.islink(data_dir) else None
+        tmp_link = f"{data_dir}.link-{os.getpid()}"
+        os.symlink(os.path.basename(staging), tmp_link, target_is_directory=True)
+        if previous is None and os.path.isdir(data_dir):
+            # Première publication en mode lien : le dossier réel est échangé avec le lien
+            if _rename_exchange(tmp_link, data_dir):
+                os.rename(tmp_link, old)
+            else:
+                os.rename(data_dir, old)
+                os.replace(tmp_link, data_dir)
+            previous = old
+        else:
+            os.replace(tmp_link, data_dir)
+        if previous and previous != os.path.realpath(staging):
+            shutil.rmtree(previous, ignore_errors=True)
+        return data_dir
+
+    if not os.path.isdir(data_dir):
+        os.rename(staging, data_dir)
+        return data_dir
+    if _rename_exchange(staging, data_dir):
+        # staging contient maintenant l'ancienne version
+        os.rename(staging, old)
+    else:
+        os.rename(data_dir, old)
+        os.rename(staging, data_dir)
+    shutil.rmtree(old, ignore_errors=True)
+    return data_dir
+
+
+# Manifest de build : empreinte de chaque fichier de data/ (ETag du serveur intégré)
+BUILD_MANIFEST_FILE = 'build-manifest.json'
+# Variantes pré-compressées (.gz, et .br si le module brotli est installé)
+PRECOMPRESS_EXTENSIONS = ('.js', '.json', '.css', '.html', '.svg')
+PRECOMPRESS_MIN_SIZE = 1024
+
+
+def _file_sha256(path):
+    import hashlib
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _precompress(path, encodings):
+    """Écrire path.gz / path.br (atomique) ; renvoie les encodages produits"""
+    import gzip
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    written = []
+    for encoding in encodings:
+        if encoding == 'gz':
+            payload = gzip.compress(data, compresslevel=9, mtime=0)
+        else:
+            import brotli
+            payload = brotli.compress(data)
+        tmp_path = f"{path}.{encoding}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, f"{path}.{encoding}")
+        written.append(encoding)
+    return written
+
+
+def write_build_manifest(data_dir, build_token):
+    """
+    Écrire data/build-manifest.json et les variantes .gz/.br de data/.
+
+    Un fichier inchangé depuis le build précédent (taille + mtime identiques,
+    cas des fichiers repris par lien dur dans le staging) garde son empreinte
+    et ses variantes compressées sans être relu.
+
+    Returns:
+        dict: {'files': nb de fichiers, 'hashed': nb relus, 'compressed': nb recompressés}
+    """
+    try:
+        import brotli  # noqa: F401
+        encodings = ('gz', 'br')
+    except ImportError:
+        encodings = ('gz',)
+
+    manifest_path = os.path.join(data_dir, BUILD_MANIFEST_FILE)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            previous = json.load(f).get('files', {})
+    except (OSError, ValueError):
+        previous = {}
+
+    files = {}
+    hashed = compressed = 0
+    for root, dirs, names in os.walk(data_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in sorted(names):
+            if name.startswith('.') or name == BUILD_MANIFEST_FILE or name.endswith(('.tmp', '.gz', '.br')):
+                continue
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, data_dir).replace(os.sep, '/')
+            st = os.stat(path)
+            prev = previous.get(rel)
+            if prev and prev['size'] == st.st_size and prev['mtime_ns'] == st.st_mtime_ns:
+                entry = dict(prev)
+            else:
+                entry = {'sha256': _file_sha256(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                         'encodings': []}
+                hashed += 1
+
+            wanted = [e for e in encodings
+                      if name.endswith(PRECOMPRESS_EXTENSIONS) and st.st_size >= PRECOMPRESS_MIN_SIZE]
+            fresh = prev and prev['sha256'] == entry['sha256']
+            missing = [e for e in wanted
+                       if not fresh or e not in prev.get('encodings', ()) or not os.path.exists(f'{path}.{e}')]
+            if missing:
+                _precompress(path, missing)
+                compressed += 1
+            for e in set(encodings) - set(wanted):
+                if os.path.exists(f'{path}.{e}'):
+                    os.remove(f'{path}.{e}')
+            entry['encodings'] = wanted
+            files[rel] = entry
+
+    # Variantes orphelines (fichier source supprimé)
+    for root, dirs, names in os.walk(data_dir):
+        for name in names:
+            if name.endswith(('.gz', '.br')):
+                rel = os.path.relpath(os.path.join(root, name[:-3]), data_dir).replace(os.sep, '/')
+                if rel not in files:
+                    os.remove(os.path.join(root, name))
+
+    write_text_file(manifest_path, json.dumps({'build_token': build_token, 'files': files},
+                                              ensure_ascii=False, separators=(',', ':')))
+    return {'files': len(files), 'hashed': hashed, 'compressed': compressed}
+
+
+# =============================================================================
+# EXPORT ANALYTIQUE — fichiers colonnes partitionnés (Parquet / Arrow / CSV)
+# =============================================================================
+# python dashboard_generator.py analytics [--format parquet|arrow|csv] [--output-dir analytics]
+#   analytics/listings/date=YYYY-MM-DD/site=Athome.lu/part-0.parquet  (annonces actuelles)
+#   analytics/history/date=YYYY-MM-DD/site=Athome.lu/part-0.parquet   (archives history/)
+# Partitions au format Hive (date = jour de publication pour listings, jour de
+# l'archive pour history) : DuckDB, pandas/pyarrow ou Spark filtrent par date et
+# site sans lire les autres fichiers. Parquet/Arrow si pyarrow est installé,
+# sinon CSV découpé en fichiers de ANALYTICS_CSV_ROWS lignes.
+#
+# Les annonces sont lues en flux depuis listings.db, triées par (date, site) :
+# un seul fichier ouvert à la fois, rien n'est chargé en entier en mémoire.
+# Les jours d'historique déjà exportés (même taille + mtime d'archive) sont sautés.
+ANALYTICS_DIR = 'analytics'
+ANALYTICS_FORMATS = ('parquet', 'arrow', 'csv')
+ANALYTICS_BATCH = 10000        # lignes par row group / record batch
+ANALYTICS_CSV_ROWS = 100000    # lignes par fichier CSV
+ANALYTICS_MANIFEST_FILE = '_manifest.json'
+ANALYTICS_NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+ANALYTICS_LISTINGS_ORDER = 'substr(created_at, 1, 10), site, id'
+# Colonnes exportées et leur type (les clés de partition date/site sont dans le chemin)
+ANALYTICS_COLUMNS = (
+    ('listing_id', 'string'), ('title', 'string'), ('city', 'string'),
+    ('price', 'float64'), ('rooms', 'int64'), ('surface', 'float64'), ('price_m2', 'float64'),
+    ('latitude', 'float64'), ('longitude', 'float64'), ('distance_km', 'float64'),
+    ('created_at', 'string'), ('url', 'string'), ('image_url', 'string'),
+)
+
+
+def analytics_format(requested=None):
+    """Format effectif : celui demandé si possible, sinon parquet avec pyarrow, sinon csv"""
+    try:
+        import pyarrow  # noqa: F401
+        has_arrow = True
+    except ImportError:
+        has_arrow = False
+    if requested in ('parquet', 'arrow') and not has_arrow:
+        print(f"⚠️  pyarrow non disponible - export {requested} remplacé par csv")
+        return 'csv'
+    return requested or ('parquet' if has_arrow else 'csv')
+
+
+def _analytics_value(kind, value):
+    if value in (None, ''):
+        return None
+    try:
+        if kind == 'float64':
+            return float(value)
+        if kind == 'int64':
+            return int(value)
+    except (TypeError, ValueError):
+        return None
+    return str(value)
+
+
+def _partition_name(key, value):
+    """Segment de chemin Hive key=valeur (valeur échappée, vide → partition par défaut)"""
+    from urllib.parse import quote
+    value = quote(str(value), safe=' .-_') if value else ANALYTICS_NULL_PARTITION
+    return f'{key}={value}'
+
+
+class PartitionedWriter:
+    """
+    Écriture de lignes triées par partition : un seul fichier ouvert à la fois.
+
+    write(partition_dir, row) ; le fichier courant est fermé dès que la
+    partition change (les lignes doivent arriver groupées par partition).
+    """
+
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self.columns = [name for name, _ in ANALYTICS_COLUMNS]
+        self.kinds = [kind for _, kind in ANALYTICS_COLUMNS]
+        self.partition = None
+        self.rows = []
+        self.part = 0
+        self.part_rows = 0
+        self.writer = None
+        self.file = None
+        self.files = 0
+        self.total = 0
+        self._schema = None
+
+    def schema(self):
+        if self._schema is None:
+            import pyarrow as pa
+            types = {'string': pa.string(), 'float64': pa.float64(), 'int64': pa.int64()}
+            self._schema = pa.schema([(name, types[kind]) for name, kind in ANALYTICS_COLUMNS])
+        return self._schema
+
+    def write(self, partition_dir, row):
+        if partition_dir != self.partition:
+            self.close()
+            self.partition = partition_dir
+            self.part = 0
+            os.makedirs(partition_dir, exist_ok=True)
+        self.rows.append([_analytics_value(kind, value) for kind, value in zip(self.kinds, row)])
+        self.total += 1
+        if len(self.rows) >= ANALYTICS_BATCH:
+            self._flush()
+
+    def _open(self):
+        ext = {'parquet': 'parquet', 'arrow': 'arrow', 'csv': 'csv'}[self.fmt]
+        path = os.path.join(self.partition, f'part-{self.part}.{ext}')
+        self.part += 1
+        self.part_rows = 0
+        self.files += 1
+        if self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(path, self.schema(), compression='zstd')
+        elif self.fmt == 'arrow':
+            import pyarrow as pa
+            self.file = pa.OSFile(path, 'wb')
+            self.writer = pa.ipc.new_file(self.file, self.schema())
+        else:
+            import csv
+            self.file = open(path, 'w', encoding='utf-8', newline='')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(self.columns)
+
+    def _flush(self):
+        if not self.rows:
+            return
+        if self.fmt == 'csv':
+            for row in self.rows:
+                if self.writer is None or self.part_rows >= ANALYTICS_CSV_ROWS:
+                    self._close_file()
+                    self._open()
+                self.writer.writerow(['' if v is None else v for v in row])
+                self.part_rows += 1
+        else:
+            import pyarrow as pa
+            if self.writer is None:
+                self._open()
+            arrays = [pa.array([row[i] for row in self.rows], type=field.type)
+                      for i, field in enumerate(self.schema())]
+            self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema()))
+        self.rows = []
+
+    def _close_file(self):
+        if self.writer is not None and self.fmt != 'csv':
+            self.writer.close()
+        if self.file is not None:
+            self.file.close()
+        self.writer = self.file = None
+
+    def close(self):
+        self._flush()
+        self._close_file()
+        self.partition = None
+
+
+def _listing_row(listing):
+    return [listing.get(name) for name, _ in ANALYTICS_COLUMNS]
+
+
+def export_analytics_listings(listings, root, fmt):
+    """
+    Annonces actuelles → root/listings/date=/site=/ (remplacé d'un bloc).
+
+    listings doit être trié par (date de publication, site) : voir
+    ANALYTICS_LISTINGS_ORDER.
+    """
+    target = os.path.join(root, 'listings')
+    staging = f"{target}.build-{os.getpid()}"
+    os.makedirs(staging)
+    writer = PartitionedWriter(fmt)
+    try:
+        for listing in listings:
+            created = listing.created_at or ''
+            partition = os.path.join(staging, _partition_name('date', created[:10]),
+                                     _partition_name('site', listing.site))
+            writer.write(partition, _listing_row(listing))
+    finally:
+        writer.close()
+    publish_staging_dir(staging, target)
+    return writer.total, writer.files
+
+
+def export_analytics_history(history_dir, root, fmt):
+    """Archives history/YYYY-MM-DD.json → root/history/date=/site=/ (jours modifiés seulement)"""
+    import glob
+    import shutil
+
+    target = os.path.join(root, 'history')
+    manifest_path = os.path.join(target, ANALYTICS_MANIFEST_FILE)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('format') != fmt:
+            manifest = {}
+    except (OSError, ValueError):
+        manifest = {}
+    days = manifest.get('days', {})
+    os.makedirs(target, exist_ok=True)
+
+    rows = files = exported = 0
+    for path in sorted(glob.glob(os.path.join(history_dir, '????-??-??.json'))):
+        day = os.path.basename(path)[:-5]
+        st = os.stat(path)
+        fingerprint = [st.st_size, st.st_mtime_ns]
+        day_dir = os.path.join(target, _partition_name('date', day))
+        if days.get(day) == fingerprint and os.path.isdir(day_dir):
+            continue
+        # Une archive = un jour : regroupée par site en mémoire (taille d'un build)
+        by_site = {}
+        for listing in _load_history_day(path):
+            by_site.setdefault(listing.get('site'), []).append(listing)
+        staging = f"{day_dir}.build-{os.getpid()}"
+        shutil.rmtree(staging, ignore_errors=True)
+        writer = PartitionedWriter(fmt)
+        try:
+            for site in sorted(by_site, key=lambda s: s or ''):
+                partition = os.path.join(staging, _partition_name('site', site))
+                for listing in by_site[site]:
+                    writer.write(partition, _listing_row(listing))
+        finally:
+            writer.close()
+        publish_staging_dir(staging, day_dir)
+        days[day] = fingerprint
+        rows += writer.total
+        files += writer.files
+        exported += 1
+
+    _write_json_atomic(manifest_path, {'format': fmt, 'days': days})
+    return exported, rows, files
+
+
+# =============================================================================
+# SERVEUR STATIQUE — dashboards/ avec ETag, 304, .gz/.br pré-compressés, Range
+# =============================================================================
+# python dashboard_generator.py serve [--port 8000] [--output-dir dashboards]
+#   - ETag fort : sha256 du build-manifest pour data/, empreinte calculée (et
+#     mise en cache par taille + mtime) pour les autres fichiers
+#   - If-None-Match → 304 ; Accept-Encoding br/gzip → variante .br/.gz seulement si
+#     le build-manifest courant la liste pour ce fichier (jamais une variante périmée)
+#   - Range (un seul intervalle, If-Range) → 206 / 416
+#   - Cache-Control : images/ gardées un jour, le reste revalidé (no-cache + ETag) :
+#     les pages chargent data/ sans URL versionnée
+# python dashboard_generator.py loadtest --url http://127.0.0.1:8000/data/listings.js
+SERVE_PORT = 8000
+SERVE_IMAGES_MAX_AGE = 24 * 3600
+SERVE_CHUNK = 256 * 1024
+SERVE_ENCODINGS = (('br', 'br'), ('gzip', 'gz'))  # (Content-Encoding, extension), ordre de préférence
+SERVE_CONTENT_TYPES = {
+    '.js': 'application/javascript; charset=utf-8',
+    '.json': 'application/json; charset=utf-8',
+    '.html': 'text/html; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.svg': 'image/svg+xml',
+    '.jpg': 'image/jpeg',
+    '.webmanifest': 'application/manifest+json',
+}
+
+
+class DashboardFiles:
+    """Résolution des fichiers servis et de leurs empreintes (partagé entre threads)"""
+
+    def __init__(self, root):
+        import threading
+        self.root = os.path.abspath(root)
+        self.manifest_path = os.path.join(self.root, 'data', BUILD_MANIFEST_FILE)
+        self.manifest_key = None
+        self.manifest = {}
+        self.hash_cache = {}
+        self.lock = threading.Lock()
+
+    def _manifest(self):
+        # Relu quand data/ est republié (nouvel inode ou mtime du manifest)
+        try:
+            st = os.stat(self.manifest_path)
+            key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            key = None
+        if key != self.manifest_key:
+            manifest = {}
+            if key is not None:
+                try:
+                    with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                        manifest = json.load(f)
+                except (OSError, ValueError):
+                    pass
+            with self.lock:
+                self.manifest = manifest.get('files', {})
+                self.manifest_key = key
+        return self.manifest
+
+    def resolve(self, url_path):
+        """Chemin disque d'une URL (None si hors de la racine ou inexistant)"""
+        from urllib.parse import unquote
+        rel = unquote(url_path).lstrip('/')
+        # Fichiers d'état (.build.lock, images/.state/, data/.alert-state.json...) non servis
+        if any(part.startswith('.') for part in rel.split('/')):
+            return None, None
+        path = os.path.realpath(os.path.join(self.root, rel))
+        if path != self.root and not path.startswith(self.root + os.sep):
+            return None, None
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+            rel = f"{rel.rstrip('/')}/index.html".lstrip('/')
+        if not os.path.isfile(path):
+            return None, None
+        return path, rel
+
+    def manifest_entry(self, rel, st):
+        """Entrée du build-manifest d'un fichier de data/ (None si absente ou périmée)"""
+        if not rel.startswith('data/'):
+            return None
+        entry = self._manifest().get(rel[len('data/'):])
+        if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return entry
+        return None
+
+    def fingerprint(self, path, rel, st):
+        """Empreinte sha256 du fichier (manifest si à jour, sinon calculée une fois)"""
+        entry = self.manifest_entry(rel, st)
+        if entry:
+            return entry['sha256']
+        key = (path, st.st_size, st.st_mtime_ns)
+        digest = self.hash_cache.get(key)
+        if digest is None:
+            digest = _file_sha256(path)
+            with self.lock:
+                self.hash_cache[key] = digest
+        return digest
+
+
+def _parse_range(header, size):
+    """(début, fin incluse) d'un Range "bytes=a-b" ; None si absent/multiple, False si non satisfiable"""
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start, _, end = header[len('bytes='):].strip().partition('-')
+    try:
+        if start == '':
+            length = int(end)
+            if length <= 0:
+                return False
+            return max(0, size - length), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def make_dashboard_handler(files, verbose=False):
+    """Classe de handler http.server liée à un DashboardFiles"""
+    from http.server import BaseHTTPRequestHandler
+    from email.utils import formatdate
+    from urllib.parse import urlsplit
+
+    class DashboardHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive
+        server_version = 'ImmoLux'
+        # En-têtes et petit corps envoyés séparément : sans TCP_NODELAY, Nagle + ACK
+        # retardé ajoutent ~40 ms par réponse sur une connexion keep-alive
+        disable_nagle_algorithm = True
+
+        def log_message(self, fmt, *args):
+            if verbose:
+                super().log_message(fmt, *args)
+
+        def do_HEAD(self):
+            self.serve(head=True)
+
+        def do_GET(self):
+            self.serve(head=False)
+
+        def send_empty(self, status, headers=()):
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def cache_control(self, rel):
+            if rel.startswith('images/'):
+                return f'public, max-age={SERVE_IMAGES_MAX_AGE}'
+            return 'no-cache'
+
+        def serve(self, head):
+            url = urlsplit(self.path)
+            path, rel = files.resolve(url.path)
+            if path is None:
+                self.send_empty(404)
+                return
+            st = os.stat(path)
+            digest = files.fingerprint(path, rel, st)
+            entry = files.manifest_entry(rel, st)
+            ext = os.path.splitext(path)[1].lower()
+            content_type = SERVE_CONTENT_TYPES.get(ext)
+            if content_type is None:
+                import mimetypes
+                content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+            # Variante pré-compressée (pas pour une requête Range : octets du fichier d'origine),
+            # seulement si le manifest du build courant la liste : un .gz/.br laissé par un
+            # build précédent ou hors data/ n'est jamais servi
+            encoding = None
+            range_header = self.headers.get('Range')
+            accepted = self.headers.get('Accept-Encoding', '')
+            listed = entry['encodings'] if entry else ()
+            if not range_header:
+                for name, suffix in SERVE_ENCODINGS:
+                    if name in accepted and suffix in listed and os.path.isfile(f'{path}.{suffix}'):
+                        encoding, path = name, f'{path}.{suffix}'
+                        st = os.stat(path)
+                        break
+            etag = f'"{digest[:32]}-{encoding}"' if encoding else f'"{digest[:32]}"'
+            headers = [('ETag', etag), ('Cache-Control', self.cache_control(rel)),
+                       ('Vary', 'Accept-Encoding'), ('Accept-Ranges', 'bytes'),
+                       ('Last-Modified', formatdate(st.st_mtime, usegmt=True))]
+
+            inm = self.headers.get('If-None-Match')
+            if inm and (inm.strip() == '*' or etag in [t.strip() for t in inm.split(',')]):
+                self.send_empty(304, headers)
+                return
+
+            size = st.st_size
+            start, end, status = 0, size - 1, 200
+            if range_header and self.headers.get('If-Range', etag) == etag:
+                byte_range = _parse_range(range_header, size)
+                if byte_range is False:
+                    self.send_empty(416, headers + [('Content-Range', f'bytes */{size}')])
+                    return
+                if byte_range:
+                    start, end = byte_range
+                    status = 206
+
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header('Content-Type', content_type)
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            if status == 206:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            self.send_header('Content-Length', str(end - start + 1 if size else 0))
+            self.end_headers()
+            if head or not size:
+                return
+            with open(path, 'rb') as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    block = f.read(min(SERVE_CHUNK, remaining))
+                    if not block:
+                        break
+                    self.wfile.write(block)
+                    remaining -= len(block)
+
+    return DashboardHandler
+
+
+def make_dashboard_server(root, host='127.0.0.1', port=SERVE_PORT, verbose=False):
+    """Serveur HTTP threadé des fichiers du dashboard"""
+    from http.server import ThreadingHTTPServer
+    server = ThreadingHTTPServer((host, port), make_dashboard_handler(DashboardFiles(root), verbose))
+    server.daemon_threads = True
+    return server
+
+
+def run_load_test(url, requests=2000, concurrency=8, revalidate=False, accept_encoding=None):
+    """
+    Charge HTTP simple : `concurrency` connexions keep-alive, `requests` requêtes au total.
+
+    revalidate : les requêtes renvoient l'ETag reçu (mesure du chemin 304).
+
+    Returns:
+        dict: requêtes/s, latences p50/p95/max (ms), octets reçus, compte par statut
+    """
+    import http.client
+    import threading
+    import time
+    from urllib.parse import urlsplit
+
+    parts = urlsplit(url)
+    target = parts.path + (f'?{parts.query}' if parts.query else '') or '/'
+    per_worker = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    latencies, statuses = [], {}
+    received = [0]
+    lock = threading.Lock()
+
+    def worker(count):
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        etag = None
+        local, local_status, local_bytes = [], {}, 0
+        for _ in range(count):
+            headers = {}
+            if accept_encoding:
+                headers['Accept-Encoding'] = accept_encoding
+            if revalidate and etag:
+                headers['If-None-Match'] = etag
+            start = time.perf_counter()
+            conn.request('GET', target, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+            local.append(time.perf_counter() - start)
+            etag = response.getheader('ETag') or etag
+            local_status[response.status] = local_status.get(response.status, 0) + 1
+            local_bytes += len(body)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            for status, n in local_status.items():
+                statuses[status] = statuses.get(status, 0) + n
+            received[0] += local_bytes
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in per_worker if n]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2) if latencies else None
+
+    return {'requests': len(latencies), 'seconds': round(elapsed, 3),
+            'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+            'p50_ms': pct(0.50), 'p95_ms': pct(0.95), 'max_ms': pct(1.0),
+            'bytes': received[0], 'statuses': statuses}
+
+
+# =============================================================================
+# BUILDS MULTI-PROFILS — une lecture de la base, plusieurs dossiers de sortie
+# =============================================================================
+# Fichier de profils (chemin dans BUILD_PROFILES, .env) : liste JSON de
+#   {"name": "centre", "output_dir": "dashboards-centre",
+#    "cities": ["Belair", "Merl"], "sites": [...], "price_min": 0, "price_max": 2500,
+#    "rooms_min": 1, "surface_min": 40, "priority_cities": [...]}
+# Tous les critères sont optionnels. Les annonces sont lues, normalisées et leurs
+# images téléchargées une seule fois ; chaque profil filtre, calcule ses stats et
+# exporte dans son dossier, en parallèle (pool de processus). Le dossier images/
+# de chaque profil est un lien vers le cache d'images partagé.
+
+# Annonces partagées avec les processus du pool (envoyées une fois par processus)
+_PROFILE_LISTINGS = None
+
+
+def load_build_profiles(path):
+    """Lire le fichier de profils (liste JSON) ; [] si absent"""
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        profiles = json.load(f)
+    for profile in profiles:
+        if not profile.get('name') or not profile.get('output_dir'):
+            raise ValueError(f"Profil invalide (name et output_dir requis): {profile}")
+    return profiles
+
+
+def filter_listings_for_profile(listings, profile):
+    """Annonces correspondant aux critères d'un profil"""
+    cities = set(normalize_city_name(c) for c in profile.get('cities') or [])
+    sites = set(profile.get('sites') or [])
+    price_min = profile.get('price_min')
+    price_max = profile.get('price_max')
+    rooms_min = profile.get('rooms_min')
+    surface_min = profile.get('surface_min')
+
+    selected = []
+    for l in listings:
+        if cities and l.get('city') not in cities:
+            continue
+        if sites and l.get('site') not in sites:
+            continue
+        price = l.get('price') or 0
+        if price_min is not None and price < price_min:
+            continue
+        if price_max is not None and price > price_max:
+            continue
+        if rooms_min is not None and (l.get('rooms') or 0) < rooms_min:
+            continue
+        if surface_min is not None and (l.get('surface') or 0) < surface_min:
+            continue
+        selected.append(l)
+    return selected
+
+
+def _link_shared_images(output_dir, images_dir):
+    """Lier <output_dir>/images au cache d'images partagé (copie par liens durs si symlink impossible)"""
+    target = os.path.join(output_dir, 'images')
+    if os.path.lexists(target):
+        return
+    try:
+        os.symlink(os.path.abspath(images_dir), target, target_is_directory=True)
+    except OSError:
+        os.makedirs(target, exist_ok=True)
+        for entry in os.scandir(images_dir):
+            if entry.is_file():
+                _link_or_copy(entry.path, os.path.join(target, entry.name))
+
+
+def _init_profile_worker(listings):
+    global _PROFILE_LISTINGS
+    _PROFILE_LISTINGS = listings
+
+
+def build_profile(profile, images_dir=IMAGES_DIR):
+    """Construire les données d'un profil (exécuté dans un processus du pool)"""
+    output_dir = profile['output_dir']
+    data_dir = os.path.join(output_dir, 'data')
+    listings = filter_listings_for_profile(_PROFILE_LISTINGS, profile)
+    stats = calc_stats(listings)
+
+    os.makedirs(output_dir, exist_ok=True)
+    _link_shared_images(output_dir, images_dir)
+    staging = prepare_staging_dir(data_dir)
+    # Déjà dans un processus du pool des profils : exporteurs en threads
+    export_data(listings, stats, staging, use_processes=False)
+    build_token = generate_version_js(staging, stats['total'], profile.get('priority_cities'))
+    write_build_manifest(staging, build_token)
+    publish_staging_dir(staging, data_dir)
+    update_sw_cache_version(output_dir, build_token)
+    generate_manifest(output_dir)
+    return profile['name'], stats['total']
+
+
+def build_profiles(listings, profiles, images_dir=IMAGES_DIR, max_workers=None):
+    """
+    Construire tous les profils en parallèle à partir d'une seule lecture des annonces.
+
+    Returns:
+        list: [(nom du profil, nombre d'annonces), ...] dans l'ordre des profils
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+
+    if not profiles:
+        return []
+    workers = max_workers or min(len(profiles), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_profile_worker,
+                             initargs=(listings,)) as pool:
+        return list(pool.map(partial(build_profile, images_dir=images_dir), profiles))
+
+
+# =============================================================================
+# VÉRIFICATION — sorties et temps des chemins optimisés face au pipeline de référence
+# =============================================================================
+# Référence  : copie figée du pipeline d'origine — lecture sqlite3 en dicts,
+#              calc_stats, calc_anomalies, écriture en série avec json (stdlib) ;
+#              n'utilise ni Listing, ni read_listings, ni run_exporters
+# Optimisé   : lecture Listing (read_listings_multi), agrégats SQL matérialisés
+#              (copie de la base de test, agrégats amorcés avant les mesures : seule
+#              la mise à jour incrémentale d'un build courant est chronométrée),
+#              exporteurs de la configuration courante, backend JSON configuré
+# listings.js / stats.js / anomalies.js sont comparés après décodage (l'indentation et
+# le backend JSON peuvent différer) ; les étapes d'enrichissement (géocodage, cycle de
+# vie) et les images sont hors comparaison.
+#
+# Temps : une étape optimisée échoue si elle est plus lente que la baseline enregistrée
+# (VERIFY_BASELINE_PATH, défaut verify-baseline.json) de plus du seuil. Le rapport à la
+# référence est affiché à titre indicatif. Sans baseline, la vérification échoue tant
+# que --update-baseline ne l'a pas créée (refusé seulement si les sorties diffèrent).
+
+VERIFY_BASELINE_FILE = 'verify-baseline.json'
+VERIFY_THRESHOLD = 0.25           # ralentissement toléré par étape (25%)
+VERIFY_MIN_SLOWDOWN_SECONDS = 0.01  # en dessous, écart considéré comme du bruit
+VERIFY_EXPORTERS = ('listings', 'stats', 'anomalies')
+VERIFY_STAGES = ('read', 'stats', 'anomalies', 'export')
+
+
+def _reference_read_listings(db_path):
+    """Lecture d'origine (dicts, fetchall) — figée, ne pas optimiser"""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        SELECT listing_id, site, title, city, price, rooms, surface,
+               url, latitude, longitude, distance_km, created_at, image_url
+        FROM listings
+        ORDER BY id DESC
+    ''')
+
+    listings = []
+    for row in cursor.fetchall():
+        listing = dict(row)
+        if listing.get('city'):
+            listing['city'] = normalize_city_name(listing['city'])
+        img = listing.get('image_url') or ''
+        if img and 'athome.lu/imageGallery/' in img:
+            m = re.search(r'/imageGallery/\w+(.+)', img)
+            if m:
+                listing['image_url'] = f"https://i1.static.athome.eu/images/annonces2/image_{m.group(1)}"
+        if listing['price'] and listing['surface'] and listing['surface'] > 0:
+            listing['price_m2'] = round(listing['price'] / listing['surface'], 1)
+        else:
+            listing['price_m2'] = None
+        listings.append(listing)
+
+    conn.close()
+    return listings
+
+
+def _reference_export(listings, stats, anomalies, data_dir):
+    """Écriture d'origine de listings.js / stats.js / anomalies.js — figée, en série"""
+    os.makedirs(data_dir, exist_ok=True)
+    now_str = datetime.now().strftime("%d/%m/%Y %H:%M")
+
+    listings_json = json.dumps(listings, ensure_ascii=False, indent=2, default=str)
+    with open(os.path.join(data_dir, 'listings.js'), 'w', encoding='utf-8') as f:
+        f.write(f'// Genere le {now_str}\n')
+        f.write(f'// {len(listings)} annonces depuis listings.db\n')
+        f.write(f'const LISTINGS = {listings_json};\n')
+
+    colors = ['#FF6384', '#36A2EB', '#FFCE56', '#4BC0C0', '#9966FF', '#FF9F40', '#2ECC71', '#E74C3C', '#3498DB']
+    site_colors = {}
+    for i, site in enumerate(stats['sites'].keys()):
+        site_colors[site] = colors[i % len(colors)]
+    with open(os.path.join(data_dir, 'stats.js'), 'w', encoding='utf-8') as f:
+        f.write(f'// Genere le {now_str}\n')
+        f.write(f'const STATS = {json.dumps(stats, ensure_ascii=False, indent=2)};\n')
+        f.write(f'const SITE_COLORS = {json.dumps(site_colors, ensure_ascii=False, indent=2)};\n')
+
+    anomalies_json = json.dumps(anomalies, ensure_ascii=False, indent=2, default=str)
+    with open(os.path.join(data_dir, 'anomalies.js'), 'w', encoding='utf-8') as f:
+        f.write(f'// Genere le {now_str}\n')
+        f.write(f'// {len(anomalies)} anomalies detectees\n')
+        f.write(f'const ANOMALIES = {anomalies_json};\n')
+
+
+def read_js_consts(path):
+    """Constantes d'un fichier data/*.js ({NOM: valeur décodée})"""
+    with open(path, encoding='utf-8') as f:
+        content = f.read()
+    decoder = json.JSONDecoder()
+    consts = {}
+    for m in re.finditer(r'^const (\w+) = ', content, re.M):
+        consts[m.group(1)], _ = decoder.raw_decode(content, m.end())
+    return consts
+
+
+def _json_diff(a, b, path='', limit=5):
+    """Premières différences entre deux valeurs JSON décodées (chemins lisibles)"""
+    diffs = []
+    if isinstance(a, dict) and isinstance(b, dict):
+        for key in list(a) + [k for k in b if k not in a]:
+            if key not in a or key not in b:
+                diffs.append(f"{path}/{key}: {'absent' if key not in a else a[key]!r} != "
+                             f"{'absent' if key not in b else b[key]!r}")
+            else:
+                diffs.extend(_json_diff(a[key], b[key], f"{path}/{key}", limit - len(diffs)))
+            if len(diffs) >= limit:
+                break
+    elif isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            diffs.append(f"{path}: {len(a)} éléments != {len(b)}")
+        for i, (x, y) in enumerate(zip(a, b)):
+            diffs.extend(_json_diff(x, y, f"{path}[{i}]", limit - len(diffs)))
+            if len(diffs) >= limit:
+                break
+    elif a != b:
+        diffs.append(f"{path}: {a!r} != {b!r}")
+    return diffs[:limit]
+
+
+def _run_reference_pipeline(db_path, data_dir):
+    """Pipeline de référence ; retourne {étape: secondes}"""
+    import time
+
+    timings = {}
+    start = time.perf_counter()
+    listings = _reference_read_listings(db_path)
+    timings['read'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stats = calc_stats(listings)
+    timings['stats'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    anomalies = calc_anomalies(listings, stats)
+    timings['anomalies'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _reference_export(listings, stats, anomalies, data_dir)
+    timings['export'] = time.perf_counter() - start
+    return timings
+
+
+def _seed_optimized_pipeline(db_path, work_db):
+    """Copie de la base de test avec journal des changements et agrégats à jour (hors mesure)"""
+    import shutil
+
+    shutil.copyfile(db_path, work_db)
+    ensure_change_log(work_db)
+    listings, report = read_listings_multi([work_db])
+    update_aggregates(listings, work_db, report)
+
+
+def _run_optimized_pipeline(data_dir, work_db):
+    """Pipeline optimisé (configuration courante, base amorcée) ; retourne {étape: secondes}"""
+    import time
+
+    timings = {}
+    start = time.perf_counter()
+    listings, report = read_listings_multi([work_db])
+    timings['read'] = time.perf_counter() - start
+
+    # Build courant : mise à jour incrémentale (journal des changements) puis lecture
+    start = time.perf_counter()
+    update_aggregates(listings, work_db, report)
+    stats = calc_stats_from_aggregates(work_db)
+    timings['stats'] = time.perf_counter() - start
+
+    ctx = build_export_context(listings, stats)
+    start = time.perf_counter()
+    ctx['anomalies'] = calc_anomalies(listings, stats)
+    timings['anomalies'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    run_exporters(ctx, data_dir, list(VERIFY_EXPORTERS))
+    timings['export'] = time.perf_counter() - start
+    return timings
+
+
+def verify_pipelines(db_path, baseline_path=None, threshold=VERIFY_THRESHOLD, repeat=3,
+                     update_baseline=False):
+    """
+    Comparer les sorties du pipeline optimisé à la référence, et ses temps à la
+    baseline enregistrée (le rapport à la référence est indicatif).
+
+    Returns:
+        dict: {'listings', 'diffs': {fichier: [différences]}, 'timings': {étape: {...}},
+               'slower_than_reference', 'slower_than_baseline': [étapes hors seuil],
+               'baseline_missing', 'baseline_updated', 'ok'}
+    """
+    import shutil
+    import tempfile
+
+    work_dir = tempfile.mkdtemp(prefix='verify-')
+    try:
+        ref_dir = os.path.join(work_dir, 'reference')
+        opt_dir = os.path.join(work_dir, 'optimized')
+        work_db = os.path.join(work_dir, 'listings.db')
+        _seed_optimized_pipeline(db_path, work_db)
+
+        # Meilleur temps sur `repeat` exécutions de chaque pipeline
+        reference, optimized = {}, {}
+        for _ in range(max(repeat, 1)):
+            for best, run in ((reference, lambda: _run_reference_pipeline(db_path, ref_dir)),
+                              (optimized, lambda: _run_optimized_pipeline(opt_dir, work_db))):
+                for stage, seconds in run().items():
+                    best[stage] = min(best.get(stage, seconds), seconds)
+
+        diffs = {}
+        total = 0
+        for name in VERIFY_EXPORTERS:
+            filename = f'{name}.js'
+            ref = read_js_consts(os.path.join(ref_dir, filename))
+            opt = read_js_consts(os.path.join(opt_dir, filename))
+            if name == 'listings':
+                total = len(ref.get('LISTINGS', []))
+            found = _json_diff(ref, opt)
+            if found:
+                diffs[filename] = found
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    baseline = {}
+    if baseline_path and os.path.exists(baseline_path):
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f).get('stages', {})
+
+    def too_slow(seconds, limit_of):
+        return seconds > limit_of * (1 + threshold) and seconds - limit_of > VERIFY_MIN_SLOWDOWN_SECONDS
+
+    timings, slower_than_reference, slower_than_baseline = {}, [], []
+    for stage in VERIFY_STAGES:
+        entry = {'reference': round(reference[stage], 4), 'optimized': round(optimized[stage], 4)}
+        if too_slow(optimized[stage], reference[stage]):
+            slower_than_reference.append(stage)
+        if stage in baseline:
+            entry['baseline'] = baseline[stage]
+            if too_slow(optimized[stage], baseline[stage]):
+                slower_than_baseline.append(stage)
+        timings[stage] = entry
+
+    # --update-baseline remplace la baseline (sorties identiques requises)
+    updated = False
+    if update_baseline and baseline_path and not diffs:
+        write_text_file(baseline_path, json.dumps({
+            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'db': os.path.basename(db_path),
+            'listings': total,
+            'json_backend': json_backend(),
+            'stages': {stage: round(optimized[stage], 4) for stage in VERIFY_STAGES},
+        }, ensure_ascii=False, indent=2) + '\n')
+        updated = True
+        slower_than_baseline = []
+
+    baseline_missing = not baseline and not updated
+    ok = not diffs and not slower_than_baseline and not baseline_missing
+    return {'listings': total, 'diffs': diffs, 'timings': timings,
+            'slower_than_reference': slower_than_reference, 'slower_than_baseline': slower_than_baseline,
+            'baseline_missing': baseline_missing, 'baseline_updated': updated, 'ok': ok}
+
+
+def cmd_export(args):
+    """Build complet sous verrou : si un autre run est en cours, celui-ci est ignoré"""
+    with build_lock(args.output_dir) as locked:
+        if locked:
+            _export_build(args)
+
+
+def _export_build(args):
+    """Build complet : lecture, agrégats, images, exports, version, manifest, profils"""
+    from database import db
+
     print("Initialisation de la base de donnees...")
     # Initialize database (creates tables if they don't exist)
     db.init_db()
-
-    print("Lecture de listings.db...")
-    listings = read_listings()
+    sources = resolve_db_sources(args.db)
+    db_path = sources[0]
+
+    # Un instantané en lecture seule par base ; plusieurs bases lues en parallèle.
+    # C'est la seule lecture des tables des scrapers : les étapes suivantes travaillent
+    # sur ces annonces (id source compris) et ne relisent que les tables du générateur
+    # (et le journal des changements, jusqu'à la position lue avec l'instantané).
+    for source in sources:
+        if not ensure_change_log(source):
+            print(f"⚠️  Journal des changements indisponible pour {source} : diff complet des agrégats")
+    listings, report = _read_sources(sources)
 
     if not listings:
         print("Aucune annonce trouvee dans la base.")
         return
 
-    stats = calc_stats(listings)
     today = datetime.now().strftime('%Y-%m-%d')
-    dashboards_dir = 'dashboards'
+    dashboards_dir = args.output_dir
     data_dir = os.path.join(dashboards_dir, 'data')
     images_dir = os.path.join(dashboards_dir, 'images')
-    print(f"  {stats['total']} annonces, {stats['cities']} villes, {len(stats['sites'])} sites")
 
     # Creer les dossiers
     os.makedirs(os.path.join(dashboards_dir, 'archives'), exist_ok=True)
     os.makedirs(images_dir, exist_ok=True)
 
-    # Etape 0 : Télécharger les images (avec ou sans Pillow)
-    downloaded, failed = process_images_for_listings(listings, images_dir)
-
-    # Etape 1 : exporter donnees JS + JSON + archive quotidienne
-    site_colors = export_data(listings, stats, data_dir)
-    print(f"  -> {data_dir}/listings.js")
-    print(f"  -> {data_dir}/stats.js")
-    print(f"  -> {data_dir}/listings.json")
-    print(f"  -> {data_dir}/history/{today}.json")
-
-    # Etape 1b : version.js + cache busting sw.js
-    build_token = generate_version_js(data_dir, stats['total'])
-    print(f"  -> {data_dir}/version.js (v{DASHBOARD_VERSION} token:{build_token})")
-    update_sw_cache_version(dashboards_dir, build_token)
-    print(f"  -> {dashboards_dir}/sw.js (cache version: {build_token})")
-
-    # Etape 2 : manifest PWA
-    generate_manifest(dashboards_dir)
-    print(f"  -> {dashboards_dir}/manifest.json")
+    # Etape 0 : Télécharger les images (avec ou sans Pillow), hors transaction : le
+    # réseau ne doit pas prolonger le verrou d'écriture sur listings.db
+    if not args.no_images:
+        downloaded, failed = process_images_for_listings(listings, images_dir, budget_seconds=_image_budget(args))
+
+    # Tables du générateur (qualité, agrégats, cycle de vie) modifiées dans une seule
+    # transaction, validée après publication : un export en échec n'avance pas les tables
+    with generator_transaction(db_path) as conn:
+        # Qualité des données brutes des scrapers (avant géocodage) : compteurs par site/contrôle
+        added, removed = update_quality(listings, db_path, conn=conn)
+        print(f"  Qualité : +{added} / -{removed} annonces recontrôlées")
+
+        # Coordonnées manquantes (gazetteer / centre de la ville) et distances
+        geo = enrich_geo(listings)
+        print(f"  Géocodage : {geo['gazetteer']} via gazetteer, {geo['centroid']} via centre de ville, "
+              f"{geo['unresolved']} sans coordonnées, {geo['distances']} distances calculées")
+
+        # Statistiques : agrégats matérialisés mis à jour avec les seuls changements
+        added, removed = update_aggregates(listings, db_path, report, conn=conn)
+        print(f"  Agrégats : +{added} / -{removed} annonces depuis le dernier build")
+        stats = calc_stats_from_aggregates(db_path, conn=conn)
+
+        # Cycle de vie : première vue, retraits, changements de prix
+        lifecycle = update_lifecycle(listings, db_path, conn=conn)
+        print(f"  Cycle de vie : {lifecycle['new']} nouvelles, {lifecycle['removed']} retirées, "
+              f"{lifecycle['price_changes']} changements de prix")
+        print(f"  {stats['total']} annonces, {stats['cities']} villes, {len(stats['sites'])} sites")
+
+        # Etape 1 : exporter donnees JS + JSON + archive quotidienne (exporteurs actifs)
+        # dans un dossier de staging, publié d'un bloc une fois complet
+        staging = prepare_staging_dir(data_dir)
+        export_ctx = build_export_context(listings, stats, db_path, conn)
+        site_colors = export_ctx['site_colors']
+        exporter_names = selected_exporters(args.exporters) if args.exporters is not None else None
+        for name, paths in run_exporters(export_ctx, staging, exporter_names).items():
+            if name == HeatmapExporter.name:
+                # Une ligne pour toute la heatmap (tuiles réécrites par zoom), pas une par tuile
+                print(f"  -> {data_dir}/{HEATMAP_DIR}/ ({heatmap_zoom_summary(staging, paths)})")
+                continue
+            for path in paths:
+                print(f"  -> {data_dir}{path[len(staging):]}")
+
+        # Etape 1b : version.js, publication de data/, puis cache busting sw.js
+        build_token = generate_version_js(staging, stats['total'])
+        print(f"  -> {data_dir}/version.js (v{DASHBOARD_VERSION} token:{build_token})")
+        built = write_build_manifest(staging, build_token)
+        print(f"  -> {data_dir}/{BUILD_MANIFEST_FILE} ({built['files']} fichiers, "
+              f"{built['hashed']} empreintes, {built['compressed']} compressés)")
+        publish_staging_dir(staging, data_dir)
+        print(f"  -> {data_dir}/ publié")
+        update_sw_cache_version(dashboards_dir, build_token)
+        print(f"  -> {dashboards_dir}/sw.js (cache version: {build_token})")
+
+        # Etape 2 : manifest PWA
+        generate_manifest(dashboards_dir)
+        print(f"  -> {dashboards_dir}/manifest.json")
+    _prune_change_logs(db_path, _change_marks(report))
+    # Etape 2b : profils supplémentaires (BUILD_PROFILES), même lecture + images partagées
+    profiles = load_build_profiles(args.profiles or config_value('BUILD_PROFILES'))
+    if profiles:
+        print(f"\nBuild de {len(profiles)} profils...")
+        for name, total in build_profiles(listings, profiles, images_dir):
+            print(f"  -> profil {name}: {total} annonces")
 
     # ⚠️  ETAPES 3 & 4 COMMENTÉES : Ne pas régénérer les fichiers HTML
     # Les fichiers HTML (index.html, photos.html, stats-by-city.html, etc.) sont gérés manuellement
@@ -1189,9 +5634,9 @@ def main():
 
     print(f"\n✅ Données du dashboard générées avec succès!")
     print(f"📊 Les fichiers HTML manuels sont PRÉSERVÉS:")
-    print(f"   - dashboards/index.html (avec glasmorphism + dark mode)")
-    print(f"   - dashboards/photos.html (avec images + transport)")
-    print(f"   - dashboards/stats-by-city.html (avec onglets + transport)")
+    print(f"   - {dashboards_dir}/index.html (avec glasmorphism + dark mode)")
+    print(f"   - {dashboards_dir}/photos.html (avec images + transport)")
+    print(f"   - {dashboards_dir}/stats-by-city.html (avec onglets + transport)")
     print(f"   - Et tous les autres fichiers HTML personnalisés")
     print(f"\n📈 Données exportées:")
     print(f"   ✅ listings.js (avec {stats['total']} annonces)")
@@ -1202,6 +5647,269 @@ def main():
     print(f"   📸 {local_images}/{stats['total']} images locales dans {images_dir}/")
 
 
+def _image_budget(args):
+    """Budget de l'étape images : option --image-budget, sinon IMAGE_BUDGET_SECONDS"""
+    if args.image_budget is not None:
+        return args.image_budget or None
+    return float(config_value('IMAGE_BUDGET_SECONDS') or 0) or None
+
+
+def _read_sources(sources):
+    """Lire les bases (fusion si plusieurs) ; retourne (annonces, rapport par base)"""
+    print(f"Lecture de {', '.join(sources)}...")
+    listings, report = read_listings_multi(sources)
+    if len(report) > 1:
+        for entry in report:
+            print(f"  {entry['source']}: {entry['rows']} annonces lues, {entry['kept']} retenues "
+                  f"({entry['seconds'] * 1000:.0f} ms)")
+        print(f"  Fusion : {len(listings)} annonces uniques depuis {len(report)} bases")
+    return listings, report
+
+
+def cmd_images(args):
+    """Étape images seule : téléchargement/compression + nettoyage"""
+    listings, _ = _read_sources(resolve_db_sources(args.db))
+    if not listings:
+        print("Aucune annonce trouvee dans la base.")
+        return
+    if args.gc_dry_run:
+        os.environ['IMAGE_GC_DRY_RUN'] = '1'
+    with build_lock(args.output_dir) as locked:
+        if locked:
+            process_images_for_listings(listings, os.path.join(args.output_dir, 'images'),
+                                        budget_seconds=_image_budget(args))
+
+
+def cmd_stats(args):
+    """Mettre à jour les agrégats et afficher les statistiques (sous le verrou de build)"""
+    with build_lock(args.output_dir) as locked:
+        if locked:
+            _stats(args)
+
+
+def _stats(args):
+    """Agrégats mis à jour depuis la base puis affichés"""
+    sources = resolve_db_sources(args.db)
+    for source in sources:
+        if not ensure_change_log(source) and not args.json:
+            print(f"⚠️  Journal des changements indisponible pour {source} : diff complet des agrégats")
+    if args.json:
+        listings, report = read_listings_multi(sources)
+    else:
+        listings, report = _read_sources(sources)
+    added, removed = update_aggregates(listings, sources[0], report)
+    stats = calc_stats_from_aggregates(sources[0])
+    if args.json:
+        print(json_dumps(stats))
+        return
+    print(f"Agrégats : +{added} / -{removed} annonces depuis le dernier build")
+    print(f"{stats['total']} annonces, {stats['cities']} villes, {len(stats['sites'])} sites")
+    print(f"Prix moyen {stats['avg_price']}€ (min {stats['min_price']}€, max {stats['max_price']}€), "
+          f"surface moyenne {stats['avg_surface']}m²")
+    for site, count in stats['sites'].items():
+        print(f"  {site}: {count}")
+
+
+def cmd_analytics(args):
+    """Export analytique partitionné, sous le verrou de build (history/ n'est pas republié en cours de lecture)"""
+    with build_lock(args.dashboards_dir) as locked:
+        if locked:
+            _analytics(args)
+
+
+def _analytics(args):
+    """Export analytique partitionné (annonces de la base + archives history/)"""
+    fmt = analytics_format(args.format)
+    root = args.output_dir or config_value('ANALYTICS_DIR', ANALYTICS_DIR)
+    os.makedirs(root, exist_ok=True)
+    print(f"Export analytique ({fmt}) vers {root}/...")
+
+    sources = resolve_db_sources(args.db)
+    if len(sources) == 1:
+        # Flux direct depuis la base, déjà trié par (date, site)
+        with db_snapshot(sources[0]) as conn:
+            rows, files = export_analytics_listings(iter_listings(conn, ANALYTICS_LISTINGS_ORDER), root, fmt)
+    else:
+        listings = sorted(_read_sources(sources)[0], key=lambda l: ((l.created_at or '')[:10], l.site or ''))
+        rows, files = export_analytics_listings(listings, root, fmt)
+    print(f"  -> {root}/listings/ : {rows} annonces, {files} fichiers")
+
+    days, rows, files = export_analytics_history(args.history_dir, root, fmt)
+    print(f"  -> {root}/history/ : {days} jours exportés ({rows} lignes, {files} fichiers)")
+
+
+def cmd_serve(args):
+    """Servir le dashboard (ETag, 304, variantes .gz/.br, Range)"""
+    server = make_dashboard_server(args.output_dir, args.host, args.port, args.verbose)
+    print(f"Dashboard servi sur http://{args.host}:{server.server_address[1]}/ (Ctrl+C pour arrêter)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def cmd_loadtest(args):
+    """Test de charge HTTP (serveur intégré ou autre)"""
+    result = run_load_test(args.url, args.requests, args.concurrency, args.revalidate, args.accept_encoding)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+        return
+    print(f"{result['requests']} requêtes en {result['seconds']} s : {result['rps']} req/s")
+    print(f"  latence p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, max {result['max_ms']} ms")
+    print(f"  {result['bytes'] / 1e6:.1f} Mo reçus, statuts {result['statuses']}")
+
+
+def cmd_verify(args):
+    """Vérification : sorties identiques à la référence, pas de régression de temps"""
+    db_path = args.fixture or resolve_db_sources(args.db)[0]
+    baseline_path = args.baseline or config_value('VERIFY_BASELINE_PATH', VERIFY_BASELINE_FILE)
+    threshold = args.threshold if args.threshold is not None else float(
+        config_value('VERIFY_THRESHOLD') or VERIFY_THRESHOLD)
+    report = verify_pipelines(db_path, baseline_path, threshold, args.repeat, args.update_baseline)
+    if args.json:
+        print(json_dumps(report))
+    else:
+        print(f"Vérification sur {db_path} ({report['listings']} annonces, meilleur de {args.repeat}, "
+              f"JSON {json_backend()})")
+        print(f"  {'étape':<10} {'référence':>10} {'optimisé':>10} {'baseline':>10}")
+        for stage, t in report['timings'].items():
+            baseline = f"{t['baseline'] * 1000:8.1f}ms" if 'baseline' in t else f"{'-':>10}"
+            flags = []
+            if stage in report['slower_than_reference']:
+                # Indicatif : seule la baseline fait échouer la vérification
+                flags.append(f"⚠️  {t['optimized'] / t['reference']:.1f}× la référence" if t['reference']
+                             else "⚠️  plus lent que la référence")
+            if stage in report['slower_than_baseline']:
+                flags.append("❌ plus lent que la baseline")
+            flag = '  ' + ', '.join(flags) if flags else ''
+            print(f"  {stage:<10} {t['reference'] * 1000:8.1f}ms {t['optimized'] * 1000:8.1f}ms {baseline}{flag}")
+        for filename, found in report['diffs'].items():
+            print(f"  ❌ {filename} diffère de la référence :")
+            for line in found:
+                print(f"     {line}")
+        if report['baseline_missing']:
+            print(f"  ❌ Pas de baseline dans {baseline_path} : la créer avec --update-baseline")
+        if report['baseline_updated']:
+            print(f"  -> {baseline_path} mis à jour")
+        if report['ok']:
+            print("✅ Sorties identiques, aucune étape hors seuil")
+        else:
+            print(f"❌ Vérification échouée (seuil de ralentissement {threshold:.0%})")
+    if not report['ok']:
+        sys.exit(1)
+
+
+def cmd_bench(args):
+    """Micro-benchmarks"""
+    benchmark_json(args.json_listings)
+    print("Benchmark mémoire des annonces :")
+    benchmark_listing_memory(args.memory_listings)
+    benchmark_images(args.images)
+
+
+COMMANDS = {
+    'export': cmd_export,
+    'images': cmd_images,
+    'stats': cmd_stats,
+    'analytics': cmd_analytics,
+    'serve': cmd_serve,
+    'loadtest': cmd_loadtest,
+    'verify': cmd_verify,
+    'bench': cmd_bench,
+}
+
+
+def build_arg_parser():
+    """Parser de la ligne de commande (une sous-commande par job)"""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='dashboard_generator.py',
+        description="Générateur de données du dashboard ImmoLux (sans sous-commande : export)")
+    parser.add_argument('--db', action='append',
+                        help="Base SQLite des annonces ; répétable, motifs glob acceptés "
+                             "(défaut: LISTINGS_DB_SOURCES ou listings.db)")
+    sub = parser.add_subparsers(dest='command')
+
+    p_export = sub.add_parser('export', help="Build complet des données du dashboard")
+    p_export.add_argument('--output-dir', default='dashboards', help="Dossier du dashboard (défaut: dashboards)")
+    p_export.add_argument('--no-images', action='store_true', help="Ne pas traiter les images")
+    p_export.add_argument('--image-budget', type=float, help="Budget en secondes de l'étape images")
+    p_export.add_argument('--profiles', help="Fichier de profils (défaut: BUILD_PROFILES)")
+    p_export.add_argument('--exporters', help='Sorties actives, ex. "+market-stats,-history"')
+
+    p_images = sub.add_parser('images', help="Télécharger/compresser les images uniquement")
+    p_images.add_argument('--output-dir', default='dashboards', help="Dossier du dashboard (défaut: dashboards)")
+    p_images.add_argument('--image-budget', type=float, help="Budget en secondes")
+    p_images.add_argument('--gc-dry-run', action='store_true', help="Nettoyage en mode rapport seulement")
+
+    p_stats = sub.add_parser('stats', help="Mettre à jour les agrégats et afficher les statistiques")
+    p_stats.add_argument('--json', action='store_true', help="Sortie JSON")
+    p_stats.add_argument('--output-dir', default='dashboards', help="Dossier du dashboard, verrou de build (défaut: dashboards)")
+
+    p_analytics = sub.add_parser('analytics', help="Export Parquet/Arrow/CSV partitionné par date et site")
+    p_analytics.add_argument('--format', choices=ANALYTICS_FORMATS,
+                             help="Format (défaut: parquet si pyarrow est installé, sinon csv)")
+    p_analytics.add_argument('--output-dir', help="Dossier de sortie (défaut: ANALYTICS_DIR ou analytics)")
+    p_analytics.add_argument('--history-dir', default=os.path.join('dashboards', 'data', 'history'),
+                             help="Archives quotidiennes (défaut: dashboards/data/history)")
+    p_analytics.add_argument('--dashboards-dir', default='dashboards',
+                             help="Dossier du dashboard, verrou de build (défaut: dashboards)")
+
+    p_serve = sub.add_parser('serve', help="Serveur HTTP du dashboard (ETag, gzip/brotli, Range)")
+    p_serve.add_argument('--output-dir', default='dashboards', help="Dossier servi (défaut: dashboards)")
+    p_serve.add_argument('--host', default='127.0.0.1', help="Adresse d'écoute (défaut: 127.0.0.1)")
+    p_serve.add_argument('--port', type=int, default=SERVE_PORT, help=f"Port (défaut: {SERVE_PORT})")
+    p_serve.add_argument('--verbose', action='store_true', help="Journal des requêtes")
+
+    p_load = sub.add_parser('loadtest', help="Test de charge HTTP")
+    p_load.add_argument('--url', default=f'http://127.0.0.1:{SERVE_PORT}/data/listings.js', help="URL testée")
+    p_load.add_argument('--requests', type=int, default=2000, help="Nombre total de requêtes (défaut: 2000)")
+    p_load.add_argument('--concurrency', type=int, default=8, help="Connexions simultanées (défaut: 8)")
+    p_load.add_argument('--revalidate', action='store_true', help="Renvoyer l'ETag reçu (chemin 304)")
+    p_load.add_argument('--accept-encoding', help='En-tête Accept-Encoding, ex. "gzip, br"')
+    p_load.add_argument('--json', action='store_true', help="Sortie JSON")
+
+    p_verify = sub.add_parser('verify', help="Comparer le pipeline optimisé à la référence (sorties + temps)")
+    p_verify.add_argument('--fixture', help="Base de test (défaut: première base de --db)")
+    p_verify.add_argument('--baseline', help=f"Temps de référence par étape (défaut: VERIFY_BASELINE_PATH "
+                                             f"ou {VERIFY_BASELINE_FILE})")
+    p_verify.add_argument('--threshold', type=float,
+                          help=f"Ralentissement toléré, ex. 0.25 = 25%% (défaut: VERIFY_THRESHOLD ou {VERIFY_THRESHOLD})")
+    p_verify.add_argument('--repeat', type=int, default=3, help="Exécutions par pipeline, meilleur temps (défaut: 3)")
+    p_verify.add_argument('--update-baseline', action='store_true',
+                          help="Enregistrer les temps du pipeline optimisé comme baseline "
+                               "(si sorties identiques)")
+    p_verify.add_argument('--json', action='store_true', help="Sortie JSON")
+
+    p_bench = sub.add_parser('bench', help="Micro-benchmarks")
+    p_bench.add_argument('--json-listings', type=int, default=100000,
+                         help="Nombre d'annonces du benchmark JSON (défaut: 100000)")
+    p_bench.add_argument('--memory-listings', type=int, default=100000,
+                         help="Nombre d'annonces du benchmark mémoire (défaut: 100000)")
+    p_bench.add_argument('--images', type=int, default=20,
+                         help="Nombre d'images du benchmark de compression (défaut: 20)")
+    return parser
+
+
+def main(argv=None):
+    """Point d'entree principal"""
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser = build_arg_parser()
+    # Sans sous-commande : export (compatibilité avec "python dashboard_generator.py"),
+    # inséré après les options globales pour que "--no-images" & co restent valides
+    i = 0
+    while i < len(argv) and (argv[i] == '--db' or argv[i].startswith('--db=')):
+        i += 2 if argv[i] == '--db' else 1
+    if i >= len(argv) or argv[i] not in COMMANDS and argv[i] not in ('-h', '--help'):
+        argv = argv[:i] + ['export'] + argv[i:]
+    args = parser.parse_args(argv)
+    load_config()
+    return COMMANDS[args.command](args)
+
+
 # Aliases pour compatibilité avec tests
 calculate_price_anomalies = calc_anomalies
 